@@ -17,4 +17,31 @@ def extract(img: np.ndarray, use_texture=False) -> np.ndarray:
 
     # Kết hợp thành vector 6 chiều (cân trọng số nếu cần)
     feature = np.concatenate([mean_color, std_color]) 
-    return feature.astype(np.float32)
\ No newline at end of file
+    return feature.astype(np.float32)
+
+def extract_batch(imgs: np.ndarray, use_texture=False) -> np.ndarray:
+    """
+    Như extract() nhưng cho cả lô ảnh cùng kích thước (N, h, w, 3) -> (N, 3) hoặc (N, 6).
+    Tổng theo từng kênh được tính bằng 1 phép nhân ma trận (BLAS) với ma trận chọn kênh,
+    nhanh hơn nhiều so với np.mean trên trục không liên tiếp.
+    """
+    if imgs is None:
+        raise ValueError("Images is None")
+
+    n, channels = imgs.shape[0], imgs.shape[-1]
+    count = int(np.prod(imgs.shape[1:-1]))
+    # float32 vẫn cộng chính xác tuyệt đối khi tổng < 2^24; bình phương (texture) cần float64
+    dtype = np.float32 if (not use_texture and count * 255 < (1 << 24)) else np.float64
+    flat = imgs.reshape(n, count * channels).astype(dtype)
+    pick = np.tile(np.eye(channels, dtype=dtype), (count, 1)) # (h*w*3, 3): cộng các pixel cùng kênh
+
+    mean_color = (flat @ pick).astype(np.float64) / count # (N, 3)
+
+    if not use_texture:
+        return mean_color.astype(np.float32)
+
+    flat *= flat
+    var = flat @ pick / count - mean_color * mean_color
+    std_color = np.sqrt(np.maximum(var, 0.0)) # (N, 3)
+    feature = np.concatenate([mean_color, std_color], axis=1)
+    return feature.astype(np.float32)
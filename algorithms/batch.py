@@ -0,0 +1,180 @@
+import os
+import glob
+import time
+import concurrent.futures
+from typing import Callable, Dict, List, Optional
+
+import cv2
+
+from algorithms.multiresolution import (
+    build_tiles_db, render_mosaic, level_sizes, _list_image_files
+)
+from algorithms.streaming import stream_mosaic, STREAM_FORMATS
+from algorithms.deepzoom import save_deepzoom
+from algorithms import tile_cache
+
+# tiles_db dùng chung trong mỗi worker process (gán 1 lần bởi _init_worker)
+_worker_db = None
+_worker_sizes = None
+# Số thread ghép mỗi ảnh trong worker (1 khi đã song song theo process, tránh tranh CPU)
+_worker_threads = None
+
+def expand_targets(patterns: List[str]) -> List[str]:
+    """
+    Chuyển danh sách đầu vào thành danh sách file ảnh gốc:
+    file ảnh, thư mục (lấy mọi ảnh bên trong), glob ("imgs/*.jpg")
+    hoặc file .txt liệt kê mỗi dòng 1 đường dẫn.
+    """
+    targets = []
+    for pat in patterns:
+        if os.path.isdir(pat):
+            targets.extend(sorted(_list_image_files(pat)))
+        elif pat.lower().endswith(".txt") and os.path.isfile(pat):
+            with open(pat, encoding="utf-8") as f:
+                targets.extend(line.strip() for line in f if line.strip())
+        elif os.path.isfile(pat):
+            targets.append(pat)
+        else:
+            targets.extend(sorted(glob.glob(pat, recursive=True)))
+
+    # Bỏ trùng nhưng giữ thứ tự
+    seen = set()
+    unique = []
+    for t in targets:
+        key = os.path.abspath(t)
+        if key not in seen:
+            seen.add(key)
+            unique.append(t)
+    return unique
+
+def output_path_for(target_path: str, out_dir: str, ext: str = ".jpg") -> str:
+    stem = os.path.splitext(os.path.basename(target_path))[0]
+    return os.path.join(out_dir, f"{stem}_mosaic{ext}")
+
+def _init_worker(tiles_db, sizes, threads=None):
+    global _worker_db, _worker_sizes, _worker_threads
+    # Atlas memmap được gửi dưới dạng đường dẫn (xem tile_cache.portable_tiles) -> mở lại chỉ đọc
+    _worker_db = {sz: (tile_cache.open_tiles(t), index) for sz, (t, index) in tiles_db.items()}
+    _worker_sizes = sizes
+    _worker_threads = threads
+
+def _stream_one(target_path: str, out_path: str, blend_factor: float, strip_rows: Optional[int]) -> Dict:
+    """Như _render_one nhưng ghép và ghi theo từng dải (xem stream_mosaic)."""
+    t0 = time.perf_counter()
+    h, w = stream_mosaic(target_path, _worker_db, _worker_sizes, out_path, blend_factor, strip_rows,
+                         workers=_worker_threads)
+    total = time.perf_counter() - t0
+    return {"read_s": 0.0, "render_s": total, "write_s": 0.0, "total_s": total, "shape": [h, w]}
+
+def _render_one(target_path: str, out_path: str, blend_factor: float,
+                stream: bool = False, strip_rows: Optional[int] = None) -> Dict:
+    """Ghép 1 ảnh với tiles_db của worker và ghi ra đĩa. Trả về thống kê thời gian."""
+    if stream:
+        return _stream_one(target_path, out_path, blend_factor, strip_rows)
+
+    t0 = time.perf_counter()
+    target = cv2.imread(target_path)
+    if target is None:
+        raise Exception(f"Lỗi đọc ảnh gốc: {target_path}")
+    t1 = time.perf_counter()
+
+    mosaic = render_mosaic(target, _worker_db, _worker_sizes, blend_factor, workers=_worker_threads)
+    t2 = time.perf_counter()
+
+    if out_path.lower().endswith(".dzi"):
+        # Kim tự tháp Deep Zoom: mã hóa theo từng ô thay vì 1 file lớn
+        save_deepzoom(mosaic, out_path, workers=_worker_threads)
+    else:
+        success, buf = cv2.imencode(os.path.splitext(out_path)[1], mosaic)
+        if not success:
+            raise Exception(f"Không thể mã hóa ảnh: {out_path}")
+        with open(out_path, "wb") as f:
+            buf.tofile(f)
+    t3 = time.perf_counter()
+
+    return {
+        "read_s": t1 - t0,
+        "render_s": t2 - t1,
+        "write_s": t3 - t2,
+        "total_s": t3 - t0,
+        "shape": list(target.shape[:2]),
+    }
+
+def run_batch(targets: List[str], tiles_folder: str, out_dir: str,
+              base_tile: int = 15, levels: int = 3, blend_factor: float = 0.2,
+              workers: int = 1, ext: str = ".jpg", use_cache: bool = True,
+              stream: bool = False, strip_rows: Optional[int] = None,
+              index: str = "kdtree",
+              progress_callback: Callable[[float, str], None] = lambda p, m: None,
+              result_callback: Optional[Callable[[Dict], None]] = None,
+              use_texture: Optional[bool] = None) -> List[Dict]:
+    """
+    Ghép tranh hàng loạt: nạp + dựng chỉ mục kho tiles 1 lần rồi render mọi ảnh gốc.
+    workers > 1: dùng process pool, mỗi worker nhận tiles_db 1 lần khi khởi tạo
+    (fork: chia sẻ copy-on-write, spawn: pickle 1 lần / worker).
+    stream=True: ghép + ghi theo dải cho ảnh rất lớn (ext phải là .npy, .ppm hoặc .dzi).
+    ext=".dzi": ghi kim tự tháp ô Deep Zoom (xem deepzoom.DeepZoomWriter).
+    index: loại chỉ mục tìm tile ("kdtree" / "lut"), xem build_tiles_db.
+    use_texture: khớp cả vân (đặc trưng 6 chiều), None = theo multiresolution.USE_TEXTURE.
+    Trả về danh sách kết quả {target, output, ok, error, *_s} theo thứ tự hoàn thành.
+    """
+    if stream and ext not in STREAM_FORMATS:
+        raise ValueError(f"Chế độ streaming chỉ ghi được {', '.join(STREAM_FORMATS)}")
+    if not targets:
+        raise Exception("Không có ảnh gốc nào để xử lý!")
+    os.makedirs(out_dir, exist_ok=True)
+
+    sizes = level_sizes(base_tile, levels)
+    t0 = time.perf_counter()
+    tiles_db = build_tiles_db(tiles_folder, sizes, progress_callback, use_cache=use_cache, index=index,
+                              use_texture=use_texture)
+    load_s = time.perf_counter() - t0
+    progress_callback(0, f"Đã nạp kho tiles ({len(tiles_db[sizes[0]][0])} ảnh) trong {load_s:.2f}s")
+
+    results = []
+    total = len(targets)
+
+    def _collect(target, out_path, stats=None, error=None):
+        res = {"target": target, "output": out_path, "ok": error is None, "error": error}
+        if stats:
+            res.update(stats)
+        results.append(res)
+        if result_callback:
+            result_callback(res)
+        progress_callback(len(results) / total * 100, f"{len(results)}/{total}: {os.path.basename(target)}")
+
+    # Ảnh trùng tên ở các thư mục khác nhau -> thêm hậu tố để không ghi đè nhau
+    jobs = []
+    used = set()
+    for t in targets:
+        out_path = output_path_for(t, out_dir, ext)
+        base, n = os.path.splitext(out_path)[0], 2
+        while out_path in used:
+            out_path = f"{base}_{n}{ext}"
+            n += 1
+        used.add(out_path)
+        jobs.append((t, out_path))
+
+    if workers <= 1:
+        _init_worker(tiles_db, sizes)
+        for target, out_path in jobs:
+            try:
+                _collect(target, out_path, _render_one(target, out_path, blend_factor, stream, strip_rows))
+            except Exception as e:
+                _collect(target, out_path, error=str(e))
+        return results
+
+    # Worker chỉ nhận đường dẫn atlas, mọi process memory-map chung 1 file thay vì mỗi process 1 bản sao tiles
+    shared_db = {sz: (tile_cache.portable_tiles(t), index) for sz, (t, index) in tiles_db.items()}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(shared_db, sizes, 1)) as executor:
+        futures = {executor.submit(_render_one, t, o, blend_factor, stream, strip_rows): (t, o)
+                   for t, o in jobs}
+        for fut in concurrent.futures.as_completed(futures):
+            target, out_path = futures[fut]
+            try:
+                _collect(target, out_path, fut.result())
+            except Exception as e:
+                _collect(target, out_path, error=str(e))
+
+    return results
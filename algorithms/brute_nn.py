@@ -0,0 +1,85 @@
+import numpy as np
+from typing import Tuple
+
+# Số phần tử tối đa của ma trận khoảng cách tạm (truy vấn x điểm) mỗi lô (~16MB float32)
+BRUTE_BLOCK = 1 << 22
+
+# Số ứng viên dư được tính lại chính xác sau bước nhân ma trận (bù sai số làm tròn float32)
+RERANK_EXTRA = 4
+
+class BruteForceNN:
+    """
+    Tìm láng giềng gần nhất bằng quét toàn bộ, số chiều bất kỳ.
+    ‖a - b‖² = ‖a‖² - 2a·b + ‖b‖²: phần a·b của cả lô truy vấn là 1 phép nhân ma trận (BLAS),
+    nhanh hơn cây khi kho nhỏ, số chiều cao (cây cắt tỉa kém) hoặc lô truy vấn lớn.
+    Công thức khai triển bị sai số làm tròn khi 2 ứng viên gần bằng nhau, nên vài ứng viên tốt nhất
+    được tính lại trực tiếp bằng hiệu (a - b) -> kết quả khớp quét trực tiếp.
+    """
+
+    def __init__(self, points: np.ndarray):
+        pts = np.asarray(points, dtype=np.float32)
+        if pts.ndim != 2 or pts.shape[0] == 0:
+            raise ValueError("points phải là mảng 2D (N, k)")
+        self.points = np.ascontiguousarray(pts)
+        self.n, self.k = pts.shape
+        # Ma trận mở rộng [-2Pᵀ; ‖b‖²]: [q, 1] @ _points_aug = ‖q - b‖² - ‖q‖² trong 1 phép nhân
+        sq = np.einsum('ij,ij->i', self.points, self.points)
+        self._points_aug = np.ascontiguousarray(np.vstack([-2 * self.points.T, sq[None, :]]))
+
+    def _candidates(self, q: np.ndarray, c: int) -> np.ndarray:
+        """c chỉ số ứng viên tốt nhất (chưa sắp) cho mỗi truy vấn theo khoảng cách khai triển."""
+        q_aug = np.empty((len(q), self.k + 1), dtype=np.float32)
+        q_aug[:, :-1] = q
+        q_aug[:, -1] = 1
+        d2 = q_aug @ self._points_aug
+        if c >= self.n:
+            return np.broadcast_to(np.arange(self.n), d2.shape)
+        if c == 1:
+            return np.argmin(d2, axis=1)[:, None]
+        return np.argpartition(d2, c - 1, axis=1)[:, :c]
+
+    def query_k_batch(self, points, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """k điểm gần nhất cho mỗi truy vấn. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần."""
+        k = int(k)
+        if k < 1:
+            raise ValueError("k phải >= 1")
+        k = min(k, self.n)
+        targets = np.asarray(points, dtype=np.float32).reshape(-1, self.k)
+        m = targets.shape[0]
+        c = min(self.n, k + RERANK_EXTRA)
+
+        dists = np.empty((m, k), dtype=np.float32)
+        idxs = np.empty((m, k), dtype=np.int64)
+        step = max(1, BRUTE_BLOCK // self.n)
+        for s in range(0, m, step):
+            q = targets[s:s + step]
+            cand = self._candidates(q, c)
+            # Tính lại chính xác cho các ứng viên, sắp theo (khoảng cách, chỉ số)
+            diff = q[:, None, :] - self.points[cand]
+            d2 = np.einsum('qck,qck->qc', diff, diff)
+            order = _order_rows(d2, cand)[:, :k]
+            dists[s:s + step] = np.sqrt(np.take_along_axis(d2, order, axis=1))
+            idxs[s:s + step] = np.take_along_axis(cand, order, axis=1)
+        return dists, idxs
+
+    def query_batch(self, points, visit_counts=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Truy vấn nhiều điểm cùng lúc. Trả về (dists, idxs), mỗi mảng shape (M,).
+        visit_counts (dict, tùy chọn): "nodes" = 0, "leaves" = 1 cho mọi truy vấn (1 lần quét toàn bộ).
+        """
+        d, i = self.query_k_batch(points, 1)
+        if visit_counts is not None:
+            visit_counts["nodes"] = np.zeros(len(i), dtype=np.int64)
+            visit_counts["leaves"] = np.ones(len(i), dtype=np.int64)
+        return d[:, 0], i[:, 0]
+
+    def query(self, point) -> Tuple[float, int]:
+        """Trả về (distance, index) của điểm gần nhất."""
+        d, i = self.query_batch(np.asarray(point, dtype=np.float32).reshape(1, -1))
+        return float(d[0]), int(i[0])
+
+def _order_rows(d2: np.ndarray, cand: np.ndarray) -> np.ndarray:
+    """Thứ tự cột mỗi hàng theo d2 tăng dần, bằng nhau thì chỉ số nhỏ trước."""
+    order = np.argsort(cand, axis=1, kind="stable")
+    by_d2 = np.argsort(np.take_along_axis(d2, order, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(order, by_d2, axis=1)
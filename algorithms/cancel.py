@@ -0,0 +1,33 @@
+import threading
+from typing import Callable
+
+class MosaicCancelled(Exception):
+    """Công việc bị hủy qua CancelToken (không phải lỗi)."""
+
+class CancelToken:
+    """
+    Cờ hủy dùng chung giữa thread điều khiển (giao diện) và thread đang xử lý.
+    Bên xử lý gọi check() ở các điểm dừng an toàn (hoặc bọc progress_callback bằng wrap()),
+    bên điều khiển gọi cancel().
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise MosaicCancelled("Đã hủy.")
+
+    def wrap(self, callback: Callable) -> Callable:
+        """Callback kiểm tra cờ hủy trước mỗi lần gọi -> hủy được ở mọi chỗ đang báo tiến độ."""
+        def _wrapped(*args, **kwargs):
+            self.check()
+            return callback(*args, **kwargs)
+        return _wrapped
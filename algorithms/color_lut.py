@@ -0,0 +1,231 @@
+import threading
+import numpy as np
+from typing import Dict, Optional
+
+from algorithms.kdtree_module import FlatKDTree
+
+# Mặc định: lưới 32 x 32 x 32 ô màu (mỗi ô rộng 8 mức), 8 ứng viên / ô
+LUT_BITS = 5
+LUT_CANDIDATES = 8
+
+# Số phần tử tối đa của ma trận khoảng cách tạm khi dựng bảng (giới hạn RAM)
+_BUILD_BLOCK = 1 << 22
+
+# Số truy vấn mỗi lô khi chấm lại ứng viên
+_QUERY_CHUNK = 1 << 16
+
+# Số khối mỗi cạnh lưới khi dựng bảng theo vùng (xem _grid_nearest_k)
+_GROUPS = 8
+
+# Biên an toàn cho sai số làm tròn khi kiểm tra điều kiện chính xác
+_EPS = 1e-3
+
+def _nearest_k(points: np.ndarray, colors: np.ndarray, k: int):
+    """
+    Brute-force vector hóa: k màu gần nhất cho mỗi điểm.
+    Trả về (idx int32 (P, k), dist_k float64 (P,)) với dist_k = khoảng cách xa nhất trong k ứng viên.
+    """
+    n = len(colors)
+    cols = colors.astype(np.float64)
+    col_sq = (cols * cols).sum(axis=1)
+
+    idx = np.empty((len(points), k), dtype=np.int32)
+    dist_k = np.empty(len(points), dtype=np.float64)
+    chunk = max(1, _BUILD_BLOCK // n)
+    for s in range(0, len(points), chunk):
+        p = points[s:s + chunk]
+        # |p - c|^2 = |p|^2 + |c|^2 - 2 p.c  (1 phép nhân ma trận BLAS cho cả lô)
+        d2 = (p * p).sum(axis=1)[:, None] + col_sq[None, :] - 2.0 * (p @ cols.T)
+        if k < n:
+            part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        else:
+            part = np.broadcast_to(np.arange(n), (len(p), n))
+        rows = np.arange(len(p))[:, None]
+        idx[s:s + chunk] = part
+        dist_k[s:s + chunk] = np.sqrt(np.maximum(d2[rows, part].max(axis=1), 0.0))
+    return idx, dist_k
+
+def _grid_nearest_k(cells: int, width: float, colors: np.ndarray, k: int):
+    """
+    k tile gần tâm mỗi ô nhất cho toàn lưới cells^3, không phải so mọi tâm với mọi tile:
+    tâm ô được gom thành _GROUPS^3 khối; mỗi khối chỉ brute-force với các tile nằm trong khối
+    nới rộng thêm `margin` ô. Kết quả đúng nếu ứng viên xa nhất không xa hơn mặt biên của
+    vùng đã xét (tile ngoài vùng chắc chắn xa hơn); tâm nào chưa thỏa thì nới gấp đôi margin.
+    Trả về (table int32 (cells^3, k), radius float64 (cells^3,)) theo thứ tự ô (b, g, r).
+    """
+    group = max(1, cells // _GROUPS)
+    tile_cell = np.clip((colors * (1.0 / width)).astype(np.int64), 0, cells - 1)
+
+    table = np.empty((cells, cells, cells, k), dtype=np.int32)
+    radius = np.empty((cells, cells, cells), dtype=np.float64)
+
+    offs = np.stack(np.meshgrid(*[np.arange(group)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    for lo in np.stack(np.meshgrid(*[np.arange(0, cells, group)] * 3, indexing="ij"), axis=-1).reshape(-1, 3):
+        cell_xyz = lo + offs
+        centers = (cell_xyz + 0.5) * width
+        pending = np.arange(len(centers))
+        margin = 1
+        while pending.size:
+            box_lo = np.maximum(lo - margin, 0)
+            box_hi = np.minimum(lo + group + margin, cells)
+            inside = np.all((tile_cell >= box_lo) & (tile_cell < box_hi), axis=1)
+            sub = np.flatnonzero(inside)
+
+            c = centers[pending]
+            # Khoảng cách tới mặt biên của vùng (mặt trùng biên không gian màu không tính)
+            to_lo = np.where(box_lo > 0, c - box_lo * width, np.inf)
+            to_hi = np.where(box_hi < cells, box_hi * width - c, np.inf)
+            bound = np.minimum(to_lo, to_hi).min(axis=1)
+
+            if sub.size >= k:
+                part, dist_k = _nearest_k(c, colors[sub], k)
+                done = dist_k <= bound
+                x, y, z = cell_xyz[pending[done]].T
+                table[x, y, z] = sub[part[done]]
+                radius[x, y, z] = dist_k[done]
+                pending = pending[~done]
+            margin *= 2
+
+    return table.reshape(-1, k), radius.reshape(-1)
+
+class ColorLUTIndex:
+    """
+    Chỉ mục tra bảng cho đặc trưng màu trung bình 3 chiều (BGR 8-bit).
+    Không gian màu được chia thành lưới (2^bits)^3 ô; mỗi ô lưu sẵn `candidates` tile
+    gần tâm ô nhất và khoảng cách tới ứng viên xa nhất (radius).
+
+    Truy vấn = 1 lần gather theo ô + chấm lại chính xác vài ứng viên. Kết quả chắc chắn đúng
+    khi |q - best| + |q - tâm ô| < radius (mọi tile gần q hơn best đều nằm trong danh sách);
+    số ít truy vấn không thỏa điều kiện được chuyển sang KD-Tree -> luôn cho đúng láng giềng gần nhất.
+    KD-Tree dự phòng chỉ được dựng ở lần đầu cần đến (truy vấn trượt bảng / query_k_batch): lần chạy
+    dùng bảng từ cache (from_arrays) mà mọi truy vấn đều trúng bảng không tốn chi phí dựng cây.
+    Cùng giao diện với KDTreeNearestNeighbor: query, query_batch, query_k_batch, colors.
+    """
+
+    def __init__(self, colors_arr: np.ndarray, bits: int = LUT_BITS, candidates: int = LUT_CANDIDATES,
+                 tables: Optional[Dict[str, np.ndarray]] = None):
+        if colors_arr is None:
+            raise ValueError("colors_arr is None")
+
+        colors_arr = np.asarray(colors_arr, dtype=np.float32)
+        if colors_arr.ndim != 2 or colors_arr.shape[1] != 3 or colors_arr.shape[0] == 0:
+            raise ValueError("colors_arr phải có shape (N, 3) và N > 0")
+        if not 1 <= bits <= 8:
+            raise ValueError("bits phải nằm trong khoảng 1..8")
+        if candidates < 1:
+            raise ValueError("candidates phải >= 1")
+
+        self.colors = colors_arr
+        self.bits = int(bits)
+        self.cells = 1 << self.bits
+        self.width = 256.0 / self.cells
+        # KD-Tree dự phòng cho các truy vấn mà danh sách ứng viên không đảm bảo chính xác (dựng khi cần, xem tree)
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+        if tables is not None:
+            self.table = np.asarray(tables["table"], dtype=np.int32)
+            self.radius = np.asarray(tables["radius"], dtype=np.float64)
+            if self.table.shape[0] != self.cells ** 3 or self.radius.shape != (self.cells ** 3,):
+                raise ValueError("Bảng LUT không khớp với số bits")
+        else:
+            self._build(min(int(candidates), len(self.colors)))
+
+    def _build(self, k: int):
+        self.table, self.radius = _grid_nearest_k(self.cells, self.width, self.colors, k)
+        if k == len(self.colors):
+            # Mọi tile đều là ứng viên -> luôn chính xác
+            self.radius[:] = np.inf
+
+    @property
+    def tree(self) -> FlatKDTree:
+        # Khóa: các thread ghép song song cùng trượt bảng lần đầu chỉ dựng cây 1 lần
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    self._tree = FlatKDTree(self.colors)
+        return self._tree
+
+    def __getstate__(self):
+        # Gửi sang process khác (VD: worker của run_batch): khóa không pickle được
+        state = self.__dict__.copy()
+        del state["_tree_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._tree_lock = threading.Lock()
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Các mảng cần lưu để dựng lại chỉ mục (xem tile_cache.save_lut)."""
+        return {"table": self.table, "radius": self.radius,
+                "bits": np.array(self.bits, dtype=np.int32)}
+
+    @classmethod
+    def from_arrays(cls, colors_arr: np.ndarray, arrays: Dict[str, np.ndarray]) -> "ColorLUTIndex":
+        return cls(colors_arr, bits=int(arrays["bits"]), tables=arrays)
+
+    def _cells_of(self, q: np.ndarray):
+        """Tọa độ ô (M, 3) và chỉ số ô phẳng (M,) của các màu truy vấn."""
+        xyz = np.clip((q * (1.0 / self.width)).astype(np.int64), 0, self.cells - 1)
+        flat = (xyz[:, 0] * self.cells + xyz[:, 1]) * self.cells + xyz[:, 2]
+        return xyz, flat
+
+    def query(self, color: np.ndarray) -> int:
+        color = np.asarray(color, dtype=np.float32).reshape(-1)
+        if color.shape[0] != 3:
+            raise ValueError("color phải có shape (3,)")
+
+        _, idxs = self.query_batch(color[None, :])
+        return int(idxs[0])
+
+    def query_batch(self, colors: np.ndarray, visit_counts=None):
+        """
+        Truy vấn nhiều màu cùng lúc. Trả về (dists, idxs) shape (M,).
+        visit_counts: dict nhận số node / leaf KD-Tree đã duyệt mỗi truy vấn (0 nếu trả lời bằng bảng).
+        """
+        colors = np.asarray(colors, dtype=np.float32)
+        if colors.ndim != 2 or colors.shape[1] != 3:
+            raise ValueError("colors phải có shape (M, 3)")
+
+        m = len(colors)
+        dists = np.empty(m, dtype=np.float32)
+        idxs = np.empty(m, dtype=np.int64)
+        if visit_counts is not None:
+            visit_counts["nodes"] = np.zeros(m, dtype=np.int64)
+            visit_counts["leaves"] = np.zeros(m, dtype=np.int64)
+        for s in range(0, m, _QUERY_CHUNK):
+            q = colors[s:s + _QUERY_CHUNK]
+            rows = np.arange(len(q))
+            xyz, cell = self._cells_of(q)
+
+            # Gather ứng viên của ô rồi chấm lại khoảng cách chính xác
+            cand = self.table[cell] # (M, K)
+            diff = self.colors[cand] - q[:, None, :]
+            d2 = np.einsum("mkc,mkc->mk", diff, diff)
+            j = d2.argmin(axis=1)
+            best = np.sqrt(d2[rows, j])
+            dists[s:s + len(q)] = best
+            idxs[s:s + len(q)] = cand[rows, j]
+
+            # Điều kiện đảm bảo đúng; truy vấn không thỏa -> hỏi KD-Tree
+            to_center = np.linalg.norm(q - (xyz + 0.5) * self.width, axis=1)
+            miss = np.flatnonzero(best + to_center >= self.radius[cell] - _EPS)
+            if miss.size:
+                sub_counts = {} if visit_counts is not None else None
+                d_miss, i_miss = self.tree.query_batch(q[miss], sub_counts)
+                dists[s + miss] = d_miss
+                idxs[s + miss] = i_miss
+                if sub_counts is not None:
+                    visit_counts["nodes"][s + miss] = sub_counts["nodes"]
+                    visit_counts["leaves"][s + miss] = sub_counts["leaves"]
+
+        return dists, idxs
+
+    def query_k_batch(self, colors: np.ndarray, k: int):
+        """k tile gần nhất: bảng chỉ lưu đủ cho láng giềng gần nhất -> dùng KD-Tree dự phòng."""
+        colors = np.asarray(colors, dtype=np.float32)
+        if colors.ndim != 2 or colors.shape[1] != 3:
+            raise ValueError("colors phải có shape (M, 3)")
+
+        return self.tree.query_k_batch(colors, k)
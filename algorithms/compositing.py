@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from typing import Dict, Optional, Tuple
+
+from algorithms.quadtree import BLOCK_X, BLOCK_Y, BLOCK_H, BLOCK_W
+
+def block_view(img: np.ndarray, size: int) -> np.ndarray:
+    """
+    View (không copy) của ảnh dưới dạng lưới các block size x size:
+    shape (H // size, W // size, size, size, C). Ghi vào view là ghi thẳng vào ảnh.
+    Phần dư ở mép phải / dưới (không đủ 1 block) không nằm trong view.
+    """
+    h, w = img.shape[:2]
+    s0, s1 = img.strides[:2]
+    return as_strided(img,
+                      shape=(h // size, w // size, size, size) + img.shape[2:],
+                      strides=(s0 * size, s1 * size, s0, s1) + img.strides[2:],
+                      writeable=True)
+
+def composite_level(mosaic: np.ndarray, blocks: np.ndarray, tiles: np.ndarray, idxs: np.ndarray,
+                    edge_cache: Optional[Dict[Tuple[int, int, int, int], np.ndarray]] = None):
+    """
+    Ghi các tile đã match vào mosaic cho 1 level (mọi block cùng size = tiles.shape[1]).
+    blocks: (M, 5) [x, y, size, h, w] từ plan_quadtree, idxs: (M,) index tile tương ứng.
+
+    - Block đủ kích thước: ghi tất cả trong 1 lần gán fancy-index trên block_view.
+    - Block ở biên (bị cắt): tile được resize về (w, h) như trước, nhưng kết quả được
+      nhớ trong edge_cache theo (size, tile, h, w) để không resize lại cùng 1 tile.
+    """
+    if len(blocks) == 0:
+        return
+    size = int(tiles.shape[1])
+    idxs = np.asarray(idxs, dtype=np.int64)
+
+    full = (blocks[:, BLOCK_H] == size) & (blocks[:, BLOCK_W] == size)
+    if full.all():
+        full_blocks, full_idxs = blocks, idxs
+    else:
+        full_blocks, full_idxs = blocks[full], idxs[full]
+
+    if len(full_blocks):
+        view = block_view(mosaic, size)
+        view[full_blocks[:, BLOCK_Y] // size, full_blocks[:, BLOCK_X] // size] = tiles[full_idxs]
+
+    if full.all():
+        return
+
+    if edge_cache is None:
+        edge_cache = {}
+    for (x, y, _, h_slice, w_slice), idx in zip(blocks[~full].tolist(), idxs[~full].tolist()):
+        key = (size, idx, h_slice, w_slice)
+        tile = edge_cache.get(key)
+        if tile is None:
+            # Resize nhẹ vì kích thước không khớp hoàn toàn (do biên ảnh lẻ)
+            tile = cv2.resize(tiles[idx], (w_slice, h_slice))
+            edge_cache[key] = tile
+        mosaic[y:y+h_slice, x:x+w_slice] = tile
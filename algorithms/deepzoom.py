@@ -0,0 +1,174 @@
+import os
+import math
+import concurrent.futures
+import cv2
+import numpy as np
+from typing import List, Optional
+
+# Thông số chuẩn của Deep Zoom (OpenSeadragon, Zoomify...): ô 254px + 1px chồng lấn -> ô đầy đủ 256px
+DZI_TILE_SIZE = 254
+DZI_OVERLAP = 1
+DZI_FORMAT = "jpg"
+DZI_QUALITY = 90
+
+# Số dòng mỗi lần đẩy ảnh có sẵn trong RAM vào writer (save_deepzoom)
+DZI_FEED_ROWS = 1024
+
+# Số ô đang chờ mã hóa tối đa trên mỗi thread (giới hạn RAM khi mã hóa chậm hơn lúc ghép)
+DZI_PENDING_PER_WORKER = 8
+
+_MANIFEST = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{ts}" Overlap="{ov}" '
+             'Format="{fmt}">\n  <Size Width="{w}" Height="{h}"/>\n</Image>\n')
+
+def _encode_tile(path: str, tile: np.ndarray, ext: str, params: List[int]):
+    """Mã hóa 1 ô rồi ghi file (imencode + ghi bytes -> đường dẫn Unicode trên Windows vẫn ghi được)."""
+    success, buf = cv2.imencode(ext, tile, params)
+    if not success:
+        raise Exception(f"Không thể mã hóa ô: {path}")
+    with open(path, "wb") as f:
+        buf.tofile(f)
+
+class _Level:
+    """Trạng thái ghi của 1 level trong kim tự tháp."""
+
+    def __init__(self, level: int, h: int, w: int, channels: int):
+        self.level = level
+        self.h, self.w = h, w
+        self.buf = np.zeros((0, w, channels), dtype=np.uint8) # Các dòng chưa ghi xong, bắt đầu từ dòng buf_y0
+        self.buf_y0 = 0
+        self.received = 0
+        self.next_row = 0 # Hàng ô kế tiếp cần ghi
+        self.carry = np.zeros((0, w, channels), dtype=np.uint8) # Dòng lẻ chờ ghép cặp khi thu nhỏ
+
+class DeepZoomWriter:
+    """
+    Ghi ảnh thành kim tự tháp ô Deep Zoom (DZI): file `<tên>.dzi` (XML) + thư mục `<tên>_files/<level>/<cột>_<hàng>.jpg`.
+    Nhận ảnh theo từng dải ngang từ trên xuống (cùng giao diện write(y0, strip) / close() với các
+    StripWriter của streaming) -> ảnh độ phân giải đầy đủ không bao giờ phải mã hóa 1 lần.
+    Mỗi level nhỏ hơn được thu nhỏ 1/2 (INTER_AREA) từ level ngay trên theo từng cặp dòng;
+    mỗi level chỉ giữ các dòng của hàng ô đang dở -> RAM tỉ lệ với chiều rộng ảnh, không phải diện tích.
+    Các ô được mã hóa song song trên thread pool (cv2.imencode nhả GIL).
+    File .dzi chỉ được ghi ở close() khi đã nhận đủ mọi dòng -> có file .dzi là có kim tự tháp đầy đủ.
+    """
+
+    def __init__(self, path: str, h: int, w: int,
+                 tile_size: int = DZI_TILE_SIZE, overlap: int = DZI_OVERLAP,
+                 fmt: str = DZI_FORMAT, quality: int = DZI_QUALITY,
+                 workers: Optional[int] = None):
+        if h <= 0 or w <= 0:
+            raise ValueError("Kích thước ảnh phải > 0")
+        if tile_size <= 0 or overlap < 0:
+            raise ValueError("tile_size phải > 0 và overlap phải >= 0")
+        if fmt not in ("jpg", "png"):
+            raise ValueError("fmt phải là 'jpg' hoặc 'png'")
+
+        self.path = path
+        self.h, self.w = h, w
+        self.tile_size, self.overlap, self.fmt = tile_size, overlap, fmt
+        self.files_dir = os.path.splitext(path)[0] + "_files"
+        self._ext = "." + fmt
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if fmt == "jpg" else []
+
+        # Level lớn nhất = ceil(log2(cạnh dài)), level 0 là ảnh 1x1
+        self.max_level = math.ceil(math.log2(max(h, w))) if max(h, w) > 1 else 0
+        self._levels = []
+        lh, lw = h, w
+        for level in range(self.max_level, -1, -1):
+            self._levels.append(_Level(level, lh, lw, 3))
+            lh, lw = -(-lh // 2), -(-lw // 2)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+        self._max_pending = max(1, workers) * DZI_PENDING_PER_WORKER
+        self._pending = []
+        self._next_y = 0
+
+    def write(self, y0: int, strip: np.ndarray):
+        if y0 != self._next_y:
+            raise ValueError("DeepZoomWriter chỉ ghi được các dải theo thứ tự từ trên xuống")
+        if strip.shape[1] != self.w:
+            raise ValueError("Dải ảnh phải có cùng chiều rộng với ảnh")
+        self._next_y += strip.shape[0]
+        self._feed(0, np.array(strip, dtype=np.uint8)) # Bản sao: người gọi có thể dùng lại bộ đệm dải
+
+    def _feed(self, li: int, rows: np.ndarray):
+        lv = self._levels[li]
+        lv.buf = np.concatenate([lv.buf, rows]) if len(lv.buf) else rows
+        lv.received += len(rows)
+        self._emit_rows(lv)
+
+        # Thu nhỏ 1/2 theo từng cặp dòng rồi đẩy xuống level kế tiếp
+        if li + 1 < len(self._levels):
+            nxt = self._levels[li + 1]
+            carry = np.concatenate([lv.carry, rows]) if len(lv.carry) else rows
+            n_even = len(carry) // 2 * 2
+            if n_even:
+                self._feed(li + 1, cv2.resize(carry[:n_even], (nxt.w, n_even // 2), interpolation=cv2.INTER_AREA))
+            lv.carry = carry[n_even:].copy()
+
+    def _emit_rows(self, lv: _Level, final: bool = False):
+        """Ghi mọi hàng ô đã đủ dòng (kể cả phần chồng lấn phía dưới) rồi bỏ các dòng không còn cần."""
+        ts, ov = self.tile_size, self.overlap
+        n_rows = -(-lv.h // ts)
+        while lv.next_row < n_rows:
+            r = lv.next_row
+            y_top = max(0, r * ts - ov)
+            y_bot = min(lv.h, (r + 1) * ts + ov)
+            if y_bot > lv.received and not final:
+                break
+            y_bot = min(y_bot, lv.received)
+            level_dir = os.path.join(self.files_dir, str(lv.level))
+            if r == 0:
+                os.makedirs(level_dir, exist_ok=True)
+            band = lv.buf[y_top - lv.buf_y0:y_bot - lv.buf_y0]
+            for c in range(-(-lv.w // ts)):
+                x0 = max(0, c * ts - ov)
+                x1 = min(lv.w, (c + 1) * ts + ov)
+                self._submit(os.path.join(level_dir, f"{c}_{r}{self._ext}"),
+                             np.ascontiguousarray(band[:, x0:x1]))
+            lv.next_row += 1
+
+            # Hàng ô kế tiếp bắt đầu từ dòng (r + 1) * ts - ov
+            drop = max(0, (r + 1) * ts - ov - lv.buf_y0)
+            lv.buf = lv.buf[drop:]
+            lv.buf_y0 += drop
+
+    def _submit(self, path: str, tile: np.ndarray):
+        self._pending.append(self._executor.submit(_encode_tile, path, tile, self._ext, self._params))
+        # Chờ bớt ô cũ nhất khi hàng đợi đầy (đồng thời báo lỗi mã hóa sớm)
+        while len(self._pending) > self._max_pending:
+            self._pending.pop(0).result()
+
+    def close(self):
+        try:
+            complete = self._next_y == self.h
+            if complete:
+                # Đẩy dòng lẻ cuối cùng của mỗi level xuống level kế tiếp, ghi nốt các hàng ô còn lại
+                for li, lv in enumerate(self._levels):
+                    self._emit_rows(lv, final=True)
+                    if li + 1 < len(self._levels) and len(lv.carry):
+                        nxt = self._levels[li + 1]
+                        self._feed(li + 1, cv2.resize(lv.carry, (nxt.w, 1), interpolation=cv2.INTER_AREA))
+                        lv.carry = lv.carry[:0]
+            for fut in self._pending:
+                fut.result()
+            self._pending = []
+        finally:
+            self._executor.shutdown(wait=True)
+
+        if complete:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(_MANIFEST.format(ts=self.tile_size, ov=self.overlap, fmt=self.fmt, w=self.w, h=self.h))
+
+def save_deepzoom(image: np.ndarray, path: str, **kwargs) -> str:
+    """Ghi ảnh đã có trong RAM thành kim tự tháp Deep Zoom (xem DeepZoomWriter). Trả về đường dẫn .dzi."""
+    h, w = image.shape[:2]
+    writer = DeepZoomWriter(path, h, w, **kwargs)
+    try:
+        for y0 in range(0, h, DZI_FEED_ROWS):
+            writer.write(y0, image[y0:y0 + DZI_FEED_ROWS])
+    finally:
+        writer.close()
+    return path
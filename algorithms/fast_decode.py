@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+from typing import Optional, Tuple
+
+# Ảnh sau khi giảm độ phân giải lúc decode phải còn >= REDUCED_MIN_RATIO lần kích thước tile
+# ở cả 2 cạnh -> bước INTER_AREA sau đó vẫn gộp đủ điểm ảnh, không thấy khác biệt chất lượng.
+REDUCED_MIN_RATIO = 2
+
+# Số byte đầu file đọc để tìm kích thước JPEG (đủ cho hầu hết file kể cả có EXIF / thumbnail)
+PROBE_BYTES = 1 << 16
+
+# Cờ imread theo hệ số giảm (libjpeg giảm ngay trong bước IDCT -> decode nhanh hơn ~scale^2 lần)
+_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# Marker SOF (Start Of Frame) chứa kích thước ảnh; C4 (DHT), C8 (JPG), CC (DAC) không phải SOF
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(path: str) -> Optional[Tuple[int, int]]:
+    """
+    (cao, rộng) của file JPEG chỉ từ phần header (không decode).
+    None nếu không phải JPEG hoặc không tìm thấy khung SOF trong PROBE_BYTES byte đầu.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(PROBE_BYTES)
+    except OSError:
+        return None
+    if head[:2] != b"\xff\xd8":
+        return None
+
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xFF: # Byte đệm giữa các marker
+            pos += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01: # Marker không có độ dài
+            pos += 2
+            continue
+        length = (head[pos + 2] << 8) | head[pos + 3]
+        if marker in _SOF_MARKERS:
+            if pos + 9 > len(head):
+                return None
+            h = (head[pos + 5] << 8) | head[pos + 6]
+            w = (head[pos + 7] << 8) | head[pos + 8]
+            return (h, w) if h > 0 and w > 0 else None
+        if marker in (0xD9, 0xDA): # Hết ảnh / bắt đầu dữ liệu nén mà chưa gặp SOF
+            return None
+        pos += 2 + length
+    return None
+
+def decode_scale(size: Optional[Tuple[int, int]], tile_size: int) -> int:
+    """Hệ số giảm lớn nhất (8, 4, 2) mà ảnh kích thước size còn đủ lớn cho tile_size, 1 = decode đầy đủ."""
+    if size is None:
+        return 1
+    short = min(size)
+    for scale in (8, 4, 2):
+        if short // scale >= REDUCED_MIN_RATIO * tile_size:
+            return scale
+    return 1
+
+def read_for_tile(path: str, tile_size: int) -> Optional[np.ndarray]:
+    """
+    Như cv2.imread(path) nhưng với JPEG lớn hơn nhiều so với tile thì decode ở độ phân giải giảm
+    (1/2, 1/4, 1/8, chọn theo header). Decode giảm thất bại -> quay về decode đầy đủ.
+    """
+    scale = decode_scale(jpeg_size(path), tile_size)
+    if scale > 1:
+        img = cv2.imread(path, _REDUCED_FLAGS[scale])
+        if img is not None:
+            return img
+    return cv2.imread(path)
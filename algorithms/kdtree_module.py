@@ -1,3 +1,4 @@
+import heapq
 import numpy as np
 
 class _Node:
@@ -12,6 +13,46 @@ class _Node:
         self.indices = indices           # Danh sách index các điểm (nếu là leaf)
         self.is_leaf = (indices is not None)
 
+def _check_k(k, n):
+    """Số láng giềng thực sự trả về: không vượt quá số điểm trong cây."""
+    k = int(k)
+    if k < 1:
+        raise ValueError("k phải >= 1")
+    return min(k, n)
+
+def _push_k(heap, k, d2, idx):
+    """Thêm (d2, idx) vào max-heap giới hạn k phần tử (lưu -d2 vì heapq là min-heap)."""
+    if len(heap) < k:
+        heapq.heappush(heap, (-d2, idx))
+    elif d2 < -heap[0][0]:
+        heapq.heapreplace(heap, (-d2, idx))
+
+def _heap_result(heap):
+    """Chuyển heap thành (dists, idxs) sắp tăng dần theo khoảng cách."""
+    res = sorted((-nd, i) for nd, i in heap)
+    dists = np.sqrt(np.array([d for d, _ in res], dtype=np.float32))
+    return dists, np.array([i for _, i in res], dtype=np.int64)
+
+def _merge_k(best_d2, best_idx, worst, q, cand_d2, cand_idx):
+    """
+    Gộp ứng viên (Q, L) vào k kết quả tốt nhất hiện tại của các truy vấn q (không trùng nhau).
+    best_d2 / best_idx: (M, k), worst: (M,) khoảng cách bình phương xa nhất trong k (cận để cắt tỉa).
+    """
+    k = best_d2.shape[1]
+    all_d2 = np.concatenate([best_d2[q], cand_d2], axis=1)
+    all_idx = np.concatenate([best_idx[q], cand_idx], axis=1)
+    sel = np.argpartition(all_d2, k - 1, axis=1)[:, :k]
+    new_d2 = np.take_along_axis(all_d2, sel, axis=1)
+    best_d2[q] = new_d2
+    best_idx[q] = np.take_along_axis(all_idx, sel, axis=1)
+    worst[q] = new_d2.max(axis=1)
+
+def _sorted_k(best_d2, best_idx):
+    """Sắp k kết quả của mỗi truy vấn tăng dần theo khoảng cách. Trả về (dists, idxs) (M, k)."""
+    order = np.argsort(best_d2, axis=1, kind="stable")
+    return (np.sqrt(np.take_along_axis(best_d2, order, axis=1)),
+            np.take_along_axis(best_idx, order, axis=1).astype(np.int64))
+
 class KDTree:
     def __init__(self, points: np.ndarray, leaf_size: int = 16):
         pts = np.asarray(points, dtype=np.float32)
@@ -90,12 +131,9 @@ class KDTree:
             # Xử lý Node thường (Pivot)
             p = points[node.location_idx]
             
-            # Tính khoảng cách tới pivot
-            # Unrolled distance cho 3 chiều (nhanh hơn loop/numpy cho 1 điểm)
-            d0 = p[0] - target[0]
-            d1 = p[1] - target[1]
-            d2_ = p[2] - target[2]
-            d2 = d0*d0 + d1*d1 + d2_*d2_
+            # Tính khoảng cách tới pivot (số chiều bất kỳ)
+            dp = p - target
+            d2 = float(dp @ dp)
 
             if d2 < best_d2:
                 best_d2 = d2
@@ -113,4 +151,646 @@ class KDTree:
                 _search(far)
 
         _search(self.root)
-        return float(np.sqrt(best_d2)), int(best_idx)
\ No newline at end of file
+        return float(np.sqrt(best_d2)), int(best_idx)
+
+    def query_batch(self, points, visit_counts=None):
+        """
+        Truy vấn nhiều điểm cùng lúc. Trả về (dists, idxs), mỗi mảng shape (M,).
+        Thay vì duyệt cây riêng cho từng điểm, mỗi node chỉ được thăm cùng với
+        cả nhóm truy vấn cần đi qua nó -> số lần gọi Python tỉ lệ với số node,
+        không phải số truy vấn.
+        visit_counts (dict, tùy chọn): nhận thêm "nodes" / "leaves" (M,) = số node đã thăm
+        và số leaf đã quét của từng truy vấn.
+        """
+        targets = np.asarray(points, dtype=np.float32).reshape(-1, self.k)
+        m = targets.shape[0]
+
+        points = self.points
+        best_d2 = np.full(m, np.inf, dtype=np.float32)
+        best_idx = np.full(m, -1, dtype=np.int64)
+        nodes_seen = np.zeros(m, dtype=np.int64)
+        leaves_seen = np.zeros(m, dtype=np.int64)
+
+        def _scan_leaf(node, q):
+            nodes_seen[q] += 1
+            leaves_seen[q] += 1
+            # Ma trận khoảng cách (Q, L) giữa nhóm truy vấn và các điểm trong leaf
+            diff = targets[q][:, None, :] - points[node.indices][None, :, :]
+            d2_arr = np.einsum('qlk,qlk->ql', diff, diff)
+
+            j = np.argmin(d2_arr, axis=1)
+            min_d2 = d2_arr[np.arange(q.size), j]
+            better = min_d2 < best_d2[q]
+            best_d2[q[better]] = min_d2[better]
+            best_idx[q[better]] = node.indices[j[better]]
+
+        def _visit_pivot(node, q):
+            # Cập nhật best bằng điểm chốt, trả về khoảng cách có dấu tới mặt phẳng chia
+            nodes_seen[q] += 1
+            p = points[node.location_idx]
+            tq = targets[q]
+            diff = tq - p
+            d2 = np.einsum('ij,ij->i', diff, diff)
+
+            better = d2 < best_d2[q]
+            best_d2[q[better]] = d2[better]
+            best_idx[q[better]] = node.location_idx
+            return tq[:, node.axis] - p[node.axis]
+
+        def _descend(node, q):
+            # Pha 1: mỗi truy vấn chỉ đi theo nhánh gần tới leaf -> có ngay cận trên best_d2 tốt
+            if node is None or q.size == 0:
+                return
+            if node.is_leaf:
+                _scan_leaf(node, q)
+                return
+            go_left = _visit_pivot(node, q) < 0
+            _descend(node.left, q[go_left])
+            _descend(node.right, q[~go_left])
+
+        def _search(node, q):
+            # Pha 2: duyệt đầy đủ có cắt tỉa, mỗi node chỉ thăm 1 lần với nhóm truy vấn đã gộp
+            if node is None or q.size == 0:
+                return
+            if node.is_leaf:
+                _scan_leaf(node, q)
+                return
+            diff_axis = _visit_pivot(node, q)
+            go_left = diff_axis < 0
+            da2 = diff_axis * diff_axis
+
+            _search(node.left, q[go_left | (da2 < best_d2[q])])
+            # Tính lại mask sau khi nhánh trái đã làm best_d2 nhỏ đi
+            _search(node.right, q[~go_left | (da2 < best_d2[q])])
+
+        all_q = np.arange(m, dtype=np.int64)
+        _descend(self.root, all_q)
+        _search(self.root, all_q)
+        if visit_counts is not None:
+            visit_counts["nodes"] = nodes_seen
+            visit_counts["leaves"] = leaves_seen
+        return np.sqrt(best_d2), best_idx
+
+    def query_k(self, point, k: int):
+        """
+        Trả về (dists, idxs) của k điểm gần nhất, sắp tăng dần theo khoảng cách.
+        Giữ k kết quả tốt nhất trong max-heap giới hạn; cắt tỉa theo phần tử xa nhất của heap.
+        """
+        target = np.asarray(point, dtype=np.float32).reshape(-1)
+        k = _check_k(k, self.n)
+        points = self.points
+        heap = []
+
+        def _worst():
+            return -heap[0][0] if len(heap) == k else float("inf")
+
+        def _search(node):
+            if node is None:
+                return
+
+            if node.is_leaf:
+                diff = points[node.indices] - target
+                d2_arr = np.einsum('ij,ij->i', diff, diff)
+                # Chỉ đưa vào heap những điểm có thể lọt top-k
+                cand = np.flatnonzero(d2_arr < _worst())
+                if cand.size > k:
+                    cand = cand[np.argpartition(d2_arr[cand], k - 1)[:k]]
+                for j in cand.tolist():
+                    _push_k(heap, k, float(d2_arr[j]), int(node.indices[j]))
+                return
+
+            p = points[node.location_idx]
+            diff = target - p
+            _push_k(heap, k, float(np.dot(diff, diff)), int(node.location_idx))
+
+            diff_axis = float(diff[node.axis])
+            near = node.left if diff_axis < 0 else node.right
+            far = node.right if diff_axis < 0 else node.left
+
+            _search(near)
+            if diff_axis * diff_axis < _worst():
+                _search(far)
+
+        _search(self.root)
+        return _heap_result(heap)
+
+    def query_k_batch(self, points, k: int):
+        """
+        Như query_k cho nhiều điểm. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần.
+        Duyệt cây theo nhóm truy vấn giống query_batch; mỗi leaf được quét vector hóa
+        rồi gộp với top-k hiện tại bằng argpartition theo hàng.
+        """
+        targets = np.asarray(points, dtype=np.float32).reshape(-1, self.k)
+        m = targets.shape[0]
+        k = _check_k(k, self.n)
+
+        pts = self.points
+        best_d2 = np.full((m, k), np.inf, dtype=np.float32)
+        best_idx = np.full((m, k), -1, dtype=np.int64)
+        worst = np.full(m, np.inf, dtype=np.float32)
+
+        def _scan_leaf(node, q):
+            diff = targets[q][:, None, :] - pts[node.indices][None, :, :]
+            d2_arr = np.einsum('qlk,qlk->ql', diff, diff)
+            cand_idx = np.broadcast_to(node.indices.astype(np.int64), d2_arr.shape)
+            _merge_k(best_d2, best_idx, worst, q, d2_arr, cand_idx)
+
+        def _visit_pivot(node, q, fresh):
+            # Chỉ gộp điểm chốt cho truy vấn chưa gặp nó (fresh), trả về khoảng cách có dấu tới mặt chia
+            p = pts[node.location_idx]
+            tq = targets[q]
+            diff = tq - p
+            d2 = np.einsum('ij,ij->i', diff, diff)
+            better = fresh & (d2 < worst[q])
+            if better.any():
+                qb = q[better]
+                _merge_k(best_d2, best_idx, worst, qb, d2[better][:, None],
+                         np.full((qb.size, 1), node.location_idx, dtype=np.int64))
+            return tq[:, node.axis] - p[node.axis]
+
+        def _descend(node, q):
+            # Pha 1: đi theo nhánh gần tới leaf -> top-k ban đầu cho cận cắt tỉa
+            if node is None or q.size == 0:
+                return
+            if node.is_leaf:
+                _scan_leaf(node, q)
+                return
+            go_left = _visit_pivot(node, q, np.ones(q.size, dtype=bool)) < 0
+            _descend(node.left, q[go_left])
+            _descend(node.right, q[~go_left])
+
+        def _search(node, q, on_path):
+            # Pha 2: duyệt có cắt tỉa. on_path: node nằm trên đường đi của pha 1
+            # -> điểm của nó đã có trong top-k, không gộp lại lần nữa
+            if node is None or q.size == 0:
+                return
+            if node.is_leaf:
+                if not on_path.all():
+                    _scan_leaf(node, q[~on_path])
+                return
+            diff_axis = _visit_pivot(node, q, ~on_path)
+            go_left = diff_axis < 0
+            da2 = diff_axis * diff_axis
+
+            # Nhánh gần cho mọi truy vấn, nhánh xa chỉ khi mặt chia còn gần hơn phần tử thứ k
+            sel = go_left | (da2 < worst[q])
+            _search(node.left, q[sel], (on_path & go_left)[sel])
+            sel = ~go_left | (da2 < worst[q])
+            _search(node.right, q[sel], (on_path & ~go_left)[sel])
+
+        all_q = np.arange(m, dtype=np.int64)
+        _descend(self.root, all_q)
+        _search(self.root, all_q, np.ones(m, dtype=bool))
+        return _sorted_k(best_d2, best_idx)
+
+class FlatKDTree:
+    """
+    KD-Tree lưu trong các mảng NumPy liên tục thay vì đồ thị các _Node:
+      - axis[i]  : trục chia của node i (-1 nếu là leaf)
+      - split[i] : giá trị chia (trái <= split <= phải)
+      - child[i] : id con trái (con phải luôn là child[i] + 1)
+      - start[i], end[i] : khoảng [start, end) trong mảng điểm đã hoán vị (chỉ dùng cho leaf)
+    Các điểm được sắp lại theo thứ tự leaf (self.points), self.perm ánh xạ về index gốc.
+    Cùng contract query() như KDTree, duyệt bằng stack tường minh (không đệ quy).
+    """
+
+    def __init__(self, points: np.ndarray, leaf_size: int = 16):
+        pts = np.asarray(points, dtype=np.float32)
+        if pts.ndim != 2 or pts.shape[0] == 0:
+            raise ValueError("points phải là mảng 2D (N, k)")
+        if leaf_size < 1:
+            raise ValueError("leaf_size phải >= 1")
+
+        n, k = pts.shape
+        cols = np.ascontiguousarray(pts.T) # Lấy 1 trục của nhiều điểm -> truy cập liên tục
+        perm = np.arange(n, dtype=np.int32)
+
+        # Xây cây theo từng độ sâu (BFS), vector hóa cho mọi node cùng độ sâu.
+        # Chia tại median nên các node cùng độ sâu chỉ có tối đa 2 kích thước khác nhau
+        # -> gom thành ma trận (số node, size) và argpartition theo hàng trong 1 lần gọi.
+        parts = []
+        lv_start = np.array([0], dtype=np.int64)
+        lv_end = np.array([n], dtype=np.int64)
+        next_id = 1
+        depth = 0
+        while lv_start.size:
+            cnt = lv_end - lv_start
+            n_lv = lv_start.size
+            axis = np.full(n_lv, -1, dtype=np.int8)
+            split = np.zeros(n_lv, dtype=np.float32)
+            child = np.full(n_lv, -1, dtype=np.int32)
+
+            inner = np.flatnonzero(cnt > leaf_size) # Node còn phải chia, phần còn lại là leaf
+            child[inner] = next_id + 2 * np.arange(inner.size)
+            ax = depth % k
+            for size in np.unique(cnt[inner]):
+                sel = inner[cnt[inner] == size]
+                pos = lv_start[sel][:, None] + np.arange(size)
+                idx = perm[pos]
+                vals = cols[ax][idx]
+                mid = size // 2
+                order = np.argpartition(vals, mid, axis=1)
+                perm[pos] = np.take_along_axis(idx, order, axis=1)
+                axis[sel] = ax
+                split[sel] = np.take_along_axis(vals, order[:, mid:mid + 1], axis=1)[:, 0]
+
+            parts.append((axis, split, child, lv_start, lv_end))
+
+            # Con trái / phải của mỗi node được cấp id liền nhau ở độ sâu tiếp theo
+            mids = lv_start[inner] + cnt[inner] // 2
+            lv_start, lv_end = (np.column_stack([lv_start[inner], mids]).ravel(),
+                                np.column_stack([mids, lv_end[inner]]).ravel())
+            next_id += 2 * inner.size
+            depth += 1
+
+        self._init_arrays(
+            axis=np.concatenate([p[0] for p in parts]),
+            split=np.concatenate([p[1] for p in parts]),
+            child=np.concatenate([p[2] for p in parts]),
+            start=np.concatenate([p[3] for p in parts]).astype(np.int32),
+            end=np.concatenate([p[4] for p in parts]).astype(np.int32),
+            points=pts[perm],
+            perm=perm,
+            leaf_size=leaf_size,
+        )
+
+    def _init_arrays(self, axis, split, child, start, end, points, perm, leaf_size):
+        self.axis = np.ascontiguousarray(axis)
+        self.split = np.ascontiguousarray(split)
+        self.child = np.ascontiguousarray(child)
+        self.start = np.ascontiguousarray(start)
+        self.end = np.ascontiguousarray(end)
+        self.points = np.ascontiguousarray(points)
+        self.perm = np.ascontiguousarray(perm)
+        self.leaf_size = int(leaf_size)
+        self.n, self.k = self.points.shape
+        self.n_nodes = self.axis.shape[0]
+
+        # memoryview cho phép đọc từng phần tử nhanh hơn nhiều so với index numpy
+        self._axis_mv = memoryview(self.axis)
+        self._split_mv = memoryview(self.split)
+        self._child_mv = memoryview(self.child)
+        self._start_mv = memoryview(self.start)
+        self._end_mv = memoryview(self.end)
+
+    # --- LƯU / NẠP ---
+
+    def to_array(self) -> np.ndarray:
+        """Đóng gói toàn bộ cây vào 1 bản ghi structured (không cần pickle)."""
+        dt = np.dtype([
+            ("axis", np.int8, (self.n_nodes,)),
+            ("split", np.float32, (self.n_nodes,)),
+            ("child", np.int32, (self.n_nodes,)),
+            ("start", np.int32, (self.n_nodes,)),
+            ("end", np.int32, (self.n_nodes,)),
+            ("points", np.float32, (self.n, self.k)),
+            ("perm", np.int32, (self.n,)),
+            ("leaf_size", np.int32),
+        ])
+        rec = np.zeros((), dtype=dt)
+        for name in ("axis", "split", "child", "start", "end", "points", "perm"):
+            rec[name] = getattr(self, name)
+        rec["leaf_size"] = self.leaf_size
+        return rec
+
+    @classmethod
+    def from_array(cls, rec: np.ndarray) -> "FlatKDTree":
+        tree = cls.__new__(cls)
+        tree.__setstate__({"rec": rec})
+        return tree
+
+    def __getstate__(self):
+        # memoryview không pickle được -> gửi sang process khác dưới dạng bản ghi mảng
+        return {"rec": self.to_array()}
+
+    def __setstate__(self, state):
+        rec = state["rec"]
+        self._init_arrays(
+            axis=rec["axis"], split=rec["split"], child=rec["child"],
+            start=rec["start"], end=rec["end"], points=rec["points"],
+            perm=rec["perm"], leaf_size=int(rec["leaf_size"]),
+        )
+
+    def save(self, path: str):
+        """Ghi cây ra đĩa bằng 1 lần np.save."""
+        np.save(path, self.to_array())
+
+    @classmethod
+    def load(cls, path: str) -> "FlatKDTree":
+        """Nạp cây đã lưu bằng save() (1 lần np.load)."""
+        return cls.from_array(np.load(path, allow_pickle=False))
+
+    # --- TRUY VẤN ---
+
+    def query(self, point):
+        """Trả về (distance, index) của điểm gần nhất."""
+        target = np.asarray(point, dtype=np.float32).reshape(-1)
+        t = target.tolist()
+
+        # Biến cục bộ để truy cập nhanh hơn
+        points = self.points
+        axis_mv, split_mv, child_mv = self._axis_mv, self._split_mv, self._child_mv
+        start_mv, end_mv = self._start_mv, self._end_mv
+
+        best_d2 = float("inf")
+        best_pos = -1
+
+        # Stack chứa (node, cận dưới khoảng cách bình phương tới vùng của node)
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= best_d2:
+                continue # Pruning (Cắt tỉa nhánh)
+
+            # Đi thẳng theo nhánh gần tới leaf, nhánh xa đẩy vào stack
+            ax = axis_mv[node]
+            while ax >= 0:
+                diff = t[ax] - split_mv[node]
+                left = child_mv[node]
+                if diff < 0:
+                    stack.append((left + 1, diff * diff))
+                    node = left
+                else:
+                    stack.append((left, diff * diff))
+                    node = left + 1
+                ax = axis_mv[node]
+
+            s, e = start_mv[node], end_mv[node]
+            diff = points[s:e] - target
+            d2_arr = np.einsum('ij,ij->i', diff, diff)
+            j = int(np.argmin(d2_arr))
+            if d2_arr[j] < best_d2:
+                best_d2 = float(d2_arr[j])
+                best_pos = s + j
+
+        return float(np.sqrt(best_d2)), int(self.perm[best_pos])
+
+    def _scan_leaves(self, q, leaves, targets, best_d2, best_pos, chunk=65536):
+        """Quét vector hóa các cặp (truy vấn q, leaf) và cập nhật best tại chỗ."""
+        offs = np.arange(self.leaf_size, dtype=np.int64)
+        for c in range(0, q.size, chunk):
+            qc = q[c:c + chunk]
+            lc = leaves[c:c + chunk]
+
+            # Ma trận index (P, leaf_size) vào mảng điểm, phần thừa bị che bằng inf
+            pos = self.start[lc][:, None] + offs
+            valid = pos < self.end[lc][:, None]
+            pos = np.where(valid, pos, 0)
+
+            diff = self.points[pos] - targets[qc][:, None, :]
+            d2 = np.einsum('plk,plk->pl', diff, diff)
+            d2[~valid] = np.inf
+
+            j = np.argmin(d2, axis=1)
+            min_d2 = d2[np.arange(qc.size), j]
+            min_pos = pos[np.arange(qc.size), j]
+
+            # Một truy vấn có thể xuất hiện nhiều lần trong chunk -> lấy min theo từng truy vấn
+            order = np.lexsort((min_d2, qc))
+            qs = qc[order]
+            first = np.ones(qs.size, dtype=bool)
+            first[1:] = qs[1:] != qs[:-1]
+            qs = qs[first]
+            cand_d2 = min_d2[order][first]
+            cand_pos = min_pos[order][first]
+
+            better = cand_d2 < best_d2[qs]
+            best_d2[qs[better]] = cand_d2[better]
+            best_pos[qs[better]] = cand_pos[better]
+
+    def query_batch(self, points, visit_counts=None):
+        """
+        Truy vấn nhiều điểm cùng lúc. Trả về (dists, idxs), mỗi mảng shape (M,).
+        Toàn bộ việc duyệt cây được vector hóa theo độ sâu: số vòng lặp Python
+        chỉ tỉ lệ với chiều sâu cây, không phụ thuộc số truy vấn.
+        visit_counts (dict, tùy chọn): nhận thêm "nodes" / "leaves" (M,) = số node đã thăm
+        và số leaf đã quét của từng truy vấn.
+        """
+        targets = np.asarray(points, dtype=np.float32).reshape(-1, self.k)
+        m = targets.shape[0]
+        rows = np.arange(m, dtype=np.int64)
+        counting = visit_counts is not None
+        if counting:
+            nodes_seen = np.ones(m, dtype=np.int64) # Gốc
+            leaves_seen = np.ones(m, dtype=np.int64) # Leaf của pha 1
+
+        best_d2 = np.full(m, np.inf, dtype=np.float32)
+        best_pos = np.zeros(m, dtype=np.int64)
+
+        # Pha 1: mỗi truy vấn đi theo nhánh gần tới leaf -> có cận trên best_d2
+        node = np.zeros(m, dtype=np.int64)
+        active = self.axis[node] >= 0
+        while active.any():
+            a = rows[active]
+            na = node[a]
+            ax = self.axis[na].astype(np.int64)
+            go_right = targets[a, ax] >= self.split[na]
+            node[a] = self.child[na] + go_right
+            active[a] = self.axis[node[a]] >= 0
+            if counting:
+                nodes_seen[a] += 1
+        home = node
+        self._scan_leaves(rows, home, targets, best_d2, best_pos)
+
+        # Pha 2: duyệt đầy đủ có cắt tỉa trên "frontier" các cặp (truy vấn, node)
+        q = rows
+        nodes = np.zeros(m, dtype=np.int64)
+        bounds = np.zeros(m, dtype=np.float32)
+        while q.size:
+            keep = bounds < best_d2[q]
+            q, nodes, bounds = q[keep], nodes[keep], bounds[keep]
+            if counting:
+                nodes_seen += np.bincount(q, minlength=m)
+
+            is_leaf = self.axis[nodes] < 0
+            if is_leaf.any():
+                # Bỏ qua leaf đã quét ở pha 1
+                lq, ln = q[is_leaf], nodes[is_leaf]
+                fresh = ln != home[lq]
+                if fresh.any():
+                    self._scan_leaves(lq[fresh], ln[fresh], targets, best_d2, best_pos)
+                    if counting:
+                        leaves_seen += np.bincount(lq[fresh], minlength=m)
+
+            inner = ~is_leaf
+            q, nodes, bounds = q[inner], nodes[inner], bounds[inner]
+            if not q.size:
+                break
+
+            ax = self.axis[nodes].astype(np.int64)
+            diff = targets[q, ax] - self.split[nodes]
+            left = self.child[nodes].astype(np.int64)
+            near = np.where(diff < 0, left, left + 1)
+            far = np.where(diff < 0, left + 1, left)
+            far_bound = np.maximum(bounds, diff * diff)
+
+            q = np.concatenate([q, q])
+            nodes = np.concatenate([near, far])
+            bounds = np.concatenate([bounds, far_bound])
+
+        if counting:
+            visit_counts["nodes"] = nodes_seen
+            visit_counts["leaves"] = leaves_seen
+        return np.sqrt(best_d2), self.perm[best_pos].astype(np.int64)
+
+    def query_k(self, point, k: int):
+        """Trả về (dists, idxs) của k điểm gần nhất, sắp tăng dần (max-heap giới hạn k phần tử)."""
+        target = np.asarray(point, dtype=np.float32).reshape(-1)
+        t = target.tolist()
+        k = _check_k(k, self.n)
+
+        points = self.points
+        axis_mv, split_mv, child_mv = self._axis_mv, self._split_mv, self._child_mv
+        start_mv, end_mv = self._start_mv, self._end_mv
+
+        heap = []
+        worst = float("inf")
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound >= worst:
+                continue
+
+            ax = axis_mv[node]
+            while ax >= 0:
+                diff = t[ax] - split_mv[node]
+                left = child_mv[node]
+                if diff < 0:
+                    stack.append((left + 1, diff * diff))
+                    node = left
+                else:
+                    stack.append((left, diff * diff))
+                    node = left + 1
+                ax = axis_mv[node]
+
+            s, e = start_mv[node], end_mv[node]
+            diff = points[s:e] - target
+            d2_arr = np.einsum('ij,ij->i', diff, diff)
+            cand = np.flatnonzero(d2_arr < worst)
+            if cand.size > k:
+                cand = cand[np.argpartition(d2_arr[cand], k - 1)[:k]]
+            for j in cand.tolist():
+                _push_k(heap, k, float(d2_arr[j]), s + j)
+            if len(heap) == k:
+                worst = -heap[0][0]
+
+        dists, pos = _heap_result(heap)
+        return dists, self.perm[pos].astype(np.int64)
+
+    def _scan_leaves_k(self, q, nodes, targets, best_d2, best_pos, worst, chunk=65536):
+        """
+        Như _scan_leaves nhưng gộp vào top-k; nodes có thể là node trong (quét mọi điểm của cây con,
+        vốn nằm liên tục trong self.points). Một truy vấn có thể gặp nhiều node trong cùng lô:
+        mọi ứng viên còn gần hơn phần tử thứ k được gom theo truy vấn, giữ k ứng viên đầu
+        của mỗi truy vấn rồi gộp vào top-k trong 1 lần.
+        """
+        k = best_d2.shape[1]
+        for c in range(0, q.size, chunk):
+            qc = q[c:c + chunk]
+            nc = nodes[c:c + chunk]
+
+            width = int((self.end[nc] - self.start[nc]).max())
+            pos = self.start[nc][:, None] + np.arange(width, dtype=np.int64)
+            valid = pos < self.end[nc][:, None]
+            pos = np.where(valid, pos, 0)
+
+            diff = self.points[pos] - targets[qc][:, None, :]
+            d2 = np.einsum('plk,plk->pl', diff, diff)
+            d2[~valid] = np.inf
+
+            # Mỗi cặp chỉ cần giữ k điểm gần nhất của node
+            if width > k:
+                part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+                d2 = np.take_along_axis(d2, part, axis=1)
+                pos = np.take_along_axis(pos, part, axis=1)
+
+            if np.unique(qc).size == qc.size:
+                _merge_k(best_d2, best_pos, worst, qc, d2, pos)
+                continue
+
+            # Chỉ giữ ứng viên có thể lọt top-k của truy vấn
+            pi, wi = np.nonzero(d2 < worst[qc][:, None])
+            if not pi.size:
+                continue
+            cq, cd, cp = qc[pi], d2[pi, wi], pos[pi, wi]
+
+            # Sắp theo (truy vấn, khoảng cách), rank = thứ hạng trong nhóm của truy vấn
+            order = np.lexsort((cd, cq))
+            cq, cd, cp = cq[order], cd[order], cp[order]
+            first = np.ones(cq.size, dtype=bool)
+            first[1:] = cq[1:] != cq[:-1]
+            group = np.cumsum(first) - 1
+            rank = np.arange(cq.size) - np.flatnonzero(first)[group]
+            top = rank < k
+
+            uq = cq[first]
+            cand_d2 = np.full((uq.size, k), np.inf, dtype=np.float32)
+            cand_pos = np.zeros((uq.size, k), dtype=np.int64)
+            cand_d2[group[top], rank[top]] = cd[top]
+            cand_pos[group[top], rank[top]] = cp[top]
+            _merge_k(best_d2, best_pos, worst, uq, cand_d2, cand_pos)
+
+    def query_k_batch(self, points, k: int):
+        """
+        Như query_k cho nhiều điểm. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần.
+        Cùng sơ đồ 2 pha với query_batch, cận cắt tỉa là khoảng cách tới phần tử thứ k.
+        """
+        targets = np.asarray(points, dtype=np.float32).reshape(-1, self.k)
+        m = targets.shape[0]
+        k = _check_k(k, self.n)
+        rows = np.arange(m, dtype=np.int64)
+
+        best_d2 = np.full((m, k), np.inf, dtype=np.float32)
+        best_pos = np.zeros((m, k), dtype=np.int64)
+        worst = np.full(m, np.inf, dtype=np.float32)
+
+        # Pha 1: đi theo nhánh gần, dừng ở cây con sâu nhất còn >= 4k điểm rồi quét cả cây con đó
+        # -> có ngay k ứng viên đủ tốt làm cận cắt tỉa (đo thực tế nhanh hơn dừng ở >= k điểm)
+        node = np.zeros(m, dtype=np.int64)
+        active = self.axis[node] >= 0
+        while active.any():
+            a = rows[active]
+            na = node[a]
+            ax = self.axis[na].astype(np.int64)
+            go_right = targets[a, ax] >= self.split[na]
+            nxt = self.child[na] + go_right
+            deeper = (self.end[nxt] - self.start[nxt]) >= 4 * k
+            node[a[deeper]] = nxt[deeper]
+            active[a] = deeper & (self.axis[nxt] >= 0)
+        home = node
+        self._scan_leaves_k(rows, home, targets, best_d2, best_pos, worst)
+        home_start, home_end = self.start[home], self.end[home]
+
+        # Pha 2: frontier các cặp (truy vấn, node), bỏ leaf thuộc cây con đã quét ở pha 1
+        q = rows
+        nodes = np.zeros(m, dtype=np.int64)
+        bounds = np.zeros(m, dtype=np.float32)
+        while q.size:
+            keep = bounds < worst[q]
+            q, nodes, bounds = q[keep], nodes[keep], bounds[keep]
+
+            is_leaf = self.axis[nodes] < 0
+            if is_leaf.any():
+                lq, ln = q[is_leaf], nodes[is_leaf]
+                fresh = (self.start[ln] < home_start[lq]) | (self.start[ln] >= home_end[lq])
+                if fresh.any():
+                    self._scan_leaves_k(lq[fresh], ln[fresh], targets, best_d2, best_pos, worst)
+
+            inner = ~is_leaf
+            q, nodes, bounds = q[inner], nodes[inner], bounds[inner]
+            if not q.size:
+                break
+
+            ax = self.axis[nodes].astype(np.int64)
+            diff = targets[q, ax] - self.split[nodes]
+            left = self.child[nodes].astype(np.int64)
+            near = np.where(diff < 0, left, left + 1)
+            far = np.where(diff < 0, left + 1, left)
+            far_bound = np.maximum(bounds, diff * diff)
+
+            q = np.concatenate([q, q])
+            nodes = np.concatenate([near, far])
+            bounds = np.concatenate([bounds, far_bound])
+
+        dists, pos = _sorted_k(best_d2, best_pos)
+        return dists, self.perm[pos].astype(np.int64)
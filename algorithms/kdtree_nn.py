@@ -1,23 +1,115 @@
 import numpy as np
-from algorithms.kdtree_module import KDTree
+from algorithms.kdtree_module import KDTree, FlatKDTree
+from algorithms.brute_nn import BruteForceNN
+
+# Các backend tìm kiếm có thể chọn (xem choose_backend)
+BACKENDS = ("auto", "tree", "brute")
+
+# Mô hình chi phí ước lượng (giây, đo trên 1 nhân CPU) để chọn backend:
+#   brute = số truy vấn * N * BRUTE_PAIR_COST          (1 phép nhân ma trận, không phụ thuộc số chiều đáng kể)
+#   tree  = TREE_CALL_COST + số truy vấn * TREE_QUERY_COST * TREE_DIM_GROWTH^(D - 3)
+# Cây cắt tỉa kém dần khi số chiều tăng -> với đặc trưng 6 chiều (màu + texture) brute-force thắng tới N ~ 10^4.
+BRUTE_PAIR_COST = 6e-9
+TREE_CALL_COST = 3e-4
+TREE_QUERY_COST = 6e-6
+TREE_DIM_GROWTH = 2.6
+
+def choose_backend(n: int, dim: int, m: int) -> str:
+    """Chọn "tree" hoặc "brute" cho lô m truy vấn trên N điểm D chiều theo mô hình chi phí ở trên."""
+    brute = m * n * BRUTE_PAIR_COST
+    tree = TREE_CALL_COST + m * TREE_QUERY_COST * TREE_DIM_GROWTH ** max(0, dim - 3)
+    return "brute" if brute <= tree else "tree"
+
+def reachable_backends(n: int, dim: int) -> tuple:
+    """
+    Các backend mà choose_backend có thể chọn cho N điểm D chiều với lô truy vấn bất kỳ (m >= 1).
+    brute - tree = m * (N * BRUTE_PAIR_COST - q) - TREE_CALL_COST, q = chi phí 1 truy vấn cây:
+    tăng hoặc giảm tuyến tính theo m -> chỉ cần xét m = 1 và m -> vô cùng.
+    """
+    q = TREE_QUERY_COST * TREE_DIM_GROWTH ** max(0, dim - 3)
+    kinds = []
+    if n * BRUTE_PAIR_COST <= TREE_CALL_COST + q:
+        kinds.append("brute")
+    if n * BRUTE_PAIR_COST > q:
+        kinds.append("tree")
+    return tuple(kinds)
 
 class KDTreeNearestNeighbor:
-    def __init__(self, colors_arr: np.ndarray):
+    """
+    Tìm tile gần nhất theo vector đặc trưng số chiều bất kỳ (3 = màu trung bình, 6 = màu + texture).
+    backend:
+      - "tree":  KD-Tree (mặc định dạng mảng FlatKDTree)
+      - "brute": quét toàn bộ bằng nhân ma trận (BruteForceNN)
+      - "auto":  chọn theo từng lần truy vấn dựa vào N, số chiều và số truy vấn trong lô (choose_backend)
+    Mọi backend có thể được dùng (reachable_backends) được dựng ngay khi tạo: chi phí dựng nằm ở bước
+    dựng chỉ mục (không lẫn vào lần truy vấn đầu) và các thread truy vấn đồng thời không phải dựng lại.
+    """
+
+    def __init__(self, colors_arr: np.ndarray, flat: bool = True, backend: str = "auto"):
         if colors_arr is None:
             raise ValueError("colors_arr is None")
+        if backend not in BACKENDS:
+            raise ValueError(f"backend phải là một trong {BACKENDS}")
 
         colors_arr = np.asarray(colors_arr, dtype=np.float32)
-        if colors_arr.ndim != 2 or colors_arr.shape[1] != 3 or colors_arr.shape[0] == 0:
-            raise ValueError("colors_arr phải có shape (N, 3) và N > 0")
+        if colors_arr.ndim != 2 or colors_arr.shape[1] == 0 or colors_arr.shape[0] == 0:
+            raise ValueError("colors_arr phải có shape (N, D) với N > 0, D > 0")
 
         self.colors = colors_arr
-        self.tree = KDTree(self.colors)
+        self.dim = colors_arr.shape[1]
+        self.flat = flat
+        self.backend = backend
+        self._tree = None
+        self._brute = None
+        kinds = reachable_backends(len(colors_arr), self.dim) if backend == "auto" else (backend,)
+        if "tree" in kinds:
+            _ = self.tree
+        if "brute" in kinds:
+            _ = self.brute
+
+    @property
+    def tree(self):
+        # flat=True: cây dạng mảng (FlatKDTree) - build nhanh, query nhanh, ít bộ nhớ hơn
+        if self._tree is None:
+            self._tree = FlatKDTree(self.colors) if self.flat else KDTree(self.colors)
+        return self._tree
+
+    @property
+    def brute(self) -> BruteForceNN:
+        if self._brute is None:
+            self._brute = BruteForceNN(self.colors)
+        return self._brute
+
+    def _engine(self, m: int):
+        kind = self.backend
+        if kind == "auto":
+            kind = choose_backend(len(self.colors), self.dim, m)
+        return self.brute if kind == "brute" else self.tree
+
+    def _check(self, colors: np.ndarray, name: str) -> np.ndarray:
+        colors = np.asarray(colors, dtype=np.float32)
+        if colors.ndim != 2 or colors.shape[1] != self.dim:
+            raise ValueError(f"{name} phải có shape (M, {self.dim})")
+        return colors
 
     def query(self, color: np.ndarray) -> int:
         color = np.asarray(color, dtype=np.float32).reshape(-1)
-        if color.shape[0] != 3:
-            raise ValueError("color phải có shape (3,)")
+        if color.shape[0] != self.dim:
+            raise ValueError(f"color phải có shape ({self.dim},)")
+
+        # Trả về (distance, index)
+        _, idx = self._engine(1).query(color)
+        return int(idx)
+
+    def query_batch(self, colors: np.ndarray, visit_counts=None):
+        """
+        Truy vấn nhiều màu cùng lúc. Trả về (dists, idxs) shape (M,).
+        visit_counts: dict nhận số node / leaf đã duyệt của mỗi truy vấn (xem FlatKDTree.query_batch).
+        """
+        colors = self._check(colors, "colors")
+        return self._engine(len(colors)).query_batch(colors, visit_counts)
 
-        # KD-Tree trả về (distance, index)
-        _, idx = self.tree.query(color)
-        return int(idx)
\ No newline at end of file
+    def query_k_batch(self, colors: np.ndarray, k: int):
+        """k tile gần nhất cho nhiều màu. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần."""
+        colors = self._check(colors, "colors")
+        return self._engine(len(colors)).query_k_batch(colors, k)
@@ -0,0 +1,89 @@
+import numpy as np
+from typing import Tuple
+
+from algorithms.quadtree import BLOCK_X, BLOCK_Y, BLOCK_SIZE, BLOCK_H, BLOCK_W
+
+# Số ứng viên mặc định mỗi block khi bật chế độ chống lặp tile
+REUSE_K = 8
+
+# Phạt cho mỗi ô kề (8 hướng) đã dùng cùng tile, tính theo đơn vị khoảng cách màu
+REUSE_PENALTY = 12.0
+
+def new_label_map(h_img: int, w_img: int, min_size: int) -> np.ndarray:
+    """
+    Bản đồ tile đã đặt trên lưới min_size x min_size của cả ảnh (-1 = chưa đặt),
+    có thêm viền 1 ô để tra ô kề ở biên ảnh không cần kiểm tra chỉ số.
+    Index tile giống nhau ở mọi level (cùng thứ tự file) nên dùng chung 1 bản đồ cho mọi level.
+    """
+    gh = -(-h_img // min_size)
+    gw = -(-w_img // min_size)
+    return np.full((gh + 2, gw + 2), -1, dtype=np.int32)
+
+def _grid_span(blocks: np.ndarray, min_size: int) -> Tuple[np.ndarray, ...]:
+    """Các ô [gx0, gx1) x [gy0, gy1) của lưới min_size mà mỗi block phủ lên."""
+    x = blocks[:, BLOCK_X].astype(np.int64)
+    y = blocks[:, BLOCK_Y].astype(np.int64)
+    gx0 = x // min_size
+    gy0 = y // min_size
+    gx1 = -(-(x + blocks[:, BLOCK_W]) // min_size)
+    gy1 = -(-(y + blocks[:, BLOCK_H]) // min_size)
+    return gx0, gy0, gx1, gy1
+
+def pick_with_reuse(blocks: np.ndarray, dists: np.ndarray, idxs: np.ndarray,
+                    label_map: np.ndarray, usage: np.ndarray, min_size: int,
+                    reuse_penalty: float = REUSE_PENALTY, usage_penalty: float = 0.0) -> np.ndarray:
+    """
+    Chọn 1 trong k ứng viên cho mỗi block của 1 level để tránh lặp tile ở vùng phẳng.
+    blocks: (M, 5) cùng size, dists / idxs: (M, k) ứng viên sắp tăng dần theo khoảng cách.
+    chi phí = khoảng cách + reuse_penalty * số ô kề đã dùng cùng tile + usage_penalty * số lần tile đã dùng.
+
+    Block được chia 4 pha theo tính chẵn lẻ của tọa độ lưới: 2 block cùng pha không bao giờ kề nhau
+    nên mỗi pha chọn vector hóa toàn bộ mà vẫn thấy lựa chọn của các pha (và các level) trước.
+    label_map (xem new_label_map) và usage (N,) được cập nhật tại chỗ. Trả về idxs đã chọn (M,).
+    """
+    m = len(blocks)
+    chosen = idxs[:, 0].astype(np.int64)
+    if m == 0 or idxs.shape[1] == 1:
+        _mark(blocks, chosen, label_map, usage, min_size)
+        return chosen
+
+    size = blocks[:, BLOCK_SIZE].astype(np.int64)
+    gx0, gy0, gx1, gy1 = _grid_span(blocks, min_size)
+    phase = ((blocks[:, BLOCK_Y] // size) % 2) * 2 + (blocks[:, BLOCK_X] // size) % 2
+
+    # 8 điểm mẫu quanh block (góc + giữa mỗi cạnh) trên label_map (đã cộng viền 1 ô)
+    xs = np.stack([gx0, (gx0 + gx1 - 1) // 2 + 1, gx1 + 1], axis=1)
+    ys = np.stack([gy0, (gy0 + gy1 - 1) // 2 + 1, gy1 + 1], axis=1)
+    ring = [(r, c) for r in range(3) for c in range(3) if (r, c) != (1, 1)]
+    ny = np.stack([ys[:, r] for r, _ in ring], axis=1)
+    nx = np.stack([xs[:, c] for _, c in ring], axis=1)
+
+    for p in range(4):
+        sel = np.flatnonzero(phase == p)
+        if not sel.size:
+            continue
+        cand = idxs[sel]
+        neigh = label_map[ny[sel], nx[sel]] # (P, 8)
+        repeats = (cand[:, :, None] == neigh[:, None, :]).sum(axis=2)
+
+        cost = dists[sel] + reuse_penalty * repeats
+        if usage_penalty:
+            cost = cost + usage_penalty * usage[cand]
+        pick = cand[np.arange(sel.size), np.argmin(cost, axis=1)]
+        chosen[sel] = pick
+        _mark(blocks[sel], pick, label_map, usage, min_size)
+
+    return chosen
+
+def _mark(blocks: np.ndarray, picks: np.ndarray, label_map: np.ndarray, usage: np.ndarray, min_size: int):
+    """Ghi tile đã chọn lên mọi ô lưới block phủ và tăng bộ đếm sử dụng."""
+    if not len(blocks):
+        return
+    gx0, gy0, gx1, gy1 = _grid_span(blocks, min_size)
+    cells = int(blocks[0, BLOCK_SIZE]) // min_size
+    offs = np.arange(cells)
+    # Ô vượt biên ảnh (block bị cắt) được kẹp về ô cuối của chính block đó
+    yy = np.minimum(gy0[:, None] + offs, gy1[:, None] - 1) + 1
+    xx = np.minimum(gx0[:, None] + offs, gx1[:, None] - 1) + 1
+    label_map[yy[:, :, None], xx[:, None, :]] = picks[:, None, None]
+    usage += np.bincount(picks, minlength=usage.size)[:usage.size]
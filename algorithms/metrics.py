@@ -0,0 +1,201 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import resource # Chỉ có trên Unix
+except ImportError:
+    resource = None
+
+class MetricsRecorder:
+    """
+    Thu thập số liệu có cấu trúc của 1 (hoặc nhiều) lần ghép tranh, thay cho việc đọc chuỗi progress:
+      - stage(name): thời gian thực và đỉnh bộ nhớ (tracemalloc) của từng giai đoạn, lồng nhau được,
+      - count / set: bộ đếm và giá trị (tiles nạp được / lỗi, số block mỗi level...),
+      - observe(name, values): histogram giá trị nguyên (VD: số node KD-Tree mỗi truy vấn),
+      - timed_callback(name, fn): bọc callback để đo thời gian nằm trong progress / preview.
+    Đọc bằng to_dict() hoặc ghi file JSON bằng dump() (có traceEvents mở được bằng chrome://tracing).
+
+    track_memory=True bật tracemalloc (NumPy có báo cấp phát cho tracemalloc) -> chậm hơn một chút.
+    """
+
+    def __init__(self, track_memory: bool = True):
+        self.track_memory = track_memory
+        self._t0 = time.perf_counter()
+        self._events: List[Dict] = []
+        self._stack: List[Dict] = []
+        self._counters: Dict[str, float] = {}
+        self._values: Dict[str, object] = {}
+        self._hist: Dict[str, np.ndarray] = {}
+        self._callbacks: Dict[str, Dict[str, float]] = {}
+        self._started_tracing = False
+
+    # --- GIAI ĐOẠN ---
+
+    @contextmanager
+    def stage(self, name: str):
+        """Đo 1 giai đoạn. Đỉnh bộ nhớ của giai đoạn con được tính cả vào giai đoạn cha."""
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        if self.track_memory:
+            # reset_peak xóa đỉnh hiện tại -> gộp vào giai đoạn cha trước khi xóa
+            _, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+
+        entry = {"name": name, "start": time.perf_counter(), "peak": 0, "depth": len(self._stack)}
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._stack.pop()
+            if self.track_memory and tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                entry["peak"] = max(entry["peak"], peak)
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], entry["peak"])
+            self._events.append({
+                "name": name,
+                "start_s": entry["start"] - self._t0,
+                "wall_s": end - entry["start"],
+                "mem_peak_bytes": int(entry["peak"]) if self.track_memory else None,
+                "depth": entry["depth"],
+            })
+
+    def record(self, name: str, start: float, wall_s: float):
+        """
+        Thêm 1 giai đoạn đã đo sẵn (start theo time.perf_counter), lồng trong giai đoạn đang mở.
+        Dùng cho số liệu đo trong thread worker (stage() dùng chung 1 ngăn xếp, chỉ gọi từ 1 thread)
+        rồi gộp lại ở thread gọi. Không có đỉnh bộ nhớ (tracemalloc đo chung cả process).
+        """
+        self._events.append({
+            "name": name,
+            "start_s": start - self._t0,
+            "wall_s": wall_s,
+            "mem_peak_bytes": None,
+            "depth": len(self._stack),
+        })
+
+    def finish(self):
+        """Tắt tracemalloc nếu chính recorder đã bật (gọi lại stage() sẽ bật lại)."""
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started_tracing = False
+
+    # --- BỘ ĐẾM / GIÁ TRỊ / HISTOGRAM ---
+
+    def count(self, name: str, n: float = 1):
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def set(self, name: str, value):
+        self._values[name] = value
+
+    def observe(self, name: str, values: np.ndarray):
+        """Cộng dồn các giá trị nguyên không âm vào histogram `name`."""
+        values = np.asarray(values, dtype=np.int64).ravel()
+        if values.size == 0:
+            return
+        counts = np.bincount(values)
+        old = self._hist.get(name)
+        if old is not None:
+            if old.size > counts.size:
+                old, counts = counts, old
+            counts = counts.copy()
+            counts[:old.size] += old
+        self._hist[name] = counts
+
+    def timed_callback(self, name: str, fn: Optional[Callable]) -> Optional[Callable]:
+        """Bọc callback để cộng dồn số lần gọi và thời gian nằm trong callback."""
+        if fn is None:
+            return None
+        rec = self._callbacks.setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+
+        def _wrapped(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                rec["calls"] += 1
+                rec["total_s"] += dt
+                rec["max_s"] = max(rec["max_s"], dt)
+        return _wrapped
+
+    # --- XUẤT KẾT QUẢ ---
+
+    @staticmethod
+    def _summarize(counts: np.ndarray) -> Dict:
+        total = int(counts.sum())
+        values = np.arange(counts.size)
+        cdf = np.cumsum(counts)
+
+        def _pct(p):
+            return int(np.searchsorted(cdf, p * total, side="left"))
+
+        # Bucket lũy thừa 2: "0", "1", "2-3", "4-7", ...
+        buckets = {}
+        lo = 0
+        while lo < counts.size:
+            hi = 0 if lo == 0 else (1 if lo == 1 else lo * 2 - 1)
+            n = int(counts[lo:hi + 1].sum())
+            if n:
+                buckets[str(lo) if hi == lo else f"{lo}-{hi}"] = n
+            lo = hi + 1
+        return {
+            "count": total,
+            "mean": float((values * counts).sum() / total) if total else 0.0,
+            "max": int(np.flatnonzero(counts)[-1]) if total else 0,
+            "p50": _pct(0.5), "p90": _pct(0.9), "p99": _pct(0.99),
+            "buckets": buckets,
+        }
+
+    def stages(self) -> Dict[str, Dict]:
+        """Tổng hợp theo tên giai đoạn (theo thứ tự xuất hiện): số lần, tổng thời gian, đỉnh bộ nhớ."""
+        out = {}
+        for ev in sorted(self._events, key=lambda e: e["start_s"]):
+            s = out.setdefault(ev["name"], {"calls": 0, "wall_s": 0.0, "mem_peak_bytes": None})
+            s["calls"] += 1
+            s["wall_s"] += ev["wall_s"]
+            if ev["mem_peak_bytes"] is not None:
+                s["mem_peak_bytes"] = max(s["mem_peak_bytes"] or 0, ev["mem_peak_bytes"])
+        return out
+
+    def to_dict(self) -> Dict:
+        peak_rss = None
+        if resource is not None:
+            # ru_maxrss: KB trên Linux
+            peak_rss = int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) * 1024
+        return {
+            "elapsed_s": time.perf_counter() - self._t0,
+            "stages": self.stages(),
+            "counters": dict(self._counters),
+            "values": dict(self._values),
+            "histograms": {k: self._summarize(v) for k, v in self._hist.items()},
+            "callbacks": {k: dict(v) for k, v in self._callbacks.items()},
+            "process_peak_rss_bytes": peak_rss,
+        }
+
+    def trace_events(self) -> List[Dict]:
+        """Các giai đoạn theo định dạng Trace Event (chrome://tracing, Perfetto)."""
+        return [{"name": ev["name"], "ph": "X", "pid": 0, "tid": 0,
+                 "ts": ev["start_s"] * 1e6, "dur": ev["wall_s"] * 1e6,
+                 "args": {"mem_peak_bytes": ev["mem_peak_bytes"]}}
+                for ev in sorted(self._events, key=lambda e: e["start_s"])]
+
+    def dump(self, path: str):
+        """Ghi file JSON: {"traceEvents": [...], "summary": to_dict()}."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.trace_events(), "summary": self.to_dict()},
+                      f, ensure_ascii=False, indent=2, default=str)
+
+def maybe_stage(metrics: Optional[MetricsRecorder], name: str):
+    """metrics.stage(name) nếu có recorder, ngược lại context rỗng (không đo gì)."""
+    return metrics.stage(name) if metrics is not None else nullcontext()
@@ -1,18 +1,61 @@
-from algorithms.multiresolution import multi_resolution_mosaic
+from algorithms.matching import REUSE_PENALTY
+from algorithms.session import MosaicSession
+from algorithms.preview import PREVIEW_MAX_SIDE
+from algorithms.cancel import CancelToken
 
 class MosaicGenerator:
+    # Cache dùng chung cho mọi MosaicGenerator trong tiến trình (giao diện tạo generator mới mỗi lần chạy)
+    shared_session = MosaicSession()
+
     def __init__(self, target_path, tiles_folder, tile_size, blend_factor,
                     levels=3,
-                    frame_every=120):
+                    frame_every=120,
+                    use_cache=True,
+                    tiles_db=None,
+                    index="kdtree",
+                    match_k=1,
+                    reuse_penalty=REUSE_PENALTY,
+                    usage_penalty=0.0,
+                    metrics=None,
+                    session=None,
+                    preview_max=PREVIEW_MAX_SIDE,
+                    workers=None,
+                    use_texture=None):
         self.target_path = target_path
         self.tiles_folder = tiles_folder
         self.tile_size = tile_size
         self.blend_factor = blend_factor
         self.levels = levels
         self.frame_every = frame_every
+        self.use_cache = use_cache
+        # tiles_db dựng sẵn (build_tiles_db) -> bỏ qua bước nạp kho tiles
+        self.tiles_db = tiles_db
+        # Loại chỉ mục tìm tile: "kdtree" hoặc "lut" (bảng tra màu), có thể là dict {size: loại}
+        self.index = index
+        # match_k > 1: chọn trong k tile gần nhất, phạt tile lặp lại ở ô kề / dùng nhiều lần
+        self.match_k = match_k
+        self.reuse_penalty = reuse_penalty
+        self.usage_penalty = usage_penalty
+        # MetricsRecorder (algorithms.metrics) để thu số liệu từng giai đoạn, None = không đo
+        self.metrics = metrics
+        # Cache kho tiles / kết quả ghép giữa các lần chạy, mặc định dùng chung shared_session
+        self.session = session if session is not None else MosaicGenerator.shared_session
+        # Cạnh dài tối đa của ảnh preview gửi cho frame_callback (None = ảnh đầy đủ)
+        self.preview_max = preview_max
+        # Số thread ghép song song theo vùng (None = số CPU)
+        self.workers = workers
+        # Khớp cả vân ảnh (đặc trưng 6 chiều màu + độ lệch chuẩn), None = theo multiresolution.USE_TEXTURE
+        self.use_texture = use_texture
+        # Hủy lần run() đang chạy từ thread khác: gen.cancel() -> run() ném MosaicCancelled
+        self.cancel_token = CancelToken()
+        # placements (M, 6) [x, y, size, h, w, chỉ số tile] của lần run() gần nhất
+        self.placements = None
+
+    def cancel(self):
+        self.cancel_token.cancel()
 
     def run(self, progress_callback, frame_callback=None):
-        img, _ = multi_resolution_mosaic(
+        img, self.placements = self.session.run(
             target_path=self.target_path,
             tiles_folder=self.tiles_folder,
             base_tile=self.tile_size,
@@ -20,6 +63,17 @@ class MosaicGenerator:
             blend_factor=self.blend_factor,
             progress_callback=progress_callback,
             frame_callback=frame_callback,
-            frame_every=self.frame_every
+            frame_every=self.frame_every,
+            use_cache=self.use_cache,
+            tiles_db=self.tiles_db,
+            index=self.index,
+            match_k=self.match_k,
+            reuse_penalty=self.reuse_penalty,
+            usage_penalty=self.usage_penalty,
+            metrics=self.metrics,
+            preview_max=self.preview_max,
+            workers=self.workers,
+            cancel=self.cancel_token,
+            use_texture=self.use_texture
         )
         return img
\ No newline at end of file
@@ -2,13 +2,25 @@ import os
 import cv2
 import numpy as np
 import time
-from typing import Callable, List, Tuple, Dict
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple, Dict, Union
 import concurrent.futures
-from collections import deque
 
 # Import thuật toán lõi
-from algorithms.average_color import extract
+from algorithms.average_color import extract, extract_batch
+from algorithms.fast_decode import read_for_tile
 from algorithms.kdtree_nn import KDTreeNearestNeighbor
+from algorithms.color_lut import ColorLUTIndex, LUT_BITS, LUT_CANDIDATES
+from algorithms import tile_cache
+from algorithms.quadtree import plan_quadtree, SPLIT_THRESHOLD, BLOCK_Y, BLOCK_SIZE, BLOCK_H, BLOCK_W
+from algorithms.compositing import composite_level
+from algorithms.matching import new_label_map, pick_with_reuse, REUSE_PENALTY
+from algorithms.metrics import MetricsRecorder, maybe_stage
+from algorithms.preview import PreviewCanvas, preview_ratio, PREVIEW_MAX_SIDE
+from algorithms.cancel import CancelToken
 
 # --- CẤU HÌNH ---
 # Trọng số cho thành phần Texture (StdDev) khi query KD-Tree.
@@ -16,6 +28,28 @@ from algorithms.kdtree_nn import KDTreeNearestNeighbor
 # > 1.0: Ưu tiên đúng vân hơn đúng màu.
 TEXTURE_WEIGHT = 0.8 
 
+# Đặc trưng tile mặc định: False = màu trung bình (3 chiều), True = màu + độ lệch chuẩn (6 chiều, khớp cả vân).
+# Chọn cho từng kho bằng tham số use_texture (build_tiles_db, load_tile_levels, MosaicSession.tiles_db...);
+# giá trị này chỉ dùng khi use_texture = None.
+# Chỉ mục KDTreeNearestNeighbor tự chọn KD-Tree / brute-force theo số chiều nên cả 2 chế độ đều nhanh.
+USE_TEXTURE = False
+
+# Kho tiles từ ngưỡng này trở lên được decode bằng process pool (tránh GIL),
+# nhỏ hơn thì dùng thread pool (không tốn chi phí khởi tạo process).
+PROCESS_POOL_MIN_TILES = 2000
+
+# Số file mỗi task gửi cho pool (giảm chi phí IPC, vẫn báo tiến độ đều)
+INGEST_CHUNK = 64
+
+# Các loại chỉ mục tìm tile gần nhất có thể chọn cho từng level (xem build_tiles_db)
+INDEX_KINDS = ("kdtree", "lut")
+
+# Số tiles mỗi lô khi downscale / trích đặc trưng vector hóa (giới hạn bộ nhớ tạm)
+PYRAMID_CHUNK = 4096
+
+# Ghép song song: số vùng (dải ô lớn nhất) mỗi worker, nhiều hơn 1 để cân tải giữa vùng phẳng / chi tiết
+REGIONS_PER_WORKER = 4
+
 def level_sizes(base_tile: int, levels: int = 3) -> List[int]:
     """
     Tính toán danh sách các kích thước tile cần chuẩn bị.
@@ -46,17 +80,22 @@ def _list_image_files(folder: str):
     return files
 
 def _process_one_tile(args):
-    """Xử lý 1 tile: Đọc -> Resize -> Trích xuất đặc trưng (Màu + Texture)"""
-    path, tile_size = args
+    """
+    Xử lý 1 tile: Đọc -> Resize -> Trích xuất đặc trưng (Màu + Texture).
+    args = (path, tile_size, use_texture): use_texture được truyền tường minh vì worker process
+    khởi tạo bằng spawn (Windows, macOS) không thấy giá trị USE_TEXTURE đã đổi ở process chính.
+    """
+    path, tile_size, use_texture = args
     try:
-        img = cv2.imread(path)
+        # JPEG lớn được decode thẳng ở độ phân giải giảm (chỉ đọc header để chọn hệ số)
+        img = read_for_tile(path, tile_size)
         if img is None: return None
         
         # Resize về kích thước cần thiết
         img_small = cv2.resize(img, (tile_size, tile_size), interpolation=cv2.INTER_AREA)
         
         # Trích xuất đặc trưng (Mean + Std nếu file extract hỗ trợ)
-        feature_vec = extract(img_small) 
+        feature_vec = extract(img_small, use_texture=use_texture)
         
         # Nếu feature có chứa texture (vector 6 chiều), ta scale phần texture
         # để điều chỉnh độ ưu tiên
@@ -67,199 +106,839 @@ def _process_one_tile(args):
     except Exception:
         return None
 
-def prepare_tiles_parallel(file_list: List[str], tile_size: int,
-                            progress_callback: Callable[[float, str], None]) -> Tuple[np.ndarray, np.ndarray]:
-    """Load và xử lý tiles ban đầu (kích thước lớn nhất) bằng đa luồng."""
-    tiles = []
-    features = []
-    total = len(file_list)
+def _decode_chunk(start: int, paths: List[str], tile_size: int, use_texture: bool,
+                  tiles: np.ndarray, features: np.ndarray, ok: np.ndarray) -> int:
+    """Decode 1 lô file và ghi thẳng vào slot [start, start + len(paths)) của các mảng cấp phát sẵn."""
+    for i, path in enumerate(paths):
+        res = _process_one_tile((path, tile_size, use_texture))
+        if res is not None:
+            tiles[start + i] = res[0]
+            features[start + i] = res[1]
+            ok[start + i] = True
+    return len(paths)
 
+def _open_ingest_views(path: str, specs) -> List[np.memmap]:
+    """Các mảng (tiles, features, ok) nằm liền nhau trong 1 file tạm, specs = [(offset, shape, dtype)]."""
+    return [np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=shape) for offset, shape, dtype in specs]
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# Các view lên file tạm dùng chung + cờ use_texture trong worker process (gán 1 lần bởi _init_shared_worker)
+_shared_views = None
+
+def _init_shared_worker(path: str, specs, use_texture: bool):
+    global _shared_views
+    _shared_views = (_open_ingest_views(path, specs), use_texture)
+
+def _decode_chunk_shared(start: int, paths: List[str], tile_size: int) -> int:
+    (tiles, features, ok), use_texture = _shared_views
+    return _decode_chunk(start, paths, tile_size, use_texture, tiles, features, ok)
+
+def _compact_rows(arrays: List[np.ndarray], ok: np.ndarray) -> int:
+    """Dồn các hàng hợp lệ lên đầu mảng (tại chỗ, giữ thứ tự). Trả về số hàng hợp lệ."""
+    valid = np.flatnonzero(ok)
+    if valid.size == ok.size:
+        return valid.size
+    # Sao chép theo từng đoạn liên tiếp các hàng hợp lệ thay vì từng hàng
+    breaks = np.flatnonzero(np.diff(valid) != 1) + 1
+    dst = 0
+    for run in np.split(valid, breaks):
+        if run.size == 0:
+            continue
+        a, b = int(run[0]), int(run[-1]) + 1
+        if a != dst:
+            for arr in arrays:
+                arr[dst:dst + b - a] = arr[a:b]
+        dst += b - a
+    return dst
+
+def _load_tiles(file_list: List[str], tile_size: int,
+                progress_callback: Callable[[float, str], None],
+                use_processes: Optional[bool] = None,
+                use_texture: Optional[bool] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Như prepare_tiles_parallel nhưng trả thêm mask các file đọc thành công (không báo lỗi khi rỗng).
+    Mảng (N, s, s, 3) và (N, F) được cấp phát trước, mỗi file được decode thẳng vào slot của nó:
+      - thread pool: ghi trực tiếp vào mảng kết quả (không có bản sao trung gian; có file lỗi thì
+        sao các hàng hợp lệ ra mảng vừa đủ để không giữ hàng lỗi suốt phiên),
+      - process pool (kho lớn): ghi vào 1 file tạm được map bởi mọi process, mảng tiles trả về vẫn là
+        view lên file đó (không sao ra RAM thường -> bộ nhớ đỉnh ~1 lần kho tiles, trang nhớ của file
+        hệ điều hành có thể đẩy ra đĩa). Tên file bị xóa ngay (Windows: khi mảng cuối cùng bị thu hồi);
+        các hàng lỗi dồn về cuối file vẫn nằm trong mapping tới khi đó.
+    Không dùng SharedMemory cho kết quả: SharedMemory.close() unmap vùng nhớ dù còn view numpy trỏ vào.
+    Tiến độ được báo ngay khi từng lô hoàn thành.
+    use_texture: None = theo USE_TEXTURE của process gọi, được truyền xuống mọi worker.
+    """
+    if use_texture is None:
+        use_texture = USE_TEXTURE
+    total = len(file_list)
     progress_callback(0, f"Đang nạp {total} ảnh mẫu (size {tile_size}px)...")
 
-    tasks = [(path, tile_size) for path in file_list]
+    feat_dim = extract(np.zeros((1, 1, 3), dtype=np.uint8), use_texture=use_texture).shape[0]
+    shapes = [((total, tile_size, tile_size, 3), np.uint8), ((total, feat_dim), np.float32), ((total,), np.bool_)]
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = list(executor.map(_process_one_tile, tasks))
+    if use_processes is None:
+        use_processes = total >= PROCESS_POOL_MIN_TILES and (os.cpu_count() or 1) > 1
+    use_processes = use_processes and total > 0
 
-        for i, res in enumerate(results):
-            if res is not None:
-                tiles.append(res[0])
-                features.append(res[1])
-            
-            if i % 200 == 0:
-                progress_callback((i / total) * 100, f"Loading: {i}/{total}")
+    chunks = [(start, file_list[start:start + INGEST_CHUNK]) for start in range(0, total, INGEST_CHUNK)]
 
-    if not tiles:
+    def _run(executor, submit):
+        done = 0
+        futures = [submit(executor, start, paths) for start, paths in chunks]
+        try:
+            for fut in concurrent.futures.as_completed(futures):
+                done += fut.result()
+                progress_callback((done / total) * 100, f"Loading: {done}/{total}")
+        except BaseException:
+            # Lỗi / bị hủy (progress_callback ném MosaicCancelled): bỏ các lô chưa chạy thay vì chờ hết
+            for fut in futures:
+                fut.cancel()
+            raise
+
+    if not use_processes:
+        tiles, features, ok = [np.zeros(shape, dtype=dtype) for shape, dtype in shapes]
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            _run(executor, lambda ex, start, paths: ex.submit(
+                _decode_chunk, start, paths, tile_size, use_texture, tiles, features, ok))
+        n_ok = _compact_rows([tiles, features], ok)
+        if n_ok < total:
+            return tiles[:n_ok].copy(), features[:n_ok].copy(), ok
+        return tiles, features, ok
+
+    # File tạm chứa 3 mảng liền nhau (mỗi mảng căn 64 byte), được mở rộng sẵn tới đủ kích thước (file thưa)
+    specs, nbytes = [], 0
+    for shape, dtype in shapes:
+        specs.append((nbytes, shape, np.dtype(dtype).str))
+        nbytes += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 64) * 64
+    fd, path = tempfile.mkstemp(prefix="mosaic_tiles_", suffix=".bin")
+    try:
+        os.ftruncate(fd, nbytes)
+    finally:
+        os.close(fd)
+
+    views = []
+    try:
+        views = _open_ingest_views(path, specs)
+        tiles, features, ok = views
+        with concurrent.futures.ProcessPoolExecutor(initializer=_init_shared_worker,
+                                                    initargs=(path, specs, use_texture)) as executor:
+            _run(executor, lambda ex, start, paths: ex.submit(
+                _decode_chunk_shared, start, paths, tile_size))
+
+        n_ok = _compact_rows([tiles, features], ok)
+        # Tiles: mảng thường trỏ vào mapping (không phải memmap -> tile_cache.portable_tiles gửi theo giá trị)
+        return np.asarray(tiles)[:n_ok], np.array(features[:n_ok]), np.array(ok)
+    finally:
+        mapping = views[0].base if views else None
+        tiles = features = ok = views = None
+        try:
+            os.remove(path) # Mapping đang mở vẫn dùng được sau khi xóa tên file (POSIX)
+        except OSError:
+            if mapping is not None:
+                weakref.finalize(mapping, _remove_quietly, path)
+            else:
+                _remove_quietly(path)
+
+def prepare_tiles_parallel(file_list: List[str], tile_size: int,
+                            progress_callback: Callable[[float, str], None]) -> Tuple[np.ndarray, np.ndarray]:
+    """Load và xử lý tiles ban đầu (kích thước lớn nhất) song song (thread hoặc process pool)."""
+    tiles, features, _ = _load_tiles(file_list, tile_size, progress_callback)
+
+    if len(tiles) == 0:
         raise Exception(f"Không tìm thấy ảnh hợp lệ trong thư mục tiles!")
 
-    return np.array(tiles, dtype=np.uint8), np.array(features, dtype=np.float32)
+    return tiles, features
+
+def _halve_tiles(tiles: np.ndarray) -> np.ndarray:
+    """
+    Giảm 1/2 kích thước toàn bộ tiles (N, s, s, 3), s chẵn, bằng trung bình khối 2x2.
+    Các tile được xếp chồng thành 1 ảnh cao (N*s, s) rồi resize INTER_AREA 1 lần:
+    vì s chẵn nên mọi khối 2x2 nằm gọn trong 1 tile -> kết quả giống hệt resize từng tile.
+    """
+    n, s = tiles.shape[:2]
+    half = s // 2
+    out = np.empty((n, half, half, 3), dtype=np.uint8)
+    for c in range(0, n, PYRAMID_CHUNK):
+        chunk = tiles[c:c + PYRAMID_CHUNK]
+        m = len(chunk)
+        small = cv2.resize(chunk.reshape(m * s, s, 3), (half, m * half), interpolation=cv2.INTER_AREA)
+        out[c:c + m] = small.reshape(m, half, half, 3)
+    return out
+
+def _tile_features(tiles: np.ndarray, use_texture: bool) -> np.ndarray:
+    """Trích xuất đặc trưng cho cả mảng tiles theo lô (mean/std theo trục không gian)."""
+    feat_dim = extract(np.zeros((1, 1, 3), dtype=np.uint8), use_texture=use_texture).shape[0]
+    features = np.empty((len(tiles), feat_dim), dtype=np.float32)
+    for c in range(0, len(tiles), PYRAMID_CHUNK):
+        features[c:c + PYRAMID_CHUNK] = extract_batch(tiles[c:c + PYRAMID_CHUNK], use_texture=(feat_dim == 6))
+
+    # Nếu feature có chứa texture (vector 6 chiều), scale phần texture như _process_one_tile
+    if feat_dim == 6:
+        features[:, 3:] *= TEXTURE_WEIGHT
+    return features
 
 def resize_tiles_in_memory(base_tiles: np.ndarray, new_size: int, 
-                           progress_callback: Callable[[float, str], None]) -> Tuple[np.ndarray, np.ndarray]:
-    """Tạo tiles kích thước nhỏ hơn từ tiles đã load trên RAM."""
-    count = len(base_tiles)
+                           progress_callback: Callable[[float, str], None],
+                           use_texture: Optional[bool] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tạo tiles kích thước nhỏ hơn từ tiles đã load trên RAM.
+    Tỉ lệ lũy thừa 2 (luôn đúng với level_sizes): giảm dần từng nửa bằng _halve_tiles, vector hóa toàn mảng.
+    use_texture: loại đặc trưng (phải giống level gốc), None = theo USE_TEXTURE.
+    """
+    if use_texture is None:
+        use_texture = USE_TEXTURE
     progress_callback(0, f"Downscaling tiles về {new_size}px...")
-    
-    new_tiles = []
-    new_features = []
-    
-    for i, tile in enumerate(base_tiles):
-        small = cv2.resize(tile, (new_size, new_size), interpolation=cv2.INTER_AREA)
-        new_tiles.append(small)
-        
-        # Trích xuất lại đặc trưng ở size mới (quan trọng vì texture thay đổi theo size)
-        feat = extract(small)
-        if feat.shape[0] == 6:
-            feat[3:] *= TEXTURE_WEIGHT
-        new_features.append(feat)
-        
-        if i % 1000 == 0:
-             progress_callback((i / count) * 100, f"Resizing: {i}/{count}")
-             
-    return np.array(new_tiles, dtype=np.uint8), np.array(new_features, dtype=np.float32)
 
-def multi_resolution_mosaic(
-    target_path: str,
-    tiles_folder: str,
-    base_tile: int = 15,
-    levels: int = 3,
-    blend_factor: float = 0.2,
-    progress_callback: Callable[[float, str], None] = lambda p, m: None,
-    frame_callback=None,
-    frame_every: int = 150
-) -> Tuple[np.ndarray, List[int]]:
-    
-    # 1. Cấu hình Quadtree
-    # Ngưỡng chia cắt: Nếu độ lệch chuẩn trung bình vùng ảnh > ngưỡng này -> chia nhỏ
-    SPLIT_THRESHOLD = 20.0 
+    tiles = base_tiles
+    while tiles.shape[1] % 2 == 0 and tiles.shape[1] // 2 >= new_size:
+        tiles = _halve_tiles(tiles)
 
-    # --- SETUP DỮ LIỆU ---
-    target = cv2.imread(target_path)
-    if target is None: raise Exception("Lỗi đọc ảnh gốc!")
-    h_img, w_img = target.shape[:2]
+    if tiles.shape[1] != new_size:
+        # Tỉ lệ lẻ -> resize từng tile như cũ
+        tiles = np.array([cv2.resize(t, (new_size, new_size), interpolation=cv2.INTER_AREA) for t in tiles],
+                         dtype=np.uint8).reshape(len(tiles), new_size, new_size, 3)
+
+    # Trích xuất lại đặc trưng ở size mới (quan trọng vì texture thay đổi theo size)
+    return tiles, _tile_features(tiles, use_texture)
+
+def _build_levels(file_list: List[str], sizes: List[int],
+                  progress_callback: Callable[[float, str], None],
+                  metrics: Optional[MetricsRecorder] = None,
+                  use_texture: Optional[bool] = None):
+    """
+    Load tiles ở size lớn nhất rồi dựng kim tự tháp: mỗi level nhỏ hơn được tạo từ level ngay trên nó.
+    Trả về ({size: (tiles, features)}, ok_mask). use_texture: None = theo USE_TEXTURE, dùng cho mọi level.
+    """
+    if use_texture is None:
+        use_texture = USE_TEXTURE
+    with maybe_stage(metrics, "decode"):
+        base_t, base_f, ok = _load_tiles(file_list, sizes[0], progress_callback, use_texture=use_texture)
+    levels = {sizes[0]: (base_t, base_f)}
+    prev_t = base_t
+    with maybe_stage(metrics, "pyramid"):
+        for sz in sizes[1:]:
+            levels[sz] = resize_tiles_in_memory(prev_t, sz, progress_callback, use_texture)
+            prev_t = levels[sz][0]
+    if metrics is not None:
+        metrics.count("tiles_decoded", int(ok.sum()))
+    return levels, ok
+
+def load_tile_levels(file_list: List[str], sizes: List[int],
+                     progress_callback: Callable[[float, str], None],
+                     cache_dir: Optional[str] = None,
+                     metrics: Optional[MetricsRecorder] = None,
+                     allow_empty: bool = False,
+                     use_texture: Optional[bool] = None) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Chuẩn bị tiles + đặc trưng cho mọi level: {size: (tiles_array, features_array)}.
+    Nếu có cache_dir: chỉ decode những file mới / đã thay đổi (so theo path, mtime, size),
+    phần còn lại lấy thẳng từ cache trên đĩa. Khi có cache, tiles_array là memmap chỉ đọc lên atlas
+    trên đĩa (tile_cache.open_atlas): chỉ các tile thực sự được đặt vào ảnh mới chiếm RAM.
+    metrics: ghi thêm tiles_loaded / tiles_failed / tiles_from_cache (xem MetricsRecorder).
+    allow_empty: không có tile hợp lệ nào -> trả về mảng rỗng thay vì báo lỗi (VD: 1 shard của kho lớn).
+    use_texture: đặc trưng 6 chiều (màu + vân) thay vì 3 chiều, None = theo USE_TEXTURE.
+    Cache riêng theo số chiều đặc trưng và TEXTURE_WEIGHT.
+    """
+    return load_tile_levels_keyed(file_list, sizes, progress_callback, cache_dir, metrics, allow_empty,
+                                  use_texture)[0]
+
+def _file_sig_or_zero(path: str) -> Tuple[int, int]:
+    try:
+        return tile_cache.file_signature(path)
+    except OSError:
+        return (0, 0)
+
+def load_tile_levels_keyed(file_list: List[str], sizes: List[int],
+                           progress_callback: Callable[[float, str], None],
+                           cache_dir: Optional[str] = None,
+                           metrics: Optional[MetricsRecorder] = None,
+                           allow_empty: bool = False,
+                           use_texture: Optional[bool] = None):
+    """
+    Như load_tile_levels nhưng trả thêm thông tin từng hàng: (levels, keys, sigs, failed)
+    keys[i] / sigs[i] = đường dẫn tuyệt đối / (mtime, dung lượng) của tile ở hàng i,
+    failed = {đường dẫn: (mtime, dung lượng)} các file đọc lỗi. Dùng cho kho cập nhật dần (TileLibrary).
+    """
+    if use_texture is None:
+        use_texture = USE_TEXTURE
+    if cache_dir is None:
+        levels, ok = _build_levels(file_list, sizes, progress_callback, metrics, use_texture)
+        if metrics is not None:
+            metrics.count("tiles_loaded", len(levels[sizes[0]][0]))
+            metrics.count("tiles_failed", int(ok.size - ok.sum()))
+        if len(levels[sizes[0]][0]) == 0 and not allow_empty:
+            raise Exception(f"Không tìm thấy ảnh hợp lệ trong thư mục tiles!")
+        keys = [os.path.abspath(p) for p, good in zip(file_list, ok) if good]
+        sigs = [_file_sig_or_zero(p) for p, good in zip(file_list, ok) if good]
+        failed = {os.path.abspath(p): _file_sig_or_zero(p) for p, good in zip(file_list, ok) if not good}
+        return levels, keys, sigs, failed
+
+    f_dim = 6 if use_texture else 3
+    cache_file = tile_cache.cache_path(cache_dir, sizes, f_dim, TEXTURE_WEIGHT)
+    with maybe_stage(metrics, "cache_read"):
+        cached = tile_cache.load(cache_file, sizes)
+
+    n_cached = 0
+    row_of = {}
+    old_failed = {}
+    if cached is not None:
+        n_cached = len(cached["paths"])
+        row_of = {p: i for i, p in enumerate(cached["paths"].tolist())}
+        old_failed = dict(zip(cached["failed_paths"].tolist(),
+                              zip(cached["failed_mtimes"].tolist(), cached["failed_fsizes"].tolist())))
+
+    # Phân loại từng file: dùng lại từ cache / file lỗi đã biết / cần xử lý lại
+    keys, sigs, src_rows = [], [], []
+    fresh_paths = []
+    failed = {}
+    for path in file_list:
+        key = os.path.abspath(path)
+        try:
+            sig = tile_cache.file_signature(path)
+        except OSError:
+            continue # File bị xóa giữa lúc liệt kê và lúc đọc
+
+        r = row_of.get(key)
+        if r is not None and (int(cached["mtimes"][r]), int(cached["fsizes"][r])) == sig:
+            src_rows.append(r)
+        elif old_failed.get(key) == sig:
+            failed[key] = sig
+            continue
+        else:
+            fresh_paths.append(path)
+            src_rows.append(-1)
+        keys.append(key)
+        sigs.append(sig)
+
+    progress_callback(0, f"Cache: dùng lại {len(keys) - len(fresh_paths)} tiles, xử lý mới {len(fresh_paths)}")
+
+    fresh_levels = None
+    fresh_ok = np.zeros(0, dtype=bool)
+    if fresh_paths:
+        fresh_levels, fresh_ok = _build_levels(fresh_paths, sizes, progress_callback, metrics, use_texture)
+
+    # Ghép kết quả theo đúng thứ tự file_list.
+    # take: chỉ số vào mảng nối [tiles trong cache..., tiles mới đọc thành công...]
+    fresh_rows = np.cumsum(fresh_ok) - 1
+    keep, take = [], []
+    j = 0
+    for i, r in enumerate(src_rows):
+        if r < 0:
+            if fresh_ok[j]:
+                take.append(n_cached + int(fresh_rows[j]))
+                keep.append(i)
+            else:
+                failed[keys[i]] = sigs[i]
+            j += 1
+        else:
+            take.append(r)
+            keep.append(i)
+
+    if metrics is not None:
+        metrics.count("tiles_loaded", len(take))
+        metrics.count("tiles_failed", len(failed))
+        metrics.count("tiles_from_cache", len(take) - int(fresh_ok.sum()))
+
+    if not take:
+        if not allow_empty:
+            raise Exception(f"Không tìm thấy ảnh hợp lệ trong thư mục tiles!")
+        # Không ghi cache rỗng: lần nạp sau thử đọc lại các file lỗi
+        return ({sz: (np.empty((0, sz, sz, 3), dtype=np.uint8), np.empty((0, f_dim), dtype=np.float32))
+                 for sz in sizes}, [], [], failed)
+
+    kept_keys = [keys[i] for i in keep]
+    kept_sigs = [sigs[i] for i in keep]
+    changed = bool(fresh_paths) or take != list(range(n_cached)) or failed != old_failed
+    if not changed:
+        return ({sz: (cached[f"tiles_{sz}"], cached[f"feats_{sz}"]) for sz in sizes},
+                kept_keys, kept_sigs, failed)
+
+    take_arr = np.array(take, dtype=np.int64)
+    from_cache = take_arr < n_cached
+    levels = {}
+    for sz in sizes:
+        # Gom thẳng vào mảng kết quả (không nối cache + mới thành 1 bản sao trung gian);
+        # tiles trong cache là memmap -> chỉ đọc các hàng được giữ lại
+        t_arr = np.empty((len(take_arr), sz, sz, 3), dtype=np.uint8)
+        f_arr = np.empty((len(take_arr), f_dim), dtype=np.float32)
+        if from_cache.any():
+            rows = take_arr[from_cache]
+            t_arr[from_cache] = cached[f"tiles_{sz}"][rows]
+            f_arr[from_cache] = cached[f"feats_{sz}"][rows]
+        if not from_cache.all():
+            rows = take_arr[~from_cache] - n_cached
+            t_arr[~from_cache] = fresh_levels[sz][0][rows]
+            f_arr[~from_cache] = fresh_levels[sz][1][rows]
+        levels[sz] = (t_arr, f_arr)
+    fresh_levels = None
+
+    sig_arr = np.array(kept_sigs, dtype=np.int64).reshape(-1, 2)
+    with maybe_stage(metrics, "cache_write"):
+        saved = tile_cache.save(cache_file, sizes, kept_keys,
+                                sig_arr[:, 0], sig_arr[:, 1], levels, failed)
+    if not saved:
+        progress_callback(0, "Không ghi được cache tiles (bỏ qua).")
+    else:
+        # Đổi tiles vừa ghi sang memmap lên atlas -> giải phóng bản trong RAM
+        with maybe_stage(metrics, "cache_read"):
+            cached = tile_cache.load(cache_file, sizes)
+        if cached is not None and len(cached["paths"]) == len(take_arr):
+            levels = {sz: (cached[f"tiles_{sz}"], levels[sz][1]) for sz in sizes}
+
+    return levels, kept_keys, kept_sigs, failed
+
+def _build_index(kind: str, features: np.ndarray, size: int, cache_dir: Optional[str],
+                 progress_callback: Callable[[float, str], None]):
+    """Dựng chỉ mục láng giềng gần nhất cho 1 level: "kdtree" hoặc "lut" (bảng tra màu, có cache)."""
+    if kind == "kdtree":
+        return KDTreeNearestNeighbor(features)
+    if kind != "lut":
+        raise ValueError(f"index phải là một trong {INDEX_KINDS}")
 
-    file_list = _list_image_files(tiles_folder)
+    lut_file = None
+    if cache_dir is not None:
+        lut_file = tile_cache.lut_path(cache_dir, size, LUT_BITS, LUT_CANDIDATES)
+        arrays = tile_cache.load_lut(lut_file, features)
+        if arrays is not None:
+            return ColorLUTIndex.from_arrays(features, arrays)
+
+    progress_callback(0, f"Đang dựng bảng tra màu cho size {size}px...")
+    lut = ColorLUTIndex(features, LUT_BITS, LUT_CANDIDATES)
+    if lut_file is not None and not tile_cache.save_lut(lut_file, features, lut.to_arrays()):
+        progress_callback(0, "Không ghi được cache bảng tra màu (bỏ qua).")
+    return lut
+
+def build_tiles_db(tiles_folder: str, sizes: List[int],
+                   progress_callback: Callable[[float, str], None] = lambda p, m: None,
+                   use_cache: bool = True,
+                   cache_dir: Optional[str] = None,
+                   index: Union[str, Dict[int, str]] = "kdtree",
+                   metrics: Optional[MetricsRecorder] = None,
+                   use_texture: Optional[bool] = None) -> Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]]:
+    """
+    Nạp kho tiles và dựng chỉ mục cho mọi level: {size: (tiles_array, kdtree)}.
+    Có thể dựng 1 lần rồi dùng lại cho nhiều ảnh gốc (xem render_mosaic).
+    index: loại chỉ mục cho mọi level ("kdtree" / "lut") hoặc dict {size: loại} để chọn theo từng level
+    (size không có trong dict dùng "kdtree"). Bảng "lut" được cache cùng kho tiles.
+    metrics: MetricsRecorder nhận thời gian / bộ nhớ từng giai đoạn và số tiles nạp được / lỗi.
+    use_texture: khớp cả vân (đặc trưng 6 chiều, không dùng với "lut"), None = theo USE_TEXTURE.
+    """
+    with maybe_stage(metrics, "list_files"):
+        file_list = _list_image_files(tiles_folder)
     if not file_list: raise Exception("Thư mục tiles trống!")
-    
-    # Tính toán các level kích thước: [Max, ..., Min]
-    sizes = level_sizes(base_tile, levels)
-    max_size = sizes[0]
-    min_size = sizes[-1]
-    
-    progress_callback(5, f"Levels cấu hình: {sizes}")
 
-    # --- LOAD & PREPARE TILES ---
+    # Cache mặc định nằm trong thư mục tiles -> lần chạy sau không phải decode lại ảnh
+    if use_cache and cache_dir is None:
+        cache_dir = os.path.join(tiles_folder, tile_cache.CACHE_DIRNAME)
+    with maybe_stage(metrics, "load_tiles"):
+        levels_data = load_tile_levels(file_list, sizes, progress_callback,
+                                       cache_dir=cache_dir if use_cache else None, metrics=metrics,
+                                       use_texture=use_texture)
+
     # Database lưu tiles theo kích thước: {size: (tiles_array, kdtree)}
     tiles_db = {}
+    with maybe_stage(metrics, "build_index"):
+        for sz in sizes:
+            t_arr, f_arr = levels_data[sz]
+            kind = index.get(sz, "kdtree") if isinstance(index, dict) else index
+            tiles_db[sz] = (t_arr, _build_index(kind, f_arr, sz, cache_dir if use_cache else None,
+                                                progress_callback))
+    return tiles_db
+
+def _level_query(tiles_db, sz: int, min_size: int, level_stats: np.ndarray):
+    """(tiles_array, chỉ mục, ma trận truy vấn) cho các block dừng ở level sz."""
+    # Lấy bộ dataset phù hợp kích thước
+    current_dataset = tiles_db.get(sz)
+
+    # Fallback nếu không có size chính xác (do biên ảnh lẻ), dùng size nhỏ nhất
+    if current_dataset is None:
+        current_dataset = tiles_db[min_size]
+
+    t_arr, tree = current_dataset
+
+    # Tạo ma trận truy vấn (M, 3) hoặc (M, 6) từ thống kê của planner
+    # -> không phải gọi hàm extract() lại -> TỐI ƯU TỐC ĐỘ
+    # Kiểm tra xem KD-Tree đang dùng 3 chiều (chỉ màu) hay 6 chiều (màu + texture)
+    if tree.colors.shape[1] == 6:
+        query_mat = level_stats.copy()
+        query_mat[:, 3:] *= TEXTURE_WEIGHT
+    else:
+        query_mat = level_stats[:, :3]
+    return t_arr, tree, query_mat
+
+def region_bands(h_img: int, max_size: int, workers: int) -> List[Tuple[int, int]]:
+    """
+    Chia ảnh thành các dải ngang [y0, y1) gồm nguyên hàng ô size lớn nhất.
+    Mỗi ô lớn nhất là 1 cây Quadtree độc lập -> các dải ghép song song được, kết quả y hệt ghép cả ảnh.
+    """
+    n_rows = -(-h_img // max_size)
+    band_rows = max(1, -(-n_rows // (workers * REGIONS_PER_WORKER)))
+    step = band_rows * max_size
+    return [(y0, min(h_img, y0 + step)) for y0 in range(0, h_img, step)]
+
+class _RegionStages:
+    """
+    Thời gian các giai đoạn của 1 vùng, đo trong thread worker (cùng giao diện stage() với MetricsRecorder
+    để dùng với maybe_stage). Mỗi vùng 1 đối tượng riêng -> không tranh chấp; thread gọi gộp vào metrics.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((name, t0, time.perf_counter() - t0))
+
+def _render_region(mosaic: np.ndarray, target: np.ndarray, y0: int, y1: int,
+                   tiles_db, sizes: List[int], edge_cache: Dict,
+                   preview: Optional[PreviewCanvas], stages: Optional[_RegionStages],
+                   cancel: Optional[CancelToken], frame_every: int,
+                   on_chunk: Callable[[int], None]):
+    """
+    Quadtree -> Matching -> Ghép cho 1 dải [y0, y1) (ghi thẳng vào mosaic[y0:y1]).
+    Chỉ đọc tiles_db -> chạy được đồng thời trên nhiều thread với các dải khác nhau.
+    Ghép theo từng lô frame_every block như compose_mosaic tuần tự, sau mỗi lô gọi on_chunk(số pixel đã ghép).
+    stages: nhận thời gian từng giai đoạn (None = không đo, không đếm node / leaf).
+    Trả về (placements của dải theo tọa độ cả ảnh, danh sách số node / leaf đã duyệt).
+    """
+    if cancel is not None:
+        cancel.check()
+    band = mosaic[y0:y1]
+    with maybe_stage(stages, "plan_quadtree"):
+        blocks, stats = plan_quadtree(target[y0:y1], sizes, SPLIT_THRESHOLD)
+
+    placements, visits_all = [], []
+    for sz in sizes:
+        sel = blocks[:, BLOCK_SIZE] == sz
+        if not sel.any():
+            continue
+        level_blocks = blocks[sel]
+        t_arr, tree, query_mat = _level_query(tiles_db, sz, sizes[-1], stats[sel])
+
+        visits = {} if stages is not None else None
+        with maybe_stage(stages, "matching"):
+            _, idx_matches = tree.query_batch(query_mat, visit_counts=visits)
+
+        global_blocks = level_blocks.astype(np.int64)
+        global_blocks[:, BLOCK_Y] += y0
+        for c in range(0, len(level_blocks), frame_every):
+            if cancel is not None:
+                cancel.check()
+            chunk = level_blocks[c:c + frame_every]
+            with maybe_stage(stages, "compositing"):
+                composite_level(band, chunk, t_arr, idx_matches[c:c + frame_every], edge_cache)
+            if preview is not None:
+                with maybe_stage(stages, "preview_paint"):
+                    preview.paint(global_blocks[c:c + frame_every], t_arr, idx_matches[c:c + frame_every])
+            on_chunk(int((chunk[:, BLOCK_H].astype(np.int64) * chunk[:, BLOCK_W]).sum()))
+
+        placements.append(np.column_stack([global_blocks, idx_matches]))
+        if visits:
+            visits_all.append(visits)
+    return placements, visits_all
+
+def _compose_parallel(target, tiles_db, sizes, progress_callback, frame_callback, frame, mosaic,
+                      preview, metrics, workers, cancel, frame_every):
+    """
+    Ghép các dải (region_bands) trên thread pool. Thread gọi báo tiến độ / preview (tối đa 30fps) trong lúc
+    các vùng đang chạy, rồi gộp thời gian từng giai đoạn của mọi vùng vào metrics (cộng dồn qua các thread).
+    """
+    h_img, w_img = target.shape[:2]
+    total_pixels = h_img * w_img
+    bands = region_bands(h_img, sizes[0], workers)
+    edge_cache = {}
+    results = [None] * len(bands)
+    region_stages = [_RegionStages() if metrics is not None else None for _ in bands]
 
-    # 1. Load tiles ở size lớn nhất
-    base_t, base_f = prepare_tiles_parallel(file_list, max_size, progress_callback)
-    tiles_db[max_size] = (base_t, KDTreeNearestNeighbor(base_f))
+    done_lock = threading.Lock()
+    done_pixels = [0]
 
-    # 2. Downscale cho các size nhỏ hơn
-    for sz in sizes[1:]:
-        t_arr, f_arr = resize_tiles_in_memory(base_t, sz, progress_callback)
-        tiles_db[sz] = (t_arr, KDTreeNearestNeighbor(f_arr))
+    def _on_chunk(n: int):
+        with done_lock:
+            done_pixels[0] += n
+
+    last_pct = -1
+    last_ui_update = time.time()
+
+    with maybe_stage(metrics, "regions"):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_render_region, mosaic, target, y0, y1, tiles_db, sizes,
+                                       edge_cache, preview, region_stages[i], cancel, frame_every, _on_chunk): i
+                       for i, (y0, y1) in enumerate(bands)}
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, timeout=0.033,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                    for fut in done:
+                        results[futures[fut]] = fut.result()
+                    if cancel is not None:
+                        cancel.check()
+
+                    pct = min(100, int(done_pixels[0] / total_pixels * 100))
+                    if pct != last_pct:
+                        progress_callback(30 + (pct * 0.7), f"Rendering: {pct}%")
+                        last_pct = pct
+                    if frame_callback:
+                        now = time.time()
+                        if now - last_ui_update > 0.033:
+                            frame_callback(frame)
+                            last_ui_update = now
+            except BaseException:
+                # Hủy / lỗi: bỏ các vùng chưa bắt đầu, chờ các vùng đang chạy rồi ném lại
+                for fut in futures:
+                    fut.cancel()
+                raise
+
+        if metrics is not None:
+            for stages in region_stages:
+                for name, t0, wall in stages.events:
+                    metrics.record(name, t0, wall)
+
+    placements = [p for band_placements, _ in results for p in band_placements]
+    if metrics is not None:
+        for _, visits_all in results:
+            for visits in visits_all:
+                metrics.observe("kd_nodes_visited", visits["nodes"])
+                metrics.observe("kd_leaves_scanned", visits["leaves"])
+    return placements
+
+def compose_mosaic(
+    target: np.ndarray,
+    tiles_db: Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]],
+    sizes: List[int],
+    progress_callback: Callable[[float, str], None] = lambda p, m: None,
+    frame_callback=None,
+    frame_every: int = 150,
+    match_k: int = 1,
+    reuse_penalty: float = REUSE_PENALTY,
+    usage_penalty: float = 0.0,
+    metrics: Optional[MetricsRecorder] = None,
+    preview_max: Optional[int] = PREVIEW_MAX_SIDE,
+    workers: Optional[int] = None,
+    cancel: Optional[CancelToken] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Phần ghép của render_mosaic (Quadtree -> Matching -> Ghép), chưa blend.
+    Trả về (mosaic, placements): placements (M, 6) = [x, y, size, h, w, chỉ số tile] theo thứ tự đã ghép.
+    Giữ lại 2 giá trị này thì đổi blend_factor chỉ cần gọi blend_mosaic.
+    frame_callback nhận ảnh preview thu nhỏ (cạnh dài <= preview_max, xem PreviewCanvas);
+    preview_max=None -> nhận thẳng mosaic độ phân giải đầy đủ.
+    workers: số thread ghép song song theo dải (None = số CPU). Kết quả giống hệt ghép tuần tự;
+    chế độ chống lặp tile (match_k > 1) cần thứ tự toàn ảnh nên luôn chạy tuần tự.
+    cancel: CancelToken, kiểm tra giữa các vùng / lô ghép (ném MosaicCancelled).
+    """
+    h_img, w_img = target.shape[:2]
+    min_size = sizes[-1]
+    if workers is None:
+        workers = os.cpu_count() or 1
 
     # --- QUADTREE PROCESS ---
     progress_callback(30, "Đang ghép tranh (Adaptive Mode)...")
     mosaic = np.zeros_like(target)
-    
-    # Queue chứa (x, y, size). Bắt đầu với lưới lớn nhất.
-    queue = deque()
-    for y in range(0, h_img, max_size):
-        for x in range(0, w_img, max_size):
-            queue.append((x, y, max_size))
+
+    # Canvas preview nhỏ chỉ cần khi có frame_callback (ratio 1 -> gửi thẳng mosaic)
+    preview = None
+    if frame_callback is not None:
+        ratio = preview_ratio(h_img, w_img, preview_max)
+        if ratio > 1:
+            preview = PreviewCanvas(h_img, w_img, ratio)
+    frame = preview.image if preview is not None else mosaic
+
+    if workers > 1 and match_k == 1 and len(region_bands(h_img, sizes[0], workers)) > 1:
+        placements = _compose_parallel(target, tiles_db, sizes, progress_callback, frame_callback,
+                                       frame, mosaic, preview, metrics, workers, cancel, frame_every)
+        placements = np.concatenate(placements) if placements else np.zeros((0, 6), dtype=np.int64)
+        if metrics is not None:
+            metrics.set("blocks_per_level",
+                        {int(sz): int((placements[:, BLOCK_SIZE] == sz).sum()) for sz in sizes})
+        if frame_callback: frame_callback(frame)
+        return mosaic, placements
+
+    # Lập kế hoạch chia Quadtree cho cả ảnh 1 lần (summed-area table, vector hóa)
+    # blocks: (M, 5) [x, y, size, h, w], stats: (M, 6) [mean BGR, std BGR]
+    with maybe_stage(metrics, "plan_quadtree"):
+        blocks, stats = plan_quadtree(target, sizes, SPLIT_THRESHOLD)
+    if metrics is not None:
+        metrics.set("blocks_per_level", {int(sz): int((blocks[:, BLOCK_SIZE] == sz).sum()) for sz in sizes})
 
     total_pixels = h_img * w_img
     processed_pixels = 0
-    blocks_count = 0
     
     last_ui_update = time.time()
 
-    while queue:
-        x, y, sz = queue.popleft() # Dùng popleft (BFS) để hiển thị dần từ thô đến tinh
-        
-        # Xử lý biên ảnh
-        h_slice = min(sz, h_img - y)
-        w_slice = min(sz, w_img - x)
-        if h_slice <= 0 or w_slice <= 0: continue
+    # Cache các tile đã resize cho block ở biên ảnh
+    edge_cache = {}
 
-        roi = target[y:y+h_slice, x:x+w_slice]
-        
-        # Tính toán thống kê màu và texture của vùng ảnh đích (ROI)
-        # mean: (3,1), stddev: (3,1)
-        mean, stddev = cv2.meanStdDev(roi)
-        avg_std = np.mean(stddev)
-        
-        # QUYẾT ĐỊNH: Chia nhỏ hay Dừng?
-        # Chia nhỏ nếu: Chưa đạt size nhỏ nhất VÀ độ phức tạp chi tiết > ngưỡng
-        should_split = (sz > min_size) and (avg_std > SPLIT_THRESHOLD)
-
-        if should_split:
-            # Chia làm 4 ô con
-            half = sz // 2
-            queue.append((x, y, half))
-            queue.append((x + half, y, half))
-            queue.append((x, y + half, half))
-            queue.append((x + half, y + half, half))
-        else:
-            # TÌM ẢNH GHÉP (MATCHING)
-            # Lấy bộ dataset phù hợp kích thước
-            current_dataset = tiles_db.get(sz)
-            
-            # Fallback nếu không có size chính xác (do biên ảnh lẻ), dùng size nhỏ nhất
-            if current_dataset is None:
-                current_dataset = tiles_db[min_size] 
+    # Các block đã ghép kèm tile được chọn, theo từng level
+    placements = []
 
-            t_arr, tree = current_dataset
-            
-            # Tạo vector truy vấn (Query Vector)
-            # Tận dụng luôn kết quả mean, stddev vừa tính để ko phải gọi hàm extract() lại -> TỐI ƯU TỐC ĐỘ
-            mean_flat = mean.flatten().astype(np.float32)
-            
-            # Kiểm tra xem KD-Tree đang dùng 3 chiều (chỉ màu) hay 6 chiều (màu + texture)
-            if tree.colors.shape[1] == 6:
-                std_flat = stddev.flatten().astype(np.float32) * TEXTURE_WEIGHT
-                query_vec = np.concatenate([mean_flat, std_flat])
-            else:
-                query_vec = mean_flat
+    # Trạng thái cho chế độ chống lặp tile (dùng chung qua mọi level)
+    if match_k > 1:
+        label_map = new_label_map(h_img, w_img, min_size)
+        usage = np.zeros(len(tiles_db[sizes[0]][0]), dtype=np.int64)
+
+    # Duyệt theo từng level để hiển thị dần từ thô đến tinh.
+    # Mỗi level: matching toàn bộ các block dừng lại ở size này trong 1 lần (query_batch).
+    for sz in sizes:
+        sel = blocks[:, BLOCK_SIZE] == sz
+        if not sel.any():
+            continue
+        level_blocks = blocks[sel]
 
-            # Query KD-Tree
-            idx_match = tree.query(query_vec)
-            best_tile = t_arr[idx_match]
+        # TÌM ẢNH GHÉP (MATCHING)
+        if cancel is not None:
+            cancel.check()
+        t_arr, tree, query_mat = _level_query(tiles_db, sz, min_size, stats[sel])
 
-            # Gán vào ảnh kết quả (cắt nếu ở biên)
-            if best_tile.shape[:2] != (h_slice, w_slice):
-                # Resize nhẹ nếu kích thước không khớp hoàn toàn (do fallback)
-                tile_resized = cv2.resize(best_tile, (w_slice, h_slice))
-                mosaic[y:y+h_slice, x:x+w_slice] = tile_resized
+        # Query KD-Tree cho cả level
+        with maybe_stage(metrics, "matching"):
+            if match_k > 1:
+                dists, cands = tree.query_k_batch(query_mat, match_k)
+                idx_matches = pick_with_reuse(level_blocks, dists, cands, label_map, usage, min_size,
+                                              reuse_penalty, usage_penalty)
+            elif metrics is not None:
+                visits = {}
+                _, idx_matches = tree.query_batch(query_mat, visit_counts=visits)
+                metrics.observe("kd_nodes_visited", visits["nodes"])
+                metrics.observe("kd_leaves_scanned", visits["leaves"])
             else:
-                mosaic[y:y+h_slice, x:x+w_slice] = best_tile[:h_slice, :w_slice]
+                _, idx_matches = tree.query_batch(query_mat)
+        placements.append(np.column_stack([level_blocks, idx_matches]).astype(np.int64))
+
+        # Ghép ảnh theo từng lô frame_every block (vector hóa), giữa các lô cập nhật tiến độ / preview
+        for c in range(0, len(level_blocks), frame_every):
+            if cancel is not None:
+                cancel.check()
+            chunk = level_blocks[c:c + frame_every]
+            with maybe_stage(metrics, "compositing"):
+                composite_level(mosaic, chunk, t_arr, idx_matches[c:c + frame_every], edge_cache)
+            if preview is not None:
+                with maybe_stage(metrics, "preview_paint"):
+                    preview.paint(chunk, t_arr, idx_matches[c:c + frame_every])
 
             # Cập nhật tiến độ
-            processed_pixels += (h_slice * w_slice)
-            blocks_count += 1
+            processed_pixels += int((chunk[:, BLOCK_H] * chunk[:, BLOCK_W]).sum())
+
+            pct = min(100, int(processed_pixels / total_pixels * 100))
+            progress_callback(30 + (pct * 0.7), f"Rendering: {pct}%")
             
-            if blocks_count % frame_every == 0:
-                pct = min(100, int(processed_pixels / total_pixels * 100))
-                progress_callback(30 + (pct * 0.7), f"Rendering: {pct}%")
-                
-                # Cập nhật preview (giới hạn 30fps)
-                if frame_callback:
-                    now = time.time()
-                    if now - last_ui_update > 0.033:
-                        frame_callback(mosaic)
-                        last_ui_update = now
+            # Cập nhật preview (giới hạn 30fps)
+            if frame_callback:
+                now = time.time()
+                if now - last_ui_update > 0.033:
+                    frame_callback(frame)
+                    last_ui_update = now
 
     # Final preview update
-    if frame_callback: frame_callback(mosaic)
+    if frame_callback: frame_callback(frame)
+
+    placements = np.concatenate(placements) if placements else np.zeros((0, 6), dtype=np.int64)
+    return mosaic, placements
+
+def blend_mosaic(mosaic: np.ndarray, target: np.ndarray, blend_factor: float,
+                 progress_callback: Callable[[float, str], None] = lambda p, m: None,
+                 metrics: Optional[MetricsRecorder] = None) -> np.ndarray:
+    """Overlay ảnh gốc mờ lên trên mosaic để làm mềm các cạnh (trả về ảnh mới, không sửa mosaic)."""
+    if blend_factor <= 0:
+        return mosaic
+    progress_callback(100, "Đang hòa trộn (Blending)...")
+    with maybe_stage(metrics, "blending"):
+        return cv2.addWeighted(mosaic, 1.0 - blend_factor, target, blend_factor, 0)
+
+def render_mosaic(
+    target: np.ndarray,
+    tiles_db: Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]],
+    sizes: List[int],
+    blend_factor: float = 0.2,
+    progress_callback: Callable[[float, str], None] = lambda p, m: None,
+    frame_callback=None,
+    frame_every: int = 150,
+    match_k: int = 1,
+    reuse_penalty: float = REUSE_PENALTY,
+    usage_penalty: float = 0.0,
+    metrics: Optional[MetricsRecorder] = None,
+    preview_max: Optional[int] = PREVIEW_MAX_SIDE,
+    workers: Optional[int] = None,
+    cancel: Optional[CancelToken] = None
+) -> np.ndarray:
+    """
+    Ghép tranh cho 1 ảnh gốc (BGR) từ tiles_db đã dựng sẵn: Quadtree -> Matching -> Ghép -> Blend.
+    frame_callback nhận ảnh preview thu nhỏ (cạnh dài <= preview_max), xem compose_mosaic.
+    match_k > 1: lấy k tile gần nhất cho mỗi block rồi chọn theo phạt lặp tile ở ô kề
+    (reuse_penalty) và số lần đã dùng (usage_penalty), xem matching.pick_with_reuse.
+    metrics: MetricsRecorder nhận thời gian từng giai đoạn, số block mỗi level, histogram số node /
+    leaf KD-Tree duyệt mỗi truy vấn và thời gian nằm trong progress / frame callback.
+    """
+    if metrics is not None:
+        progress_callback = metrics.timed_callback("progress", progress_callback)
+        frame_callback = metrics.timed_callback("preview", frame_callback)
+    mosaic, _ = compose_mosaic(target, tiles_db, sizes, progress_callback, frame_callback, frame_every,
+                               match_k, reuse_penalty, usage_penalty, metrics, preview_max, workers, cancel)
+    return blend_mosaic(mosaic, target, blend_factor, progress_callback, metrics)
+
+def multi_resolution_mosaic(
+    target_path: str,
+    tiles_folder: str,
+    base_tile: int = 15,
+    levels: int = 3,
+    blend_factor: float = 0.2,
+    progress_callback: Callable[[float, str], None] = lambda p, m: None,
+    frame_callback=None,
+    frame_every: int = 150,
+    use_cache: bool = True,
+    cache_dir: Optional[str] = None,
+    tiles_db: Optional[Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]]] = None,
+    index: Union[str, Dict[int, str]] = "kdtree",
+    match_k: int = 1,
+    reuse_penalty: float = REUSE_PENALTY,
+    usage_penalty: float = 0.0,
+    metrics: Optional[MetricsRecorder] = None,
+    preview_max: Optional[int] = PREVIEW_MAX_SIDE,
+    workers: Optional[int] = None,
+    cancel: Optional[CancelToken] = None,
+    use_texture: Optional[bool] = None
+) -> Tuple[np.ndarray, List[int]]:
     
-    # --- BLENDING ---
-    if blend_factor > 0:
-        progress_callback(100, "Đang hòa trộn (Blending)...")
-        # Overlay ảnh gốc mờ lên trên mosaic để làm mềm các cạnh
-        mosaic = cv2.addWeighted(mosaic, 1.0 - blend_factor, target, blend_factor, 0)
+    # --- SETUP DỮ LIỆU ---
+    # metrics (MetricsRecorder): thu số liệu từng giai đoạn, đọc bằng metrics.to_dict() / metrics.dump(path)
+    try:
+        with maybe_stage(metrics, "read_target"):
+            target = cv2.imread(target_path)
+        if target is None: raise Exception("Lỗi đọc ảnh gốc!")
+
+        # Tính toán các level kích thước: [Max, ..., Min]
+        sizes = level_sizes(base_tile, levels)
+
+        progress_callback(5, f"Levels cấu hình: {sizes}")
+
+        # --- LOAD & PREPARE TILES ---
+        # Có thể truyền sẵn tiles_db (dựng bằng build_tiles_db) để không phải nạp lại kho tiles
+        if tiles_db is None:
+            with maybe_stage(metrics, "tiles_db"):
+                tiles_db = build_tiles_db(tiles_folder, sizes, progress_callback,
+                                          use_cache=use_cache, cache_dir=cache_dir, index=index,
+                                          metrics=metrics, use_texture=use_texture)
+
+        # match_k > 1: chọn trong k ứng viên để tránh lặp tile (VD: match_k=matching.REUSE_K)
+        with maybe_stage(metrics, "render"):
+            mosaic = render_mosaic(target, tiles_db, sizes, blend_factor,
+                                   progress_callback, frame_callback, frame_every,
+                                   match_k, reuse_penalty, usage_penalty, metrics, preview_max,
+                                   workers, cancel)
+    finally:
+        # Tắt tracemalloc kể cả khi lỗi giữa chừng
+        if metrics is not None:
+            metrics.finish()
 
     progress_callback(100, "Hoàn tất!")
-    return mosaic, sizes
\ No newline at end of file
+    return mosaic, sizes
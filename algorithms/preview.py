@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+from typing import Dict
+
+from algorithms.quadtree import BLOCK_X, BLOCK_Y
+
+# Cạnh dài tối đa (px) của ảnh preview gửi cho frame_callback
+PREVIEW_MAX_SIDE = 800
+
+def preview_ratio(h_img: int, w_img: int, max_side: int = PREVIEW_MAX_SIDE) -> int:
+    """Tỉ lệ thu nhỏ nguyên nhỏ nhất để cạnh dài của preview <= max_side (1 = không thu nhỏ)."""
+    if not max_side or max_side <= 0:
+        return 1
+    return max(1, -(-max(h_img, w_img) // max_side))
+
+class PreviewCanvas:
+    """
+    Ảnh preview thu nhỏ 1/ratio của mosaic, được vẽ song song với lúc ghép:
+    mỗi tile đặt vào mosaic cũng được đặt vào canvas ở độ phân giải preview
+    -> chi phí preview tỉ lệ với kích thước preview, không phụ thuộc kích thước ảnh kết quả.
+
+    Tile level size s được thu về ceil(s / ratio) px (tính lười, chỉ cho các tile đã dùng).
+    Khi ratio không chia hết s, các ô preview có thể chồng nhau 1 px (chỉ dùng để hiển thị).
+    """
+
+    def __init__(self, h_img: int, w_img: int, ratio: int):
+        self.ratio = int(ratio)
+        self.image = np.zeros((-(-h_img // self.ratio), -(-w_img // self.ratio), 3), dtype=np.uint8)
+        # {size: (tiles thu nhỏ (N, p, p, 3), mask đã tính (N,))}
+        self._small: Dict[int, tuple] = {}
+
+    def _small_tiles(self, tiles: np.ndarray, idxs: np.ndarray) -> np.ndarray:
+        size = int(tiles.shape[1])
+        p = -(-size // self.ratio)
+        entry = self._small.get(size)
+        if entry is None or len(entry[0]) < len(tiles):
+            entry = (np.zeros((len(tiles), p, p, 3), dtype=np.uint8), np.zeros(len(tiles), dtype=bool))
+            self._small[size] = entry
+        small, ready = entry
+
+        todo = np.unique(idxs[~ready[idxs]])
+        for i in todo.tolist():
+            small[i] = cv2.resize(tiles[i], (p, p), interpolation=cv2.INTER_AREA)
+        ready[todo] = True
+        return small
+
+    def paint(self, blocks: np.ndarray, tiles: np.ndarray, idxs: np.ndarray):
+        """Vẽ các block của 1 level (cùng size = tiles.shape[1]) với tile idxs lên canvas."""
+        if len(blocks) == 0:
+            return
+        idxs = np.asarray(idxs, dtype=np.int64)
+        small = self._small_tiles(tiles, idxs)
+        p = small.shape[1]
+        h, w = self.image.shape[:2]
+
+        # Ô vượt mép canvas (block ở biên ảnh) được kẹp về hàng / cột cuối
+        offs = np.arange(p)
+        rows = np.minimum(blocks[:, BLOCK_Y, None] // self.ratio + offs, h - 1)
+        cols = np.minimum(blocks[:, BLOCK_X, None] // self.ratio + offs, w - 1)
+        self.image[rows[:, :, None], cols[:, None, :]] = small[idxs]
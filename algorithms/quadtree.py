@@ -0,0 +1,131 @@
+import numpy as np
+from typing import List, Tuple
+
+# Ngưỡng chia cắt mặc định: Nếu độ lệch chuẩn trung bình vùng ảnh > ngưỡng này -> chia nhỏ
+SPLIT_THRESHOLD = 20.0
+
+# Cột của mảng blocks trả về từ plan_quadtree
+BLOCK_X, BLOCK_Y, BLOCK_SIZE, BLOCK_H, BLOCK_W = range(5)
+
+def _cell_sums(src: np.ndarray, cell: int, dtype) -> np.ndarray:
+    """
+    Tổng theo từng ô cell x cell (ô cuối có thể thiếu) -> shape (ceil(h/cell), ceil(w/cell), C).
+    Cộng dồn các hàng / cột cách nhau cell bằng slice có bước: chỉ 2*cell phép cộng vector hóa,
+    nhanh hơn nhiều so với reduceat / sum có đổi kiểu trên toàn ảnh.
+    """
+    rows = src[0::cell].astype(np.uint32)
+    for i in range(1, cell):
+        part = src[i::cell]
+        rows[:part.shape[0]] += part
+
+    cols = rows[:, 0::cell].astype(dtype)
+    for i in range(1, cell):
+        part = rows[:, i::cell]
+        cols[:, :part.shape[1]] += part
+    return cols
+
+def _grid_tables(target: np.ndarray, cell: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bảng tổng tích lũy (summed-area table) của giá trị pixel và bình phương,
+    lấy mẫu trên lưới các ô cell x cell (ô cuối mỗi hàng/cột có thể bị cắt ở biên).
+    Mọi block của quadtree đều có góc nằm trên lưới này nên không cần SAT ở độ phân giải đầy đủ.
+    Trả về (S, Q) shape (gh+1, gw+1, C), kiểu int64 -> tính toán chính xác tuyệt đối.
+    """
+    h_img, w_img = target.shape[:2]
+    img = target.reshape(h_img, w_img, -1)
+    channels = img.shape[2]
+    gh = -(-h_img // cell)
+    gw = -(-w_img // cell)
+
+    cell_sum = np.empty((gh, gw, channels), dtype=np.int64)
+    cell_sq = np.empty((gh, gw, channels), dtype=np.int64)
+
+    # Xử lý theo dải hàng để bộ nhớ tạm (bình phương) không phụ thuộc kích thước ảnh
+    band_cells = max(1, (1 << 22) // max(1, w_img * channels * cell))
+    for gy0 in range(0, gh, band_cells):
+        band = img[gy0 * cell:(gy0 + band_cells) * cell]
+        gy1 = gy0 + -(-band.shape[0] // cell)
+
+        cell_sum[gy0:gy1] = _cell_sums(band, cell, np.int64)
+        # 255^2 = 65025 vẫn vừa uint16
+        cell_sq[gy0:gy1] = _cell_sums(np.multiply(band, band, dtype=np.uint16), cell, np.int64)
+
+    S = np.zeros((gh + 1, gw + 1, channels), dtype=np.int64)
+    Q = np.zeros((gh + 1, gw + 1, channels), dtype=np.int64)
+    S[1:, 1:] = cell_sum.cumsum(axis=0).cumsum(axis=1)
+    Q[1:, 1:] = cell_sq.cumsum(axis=0).cumsum(axis=1)
+    return S, Q
+
+def _box(table: np.ndarray, gy0, gx0, gy1, gx1) -> np.ndarray:
+    """Tổng trên các hình chữ nhật [gy0, gy1) x [gx0, gx1) của lưới (vector hóa)."""
+    return table[gy1, gx1] - table[gy0, gx1] - table[gy1, gx0] + table[gy0, gx0]
+
+def plan_quadtree(target: np.ndarray, sizes: List[int],
+                  split_threshold: float = SPLIT_THRESHOLD) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lập kế hoạch chia Quadtree cho toàn ảnh mà không phải quét lại ROI ở mỗi level.
+    sizes: danh sách kích thước [Max, ..., Min] (lũy thừa 2 lần nhau, xem level_sizes).
+
+    Trả về:
+      blocks: int32 (M, 5) các leaf [x, y, size, h, w] (h, w đã cắt theo biên ảnh),
+              sắp theo level từ thô đến tinh (cùng thứ tự duyệt BFS).
+      stats:  float32 (M, 2C) [mean..., std...] của vùng ảnh tương ứng mỗi leaf
+              (cùng giá trị với cv2.meanStdDev).
+    """
+    h_img, w_img = target.shape[:2]
+    max_size = sizes[0]
+    min_size = sizes[-1]
+
+    S, Q = _grid_tables(target, min_size)
+    gh, gw = S.shape[0] - 1, S.shape[1] - 1
+
+    # Lưới lớn nhất
+    ys, xs = np.meshgrid(np.arange(0, h_img, max_size), np.arange(0, w_img, max_size), indexing="ij")
+    x = xs.ravel().astype(np.int64)
+    y = ys.ravel().astype(np.int64)
+
+    out_blocks = []
+    out_stats = []
+    for sz in sizes:
+        if x.size == 0:
+            break
+
+        # Tọa độ trên lưới SAT (cắt theo biên ảnh)
+        step = sz // min_size
+        gx0 = x // min_size
+        gy0 = y // min_size
+        gx1 = np.minimum(gx0 + step, gw)
+        gy1 = np.minimum(gy0 + step, gh)
+        h_slice = np.minimum(sz, h_img - y)
+        w_slice = np.minimum(sz, w_img - x)
+        count = (h_slice * w_slice)[:, None].astype(np.float64)
+
+        mean = _box(S, gy0, gx0, gy1, gx1) / count
+        var = _box(Q, gy0, gx0, gy1, gx1) / count - mean * mean
+        std = np.sqrt(np.maximum(var, 0.0))
+
+        # QUYẾT ĐỊNH: Chia nhỏ nếu chưa đạt size nhỏ nhất VÀ độ phức tạp chi tiết > ngưỡng
+        if sz > min_size:
+            split = std.mean(axis=1) > split_threshold
+        else:
+            split = np.zeros(x.size, dtype=bool)
+
+        leaf = ~split
+        if leaf.any():
+            out_blocks.append(np.stack([x[leaf], y[leaf], np.full(int(leaf.sum()), sz),
+                                        h_slice[leaf], w_slice[leaf]], axis=1))
+            out_stats.append(np.concatenate([mean[leaf], std[leaf]], axis=1))
+
+        # Chia làm 4 ô con theo thứ tự (x, y), (x+h, y), (x, y+h), (x+h, y+h), bỏ ô nằm ngoài ảnh
+        half = sz // 2
+        cx = (x[split][:, None] + np.array([0, half, 0, half])).ravel()
+        cy = (y[split][:, None] + np.array([0, 0, half, half])).ravel()
+        inside = (cx < w_img) & (cy < h_img)
+        x, y = cx[inside], cy[inside]
+
+    channels = S.shape[2]
+    if not out_blocks:
+        return np.zeros((0, 5), dtype=np.int32), np.zeros((0, 2 * channels), dtype=np.float32)
+
+    return (np.concatenate(out_blocks).astype(np.int32),
+            np.concatenate(out_stats).astype(np.float32))
@@ -0,0 +1,628 @@
+import os
+import json
+import time
+import queue
+import socket
+import uuid
+import threading
+import http.client
+import urllib.parse
+import socketserver
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from algorithms.session import MosaicSession
+from algorithms.multiresolution import level_sizes, render_mosaic, INDEX_KINDS
+from algorithms.cancel import CancelToken, MosaicCancelled
+
+# Số job tối đa chờ trong hàng đợi (đầy -> từ chối job mới với HTTP 503)
+SERVICE_QUEUE = 16
+
+# Số job ghép cùng lúc (mỗi job ghép song song theo vùng trên phần CPU còn lại)
+SERVICE_WORKERS = 2
+
+# Số kho tiles giữ trong RAM cùng lúc (bỏ kho dùng lâu nhất khi vượt)
+SERVICE_LIBRARIES = 4
+
+# Số sự kiện tiến độ gần nhất giữ lại cho mỗi job / số job đã xong giữ lại để tra cứu
+SERVICE_EVENTS = 256
+SERVICE_HISTORY = 256
+
+# Số mẫu độ trễ gần nhất dùng để tính thống kê
+SERVICE_LATENCY_SAMPLES = 1024
+
+# Đuôi file kết quả được phép cho 'out' của job
+OUTPUT_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Origin (trình duyệt) được phép gọi API: chỉ trang chạy trên chính máy này.
+# Request có Origin khác bị từ chối -> trang web lạ đang mở trong trình duyệt không gửi được job.
+LOCAL_ORIGIN_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Các trạng thái job
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+class QueueFull(Exception):
+    """Hàng đợi job đã đầy."""
+
+class OutputBusy(Exception):
+    """File kết quả đang thuộc về 1 job khác đang chờ / đang chạy."""
+
+class Job:
+    """1 yêu cầu ghép tranh: tham số, trạng thái, tiến độ (có thể chờ theo dõi từ thread khác)."""
+
+    def __init__(self, job_id: str, params: Dict):
+        self.id = job_id
+        self.params = params
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.error = None
+        self.output = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel = CancelToken()
+        self._seq = 0
+        self._events = collections.deque(maxlen=SERVICE_EVENTS)
+        self._cond = threading.Condition()
+
+    def update(self, progress: Optional[float] = None, message: Optional[str] = None, status: Optional[str] = None):
+        with self._cond:
+            if progress is not None:
+                self.progress = float(progress)
+            if message is not None:
+                self.message = message
+            if status is not None:
+                self.status = status
+            self._seq += 1
+            self._events.append((self._seq, self.to_dict()))
+            self._cond.notify_all()
+
+    def claim(self, status: str, message: str) -> bool:
+        """Chuyển job đang chờ sang `status` (nguyên tử). False nếu job không còn ở trạng thái chờ."""
+        with self._cond:
+            if self.status != QUEUED:
+                return False
+            if status != RUNNING:
+                self.finished = time.time()
+            self.update(message=message, status=status)
+            return True
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def events(self, timeout: Optional[float] = None) -> Iterator[Dict]:
+        """
+        Các trạng thái mới của job theo thứ tự, tới khi job kết thúc (trạng thái cuối luôn có).
+        Người theo dõi chậm chỉ bỏ lỡ các sự kiện trung gian cũ (giữ SERVICE_EVENTS sự kiện gần nhất).
+        timeout: số giây tối đa chờ 1 sự kiện mới (None = chờ mãi).
+        """
+        seen = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._seq > seen or self.done, timeout):
+                    return
+                fresh = [state for seq, state in self._events if seq > seen]
+                seen = self._seq
+                finished = self.done
+            yield from fresh
+            if finished:
+                return
+
+    def to_dict(self) -> Dict:
+        now = time.time()
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "output": self.output,
+            "queue_s": (self.started or now) - self.submitted,
+            "run_s": ((self.finished or now) - self.started) if self.started else 0.0,
+        }
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    arr = np.asarray(values, dtype=np.float64)
+    return {"count": int(arr.size), "mean": float(arr.mean()), "p50": float(np.percentile(arr, 50)),
+            "p95": float(np.percentile(arr, 95)), "max": float(arr.max())}
+
+class MosaicService:
+    """
+    Dịch vụ ghép tranh chạy lâu: giữ tối đa SERVICE_LIBRARIES kho tiles đã nạp + dựng chỉ mục trong RAM
+    (mỗi kho 1 MosaicSession), nhận job qua hàng đợi có giới hạn, ghép trên `workers` thread.
+    Các job dùng chung 1 kho chỉ khóa lúc nạp kho; phần ghép chỉ đọc tiles_db nên chạy đồng thời được.
+    Dùng trực tiếp trong Python (submit / get / stats) hoặc qua HTTP (serve, xem ServiceHandler).
+    """
+
+    def __init__(self, workers: int = SERVICE_WORKERS, max_queue: int = SERVICE_QUEUE,
+                 output_dir: Optional[str] = None, render_workers: Optional[int] = None):
+        if workers < 1:
+            raise ValueError("workers phải >= 1")
+        if max_queue < 1:
+            raise ValueError("max_queue phải >= 1")
+        self.output_dir = output_dir or os.path.join(os.getcwd(), "mosaic_service_out")
+        # Số thread ghép theo vùng cho mỗi job: chia đều CPU cho các job chạy cùng lúc
+        self.render_workers = render_workers or max(1, (os.cpu_count() or 1) // workers)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._jobs: "collections.OrderedDict[str, Job]" = collections.OrderedDict()
+        # Mỗi (thư mục tiles, use_texture) 1 phiên riêng -> job có / không khớp vân không nạp lại kho của nhau
+        self._libraries: "collections.OrderedDict[Tuple[str, bool], MosaicSession]" = collections.OrderedDict()
+        self._counts = collections.Counter()
+        self._queue_lat = collections.deque(maxlen=SERVICE_LATENCY_SAMPLES)
+        self._run_lat = collections.deque(maxlen=SERVICE_LATENCY_SAMPLES)
+        self._running = 0
+        self._started = time.time()
+
+        self._workers = [threading.Thread(target=self._worker, name=f"mosaic-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._workers:
+            t.start()
+
+    # --- KHO TILES ---
+
+    def _session(self, tiles_folder: str, use_texture: bool) -> MosaicSession:
+        key = (os.path.abspath(tiles_folder), bool(use_texture))
+        with self._lock:
+            session = self._libraries.get(key)
+            if session is None:
+                session = MosaicSession()
+                self._libraries[key] = session
+                while len(self._libraries) > SERVICE_LIBRARIES:
+                    self._libraries.popitem(last=False)
+            self._libraries.move_to_end(key)
+            return session
+
+    def warm(self, tiles_folder: str, base_tile: int = 15, levels: int = 3, index: str = "kdtree",
+             use_cache: bool = True, progress_callback: Callable[[float, str], None] = lambda p, m: None,
+             use_texture: bool = False):
+        """Nạp + dựng chỉ mục trước cho 1 kho tiles (chạy đồng bộ)."""
+        sizes = level_sizes(base_tile, levels)
+        return self._session(tiles_folder, use_texture).tiles_db(tiles_folder, sizes, progress_callback,
+                                                                 use_cache=use_cache, index=index,
+                                                                 use_texture=use_texture)
+
+    # --- JOB ---
+
+    def _output_path(self, out: str) -> str:
+        """
+        Đường dẫn thật của 'out' (tương đối -> tính từ output_dir). ValueError nếu sau khi phân giải
+        (.., symlink) nó nằm ngoài output_dir hoặc không phải đuôi ảnh -> job không ghi đè được file bất kỳ.
+        """
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, out))
+        if os.path.commonpath([root, path]) != root or path == root:
+            raise ValueError("'out' phải nằm trong thư mục kết quả của dịch vụ")
+        if os.path.splitext(path)[1].lower() not in OUTPUT_EXTS:
+            raise ValueError(f"'out' phải có đuôi {', '.join(OUTPUT_EXTS)}")
+        return path
+
+    def _check_params(self, params: Dict) -> Dict:
+        if not isinstance(params, dict):
+            raise ValueError("Tham số job phải là 1 object JSON")
+        if not params.get("target") or not params.get("tiles"):
+            raise ValueError("Job phải có 'target' và 'tiles'")
+        p = {
+            "target": str(params["target"]),
+            "tiles": str(params["tiles"]),
+            "out": self._output_path(str(params["out"])) if params.get("out") else None,
+            "base_tile": int(params.get("base_tile", 15)),
+            "levels": int(params.get("levels", 3)),
+            "blend": float(params.get("blend", 0.2)),
+            "index": str(params.get("index", "kdtree")),
+            "match_k": int(params.get("match_k", 1)),
+            "use_cache": bool(params.get("use_cache", True)),
+            "use_texture": bool(params.get("use_texture", False)),
+        }
+        if p["index"] not in INDEX_KINDS:
+            raise ValueError(f"index phải là một trong {INDEX_KINDS}")
+        if p["use_texture"] and p["index"] == "lut":
+            raise ValueError("use_texture không dùng được với index lut (bảng tra chỉ cho màu 3 chiều)")
+        if not 0.0 <= p["blend"] <= 1.0:
+            raise ValueError("blend phải nằm trong khoảng 0..1")
+        if p["match_k"] < 1:
+            raise ValueError("match_k phải >= 1")
+        level_sizes(p["base_tile"], p["levels"]) # Kiểm tra base_tile / levels
+        return p
+
+    def submit(self, params: Dict) -> Job:
+        """
+        Thêm job vào hàng đợi. ValueError nếu tham số sai, QueueFull nếu hàng đợi đầy,
+        OutputBusy nếu 'out' trùng file kết quả của job khác chưa kết thúc (2 job không ghi đè lên nhau).
+        Mã job duy nhất giữa các lần chạy dịch vụ (thời điểm + ngẫu nhiên) -> file mặc định <mã job>.jpg
+        trong output_dir không đè lên kết quả của lần chạy trước.
+        """
+        params = self._check_params(params)
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+        if params["out"] is None:
+            params["out"] = self._output_path(f"{job_id}.jpg")
+        with self._lock:
+            busy = next((j for j in self._jobs.values() if not j.done and j.params["out"] == params["out"]), None)
+            if busy is not None:
+                raise OutputBusy(f"'out' đang được job {busy.id} dùng, chọn file khác hoặc chờ job đó xong.")
+            job = Job(job_id, params)
+            job.update(0, "Đang chờ trong hàng đợi.")
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                raise QueueFull("Hàng đợi job đã đầy, thử lại sau.")
+            self._jobs[job.id] = job
+            self._counts["submitted"] += 1
+            self._forget_old()
+        return job
+
+    def _forget_old(self):
+        """Chỉ giữ SERVICE_HISTORY job đã kết thúc gần nhất (gọi khi đang giữ _lock)."""
+        finished = [jid for jid, j in self._jobs.items() if j.done]
+        for jid in finished[:max(0, len(finished) - SERVICE_HISTORY)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Hủy job đang chờ / đang chạy. False nếu không có job này hoặc job đã kết thúc."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel.cancel()
+        # Job còn trong hàng đợi: kết thúc ngay, worker lấy ra sau đó sẽ bỏ qua
+        if job.claim(CANCELLED, "Đã hủy."):
+            self._record(job)
+        return True
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        job.started = time.time()
+        if not job.claim(RUNNING, "Bắt đầu ghép."):
+            job.started = None
+            return # Đã bị hủy khi còn trong hàng đợi
+        with self._lock:
+            self._running += 1
+        p = job.params
+        try:
+            progress = job.cancel.wrap(lambda pct, msg: job.update(pct, msg))
+            sizes = level_sizes(p["base_tile"], p["levels"])
+            session = self._session(p["tiles"], p["use_texture"])
+            tiles_db = session.tiles_db(p["tiles"], sizes, progress, use_cache=p["use_cache"], index=p["index"],
+                                        cancel=job.cancel, use_texture=p["use_texture"])
+            target = cv2.imread(p["target"])
+            if target is None: raise Exception("Lỗi đọc ảnh gốc!")
+
+            mosaic = render_mosaic(target, tiles_db, sizes, p["blend"], progress, match_k=p["match_k"],
+                                   workers=self.render_workers, cancel=job.cancel)
+
+            out = p["out"]
+            os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+            success, buf = cv2.imencode(os.path.splitext(out)[1] or ".jpg", mosaic)
+            if not success: raise Exception(f"Không thể mã hóa ảnh: {out}")
+            with open(out, "wb") as f:
+                buf.tofile(f)
+            job.output = out
+            job.finished = time.time()
+            job.update(100, "Hoàn tất!", DONE)
+        except MosaicCancelled:
+            job.finished = time.time()
+            job.update(message="Đã hủy.", status=CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            job.finished = time.time()
+            job.update(message=f"Lỗi: {e}", status=FAILED)
+        finally:
+            with self._lock:
+                self._running -= 1
+        self._record(job)
+
+    def _record(self, job: Job):
+        with self._lock:
+            self._counts[job.status] += 1
+            if job.started is not None:
+                self._queue_lat.append(job.started - job.submitted)
+                self._run_lat.append(job.finished - job.started)
+
+    def stats(self) -> Dict:
+        """Độ sâu hàng đợi, số job theo trạng thái, độ trễ chờ / chạy (giây) và các kho tiles đang giữ."""
+        with self._lock:
+            return {
+                "uptime_s": time.time() - self._started,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "running": self._running,
+                "workers": len(self._workers),
+                "counts": dict(self._counts),
+                "queue_latency_s": _percentiles(list(self._queue_lat)),
+                "run_latency_s": _percentiles(list(self._run_lat)),
+                "libraries": [{"tiles": folder, "use_texture": texture} for folder, texture in self._libraries],
+            }
+
+    def close(self):
+        """Dừng các worker sau khi hết job đang chờ."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for t in self._workers:
+            t.join()
+
+# --- HTTP ---
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    API JSON (POST phải gửi Content-Type: application/json; request có Origin không phải máy cục bộ bị từ chối 403;
+    'out' của job là đường dẫn trong thư mục kết quả của dịch vụ):
+      POST   /jobs              tạo job {target, tiles, out?, base_tile?, levels?, blend?, index?, match_k?, use_cache?,
+                                use_texture?}
+                                -> 202 {id, ...} | 400 tham số sai | 409 'out' trùng job chưa xong | 503 hàng đợi đầy
+      GET    /jobs/<id>         trạng thái job
+      GET    /jobs/<id>/events  luồng trạng thái (NDJSON, mỗi dòng 1 object) tới khi job kết thúc
+      GET    /jobs/<id>/result  ảnh kết quả (khi status = done)
+      DELETE /jobs/<id>         hủy job
+      POST   /libraries         nạp trước kho tiles {tiles, base_tile?, levels?, index?, use_texture?}
+      GET    /stats             độ sâu hàng đợi, số job, độ trễ
+    """
+
+    server_version = "MosaicService/1.0"
+    service: MosaicService = None
+
+    def log_message(self, format, *args):
+        pass # Không in log mỗi request ra stderr
+
+    def address_string(self):
+        # Unix socket không có địa chỉ (host, port)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _send_json(self, code: int, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _origin_allowed(self) -> bool:
+        """Không có Origin (client không phải trình duyệt) hoặc Origin là trang trên chính máy này."""
+        origin = self.headers.get("Origin")
+        if origin is None:
+            return True
+        try:
+            host = urllib.parse.urlsplit(origin).hostname
+        except ValueError:
+            return False
+        return host in LOCAL_ORIGIN_HOSTS
+
+    def _reject_foreign(self) -> bool:
+        """Trả lời 403 và True nếu request đến từ trang web khác (xem LOCAL_ORIGIN_HOSTS)."""
+        if self._origin_allowed():
+            return False
+        self._send_json(403, {"error": "Origin không được phép"})
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        return json.loads(raw.decode("utf-8"))
+
+    def _job_or_404(self, job_id: str) -> Optional[Job]:
+        job = self.service.get(job_id)
+        if job is None:
+            self._send_json(404, {"error": "Không có job này"})
+        return job
+
+    def do_GET(self):
+        if self._reject_foreign():
+            return
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        if parts == ["stats"]:
+            return self._send_json(200, self.service.stats())
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = self._job_or_404(parts[1])
+            if job is None:
+                return
+            if len(parts) == 2:
+                return self._send_json(200, job.to_dict())
+            if parts[2:] == ["events"]:
+                return self._stream_events(job)
+            if parts[2:] == ["result"]:
+                return self._send_result(job)
+        self._send_json(404, {"error": "Không có đường dẫn này"})
+
+    def do_POST(self):
+        if self._reject_foreign():
+            return
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        # Chỉ nhận JSON thật: form / text/plain là các kiểu trình duyệt gửi chéo trang không cần hỏi trước (CORS)
+        if self.headers.get_content_type() != "application/json":
+            return self._send_json(415, {"error": "Content-Type phải là application/json"})
+        try:
+            params = self._read_json()
+        except (ValueError, UnicodeDecodeError):
+            return self._send_json(400, {"error": "Body phải là JSON"})
+
+        if parts == ["jobs"]:
+            try:
+                job = self.service.submit(params)
+            except ValueError as e:
+                return self._send_json(400, {"error": str(e)})
+            except QueueFull as e:
+                return self._send_json(503, {"error": str(e)})
+            except OutputBusy as e:
+                return self._send_json(409, {"error": str(e)})
+            return self._send_json(202, job.to_dict())
+        if parts == ["libraries"]:
+            if not isinstance(params, dict) or not params.get("tiles"):
+                return self._send_json(400, {"error": "Cần 'tiles'"})
+            try:
+                db = self.service.warm(str(params["tiles"]), int(params.get("base_tile", 15)),
+                                       int(params.get("levels", 3)), str(params.get("index", "kdtree")),
+                                       use_texture=bool(params.get("use_texture", False)))
+            except ValueError as e:
+                return self._send_json(400, {"error": str(e)})
+            except Exception as e:
+                return self._send_json(500, {"error": str(e)})
+            return self._send_json(200, {"tiles": os.path.abspath(params["tiles"]),
+                                         "sizes": sorted(db.keys(), reverse=True),
+                                         "count": len(next(iter(db.values()))[0])})
+        self._send_json(404, {"error": "Không có đường dẫn này"})
+
+    def do_DELETE(self):
+        if self._reject_foreign():
+            return
+        parts = [p for p in self.path.split("?", 1)[0].split("/") if p]
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self._job_or_404(parts[1])
+            if job is None:
+                return
+            return self._send_json(200, {"id": job.id, "cancelled": self.service.cancel(job.id)})
+        self._send_json(404, {"error": "Không có đường dẫn này"})
+
+    def _stream_events(self, job: Job):
+        # Không có Content-Length: luồng kết thúc khi đóng kết nối (sau trạng thái cuối của job)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for state in job.events():
+                self.wfile.write(json.dumps(state, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # Client ngắt kết nối giữa chừng
+
+    def _send_result(self, job: Job):
+        if job.status != DONE:
+            return self._send_json(409, {"error": f"Job chưa xong (status = {job.status})"})
+        try:
+            with open(job.output, "rb") as f:
+                body = f.read()
+        except OSError as e:
+            return self._send_json(410, {"error": str(e)})
+        ctype = {".png": "image/png", ".bmp": "image/bmp", ".webp": "image/webp"}.get(
+            os.path.splitext(job.output)[1].lower(), "image/jpeg")
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address) # Socket cũ còn sót lại
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+def make_server(service: MosaicService, host: str = "127.0.0.1", port: int = 8765,
+                unix_socket: Optional[str] = None):
+    """
+    Tạo HTTP server cho service (chưa chạy: gọi serve_forever(), dừng bằng shutdown()).
+    Mặc định chỉ nghe trên localhost; unix_socket: nghe trên Unix socket thay cho TCP.
+    """
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    if unix_socket:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Hệ điều hành không hỗ trợ Unix socket")
+        return _UnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# --- CLIENT ---
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self._unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._unix_path)
+
+class ServiceClient:
+    """Client tối giản (chỉ thư viện chuẩn) cho MosaicService qua TCP hoặc Unix socket."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None,
+                 timeout: Optional[float] = 60.0):
+        self.host, self.port, self.unix_socket, self.timeout = host, port, unix_socket, timeout
+
+    def _conn(self, timeout=-1):
+        timeout = self.timeout if timeout == -1 else timeout
+        if self.unix_socket:
+            return _UnixHTTPConnection(self.unix_socket, timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _request(self, method: str, path: str, body=None) -> Tuple[int, bytes]:
+        conn = self._conn()
+        try:
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            headers = {"Content-Type": "application/json"} if data is not None else {}
+            conn.request(method, path, body=data, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        finally:
+            conn.close()
+
+    def _json(self, method: str, path: str, body=None) -> Tuple[int, Dict]:
+        status, raw = self._request(method, path, body)
+        return status, json.loads(raw.decode("utf-8"))
+
+    def submit(self, **params) -> Tuple[int, Dict]:
+        return self._json("POST", "/jobs", params)
+
+    def status(self, job_id: str) -> Tuple[int, Dict]:
+        return self._json("GET", f"/jobs/{job_id}")
+
+    def cancel(self, job_id: str) -> Tuple[int, Dict]:
+        return self._json("DELETE", f"/jobs/{job_id}")
+
+    def warm(self, **params) -> Tuple[int, Dict]:
+        return self._json("POST", "/libraries", params)
+
+    def stats(self) -> Dict:
+        return self._json("GET", "/stats")[1]
+
+    def result(self, job_id: str) -> Tuple[int, bytes]:
+        return self._request("GET", f"/jobs/{job_id}/result")
+
+    def events(self, job_id: str) -> Iterator[Dict]:
+        """Đọc luồng trạng thái của job (không giới hạn thời gian chờ giữa 2 sự kiện)."""
+        conn = self._conn(timeout=None)
+        try:
+            conn.request("GET", f"/jobs/{job_id}/events")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise Exception(json.loads(resp.read().decode("utf-8")).get("error"))
+            for line in resp:
+                if line.strip():
+                    yield json.loads(line.decode("utf-8"))
+        finally:
+            conn.close()
+
+    def wait(self, job_id: str) -> Dict:
+        """Chờ job kết thúc (qua luồng sự kiện), trả về trạng thái cuối."""
+        last = None
+        for last in self.events(job_id):
+            pass
+        return last if last is not None else self.status(job_id)[1]
@@ -0,0 +1,214 @@
+import os
+import hashlib
+import threading
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from algorithms import tile_cache
+from algorithms import multiresolution
+from algorithms.multiresolution import (
+    level_sizes, _list_image_files, load_tile_levels, resize_tiles_in_memory, _build_index,
+    compose_mosaic, blend_mosaic
+)
+from algorithms.matching import REUSE_PENALTY
+from algorithms.metrics import MetricsRecorder, maybe_stage
+from algorithms.preview import PREVIEW_MAX_SIDE
+from algorithms.cancel import CancelToken
+
+def library_fingerprint(file_list: List[str]) -> str:
+    """Dấu vân tay của kho tiles: sha1 của (đường dẫn, mtime, dung lượng) mọi file, theo thứ tự liệt kê."""
+    h = hashlib.sha1()
+    for path in file_list:
+        try:
+            mtime, fsize = tile_cache.file_signature(path)
+        except OSError:
+            continue
+        h.update(f"{os.path.abspath(path)}\0{mtime}\0{fsize}\n".encode("utf-8", "surrogateescape"))
+    return h.hexdigest()
+
+def _derive_source(levels: Dict[int, Tuple[np.ndarray, np.ndarray]], size: int) -> Optional[int]:
+    """Level nhỏ nhất đã có mà giảm dần từng nửa về được `size` (tỉ lệ lũy thừa 2), None nếu không có."""
+    best = None
+    for s in levels:
+        ratio = s // size
+        if s > size and s % size == 0 and ratio & (ratio - 1) == 0 and (best is None or s < best):
+            best = s
+    return best
+
+class MosaicSession:
+    """
+    Cache trong RAM cho các lần ghép liên tiếp của 1 phiên làm việc (VD: giao diện kéo thanh trượt rồi chạy lại):
+      - kho tiles: {size: (tiles, features)} + chỉ mục từng level, theo thư mục tiles. Kho không đổi
+        (cùng dấu vân tay file) -> bỏ qua hoàn toàn bước nạp; đổi tile_size mà vẫn giữ level lớn nhất
+        -> level mới được giảm từ level đã có, không decode lại ảnh.
+      - kết quả ghép chưa blend + placements, theo ảnh gốc và các tham số cấu trúc
+        (sizes, kho tiles, index, match_k, phạt lặp). Chỉ đổi blend_factor -> 1 lần addWeighted.
+    Chỉ giữ 1 kho tiles và 1 kết quả gần nhất. Dùng chung được giữa các thread (có khóa).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._library = None
+        self._render = None
+
+    def clear(self):
+        """Bỏ toàn bộ dữ liệu đã cache."""
+        with self._lock:
+            self._library = None
+            self._render = None
+
+    def tiles_db(self, tiles_folder: str, sizes: List[int],
+                 progress_callback: Callable[[float, str], None] = lambda p, m: None,
+                 use_cache: bool = True,
+                 cache_dir: Optional[str] = None,
+                 index: Union[str, Dict[int, str]] = "kdtree",
+                 metrics: Optional[MetricsRecorder] = None,
+                 cancel: Optional[CancelToken] = None,
+                 use_texture: Optional[bool] = None):
+        """
+        Như multiresolution.build_tiles_db nhưng dùng lại dữ liệu đã nạp trong phiên.
+        Cùng tham số và kho không đổi -> trả về đúng đối tượng tiles_db lần trước.
+        use_texture: đặc trưng 6 chiều (màu + vân), None = theo multiresolution.USE_TEXTURE;
+        đổi loại đặc trưng -> nạp lại kho (từ cache đĩa riêng của loại đó nếu có).
+        Gọi từ thread nền để nạp trước kho tiles (pre-warm): lần run() sau chờ trên khóa của phiên
+        rồi dùng ngay kết quả. cancel: CancelToken, hủy tại các lần báo tiến độ (ném MosaicCancelled).
+        """
+        if cancel is not None:
+            progress_callback = cancel.wrap(progress_callback)
+        if use_texture is None:
+            use_texture = multiresolution.USE_TEXTURE
+        with self._lock:
+            with maybe_stage(metrics, "list_files"):
+                file_list = _list_image_files(tiles_folder)
+            if not file_list: raise Exception("Thư mục tiles trống!")
+
+            if use_cache and cache_dir is None:
+                cache_dir = os.path.join(tiles_folder, tile_cache.CACHE_DIRNAME)
+            if not use_cache:
+                cache_dir = None
+
+            folder = os.path.abspath(tiles_folder)
+            with maybe_stage(metrics, "fingerprint"):
+                fingerprint = library_fingerprint(file_list)
+
+            lib = self._library
+            if (lib is None or lib["folder"] != folder or lib["fingerprint"] != fingerprint
+                    or lib["use_texture"] != use_texture):
+                lib = {"folder": folder, "fingerprint": fingerprint, "use_texture": use_texture,
+                       "levels": {}, "indexes": {}, "dbs": {}}
+                self._library = lib
+
+            index_key = tuple(sorted(index.items())) if isinstance(index, dict) else index
+            db_key = (tuple(sizes), index_key)
+            db = lib["dbs"].get(db_key)
+            if db is not None:
+                progress_callback(10, "Dùng lại kho tiles đã nạp trong phiên.")
+                if metrics is not None:
+                    metrics.count("session_library_hits")
+                return db
+
+            levels = lib["levels"]
+            if any(sz not in levels and _derive_source(levels, sz) is None for sz in sizes):
+                # Không dựng được từ dữ liệu đã có (VD: level lớn nhất thay đổi) -> nạp lại kho
+                with maybe_stage(metrics, "load_tiles"):
+                    loaded = load_tile_levels(file_list, sizes, progress_callback, cache_dir, metrics,
+                                              use_texture=use_texture)
+                levels.clear()
+                levels.update(loaded)
+                lib["indexes"].clear()
+                lib["dbs"].clear()
+            else:
+                with maybe_stage(metrics, "pyramid"):
+                    for sz in sizes:
+                        if sz not in levels:
+                            levels[sz] = resize_tiles_in_memory(levels[_derive_source(levels, sz)][0],
+                                                                sz, progress_callback, use_texture)
+
+            db = {}
+            with maybe_stage(metrics, "build_index"):
+                for sz in sizes:
+                    if cancel is not None:
+                        cancel.check()
+                    kind = index.get(sz, "kdtree") if isinstance(index, dict) else index
+                    tree = lib["indexes"].get((sz, kind))
+                    if tree is None:
+                        tree = _build_index(kind, levels[sz][1], sz, cache_dir, progress_callback)
+                        lib["indexes"][(sz, kind)] = tree
+                    db[sz] = (levels[sz][0], tree)
+            lib["dbs"][db_key] = db
+            return db
+
+    def run(self, target_path: str, tiles_folder: str, base_tile: int = 15, levels: int = 3,
+            blend_factor: float = 0.2,
+            progress_callback: Callable[[float, str], None] = lambda p, m: None,
+            frame_callback=None,
+            frame_every: int = 150,
+            use_cache: bool = True,
+            tiles_db=None,
+            index: Union[str, Dict[int, str]] = "kdtree",
+            match_k: int = 1,
+            reuse_penalty: float = REUSE_PENALTY,
+            usage_penalty: float = 0.0,
+            metrics: Optional[MetricsRecorder] = None,
+            preview_max: Optional[int] = PREVIEW_MAX_SIDE,
+            workers: Optional[int] = None,
+            cancel: Optional[CancelToken] = None,
+            use_texture: Optional[bool] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Như multi_resolution_mosaic nhưng qua cache của phiên. Trả về (ảnh đã blend, placements).
+        placements (M, 6) = [x, y, size, h, w, chỉ số tile], xem compose_mosaic.
+        cancel: CancelToken, hủy lúc nạp kho tiles hoặc giữa các vùng ghép (ném MosaicCancelled).
+        """
+        if metrics is not None:
+            progress_callback = metrics.timed_callback("progress", progress_callback)
+            frame_callback = metrics.timed_callback("preview", frame_callback)
+
+        try:
+            with self._lock:
+                sizes = level_sizes(base_tile, levels)
+                progress_callback(5, f"Levels cấu hình: {sizes}")
+
+                if tiles_db is None:
+                    with maybe_stage(metrics, "tiles_db"):
+                        tiles_db = self.tiles_db(tiles_folder, sizes, progress_callback,
+                                                 use_cache=use_cache, index=index, metrics=metrics,
+                                                 cancel=cancel, use_texture=use_texture)
+
+                try:
+                    target_sig = tile_cache.file_signature(target_path)
+                except OSError:
+                    raise Exception("Lỗi đọc ảnh gốc!")
+                key = (os.path.abspath(target_path), target_sig, tuple(sizes),
+                       match_k, float(reuse_penalty), float(usage_penalty))
+
+                entry = self._render
+                if entry is not None and entry["key"] == key and entry["tiles_db"] is tiles_db:
+                    if metrics is not None:
+                        metrics.count("session_render_hits")
+                    progress_callback(100, "Dùng lại kết quả ghép, chỉ hòa trộn lại.")
+                else:
+                    with maybe_stage(metrics, "read_target"):
+                        target = cv2.imread(target_path)
+                    if target is None: raise Exception("Lỗi đọc ảnh gốc!")
+
+                    with maybe_stage(metrics, "render"):
+                        mosaic, placements = compose_mosaic(target, tiles_db, sizes, progress_callback,
+                                                            frame_callback, frame_every, match_k,
+                                                            reuse_penalty, usage_penalty, metrics,
+                                                            preview_max, workers, cancel)
+                    entry = {"key": key, "tiles_db": tiles_db, "target": target,
+                             "mosaic": mosaic, "placements": placements}
+                    self._render = entry
+
+                # Luôn trả bản sao: ảnh trong cache không được bị sửa bởi người gọi
+                result = blend_mosaic(entry["mosaic"], entry["target"], blend_factor, progress_callback, metrics)
+                if result is entry["mosaic"]:
+                    result = result.copy()
+                placements = entry["placements"]
+        finally:
+            if metrics is not None:
+                metrics.finish()
+
+        progress_callback(100, "Hoàn tất!")
+        return result, placements
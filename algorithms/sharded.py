@@ -0,0 +1,456 @@
+import os
+import zlib
+import weakref
+import threading
+import multiprocessing
+import concurrent.futures
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from algorithms import tile_cache
+from algorithms import multiresolution
+from algorithms.kdtree_nn import KDTreeNearestNeighbor
+from algorithms.multiresolution import _list_image_files, _file_sig_or_zero, load_tile_levels
+
+# Mỗi file được băm (đường dẫn tuyệt đối) vào 1 trong SHARD_SLOTS ô cố định; bảng ô -> shard
+# (slot_owners) chỉ chuyển 1 phần ô sang shard mới khi tăng số shard -> cache các shard cũ vẫn dùng lại được.
+SHARD_SLOTS = 4096
+
+# Số tiles mục tiêu mỗi shard khi không chỉ định số shard (shards_for)
+SHARD_TARGET_TILES = 250_000
+
+# Thư mục con trong cache kho tiles chứa cache (atlas + đặc trưng) của từng shard
+SHARD_CACHE_DIRNAME = "shards"
+
+def slot_of(path: str) -> int:
+    """Ô băm cố định của 1 file (không phụ thuộc số shard / thứ tự liệt kê)."""
+    key = os.path.abspath(path).encode("utf-8", "surrogateescape")
+    return zlib.crc32(key) % SHARD_SLOTS
+
+def slot_owners(n_shards: int) -> np.ndarray:
+    """
+    Bảng ô -> shard (SHARD_SLOTS,) cho n_shards shard, dựng dần từ 1 shard:
+    khi thêm shard j, mỗi shard cũ nhường phần ô vượt quá SHARD_SLOTS // (j + 1) cho shard j.
+    -> Tăng từ N lên N + 1 shard chỉ chuyển khoảng 1 / (N + 1) số file, các file còn lại giữ shard cũ.
+    """
+    if n_shards < 1 or n_shards > SHARD_SLOTS:
+        raise ValueError(f"n_shards phải trong khoảng 1..{SHARD_SLOTS}")
+    owner = np.zeros(SHARD_SLOTS, dtype=np.int64)
+    for j in range(1, n_shards):
+        quota = SHARD_SLOTS // (j + 1)
+        for i in range(j):
+            own = np.flatnonzero(owner == i)
+            owner[own[quota:]] = j
+    return owner
+
+def shards_for(n_files: int) -> int:
+    """Số shard mặc định: mỗi shard khoảng SHARD_TARGET_TILES tiles."""
+    return max(1, min(SHARD_SLOTS, -(-n_files // SHARD_TARGET_TILES)))
+
+def partition_files(file_list: List[str], n_shards: int) -> List[List[str]]:
+    """Chia file_list thành n_shards danh sách (giữ thứ tự ban đầu trong mỗi shard) theo slot_owners."""
+    owner = slot_owners(n_shards)
+    parts = [[] for _ in range(n_shards)]
+    for path in file_list:
+        parts[owner[slot_of(path)]].append(path)
+    return parts
+
+def _query_index(index: KDTreeNearestNeighbor, colors: np.ndarray, k: Optional[int], count_visits: bool):
+    """k = None: láng giềng gần nhất (query_batch, có thể đếm node / leaf), ngược lại query_k_batch."""
+    if k is None:
+        visits = {} if count_visits else None
+        d, i = index.query_batch(colors, visits)
+        return d[:, None], i[:, None], visits
+    d, i = index.query_k_batch(colors, k)
+    return d, i, None
+
+def _load_shard(file_list: List[str], sizes: List[int], cache_dir: Optional[str], use_texture: bool):
+    """Nạp 1 shard: ({size: (tiles, features)}, {size: chỉ mục}). Shard không có tile hợp lệ nào: mảng rỗng, {}."""
+    levels = load_tile_levels(file_list, sizes, lambda p, m: None, cache_dir, allow_empty=True,
+                              use_texture=use_texture)
+    if len(levels[sizes[0]][1]) == 0:
+        return levels, {}
+    return levels, {sz: KDTreeNearestNeighbor(levels[sz][1]) for sz in sizes}
+
+def _shard_process(conn, parent_conn, file_list: List[str], sizes: List[int], cache_dir: Optional[str],
+                   use_texture: bool):
+    """
+    Vòng lặp của 1 process shard: nạp shard, gửi ("ready", {size: (tiles, features)}) rồi trả lời truy vấn
+    (size, colors, k, count_visits) tới khi nhận "stop" / pipe đóng.
+    Tiles gửi dạng tile_cache.portable_tiles (đường dẫn atlas khi có cache) -> process chính chỉ mmap atlas,
+    chỉ mục (cây / ma trận brute-force) chỉ nằm trong process shard.
+    Process không phải daemon -> tự dùng process pool khi decode shard lớn (xem multiresolution._load_tiles).
+    """
+    parent_conn.close() # Bản sao đầu pipe của process chính: đóng để nhận EOF khi process chính thoát
+    try:
+        levels, indexes = _load_shard(file_list, sizes, cache_dir, use_texture)
+        conn.send(("ready", {sz: (tile_cache.portable_tiles(t), f) for sz, (t, f) in levels.items()}))
+        levels = None
+    except Exception as e:
+        conn.send(("error", str(e)))
+        conn.close()
+        return
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg == "stop":
+            break
+        sz, colors, k, count_visits = msg
+        try:
+            conn.send(("ok", _query_index(indexes[sz], colors, k, count_visits)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+    conn.close()
+
+def _stop_shard_process(conn, proc):
+    """Dừng 1 process shard: gửi "stop", chờ, buộc dừng nếu quá hạn (từ close() hoặc lúc chương trình thoát)."""
+    try:
+        conn.send("stop")
+    except (OSError, ValueError):
+        pass
+    proc.join(timeout=5)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+    conn.close()
+
+class _LocalShard:
+    """Shard trong process hiện tại. sigs: [(đường dẫn, (mtime, dung lượng))] các file lúc nạp."""
+
+    def __init__(self, shard_id: int, sigs: List[Tuple[str, Tuple[int, int]]], levels, indexes):
+        self.id = shard_id
+        self.sigs = sigs
+        self.tiles = {sz: t for sz, (t, _) in levels.items()}
+        self.features = {sz: f for sz, (_, f) in levels.items()}
+        self.indexes = indexes
+
+    def query(self, sz: int, colors: np.ndarray, k: Optional[int], count_visits: bool):
+        return _query_index(self.indexes[sz], colors, k, count_visits)
+
+    def close(self):
+        pass
+
+class _ProcessShard:
+    """
+    Shard chạy trong process riêng, nói chuyện qua Pipe (send / recv tách rời để truy vấn song song).
+    Process không phải daemon (để decode được bằng process pool) nên luôn được dừng tường minh:
+    close(), hoặc weakref.finalize khi đối tượng bị thu hồi / chương trình thoát.
+    """
+
+    def __init__(self, shard_id: int, sigs: List[Tuple[str, Tuple[int, int]]], sizes: List[int],
+                 cache_dir: Optional[str], use_texture: bool, ctx):
+        self.id = shard_id
+        self.sigs = sigs
+        self._conn, child = ctx.Pipe()
+        files = [path for path, _ in sigs]
+        self._proc = ctx.Process(target=_shard_process,
+                                 args=(child, self._conn, files, list(sizes), cache_dir, use_texture))
+        self._proc.start()
+        child.close()
+        self._stop = weakref.finalize(self, _stop_shard_process, self._conn, self._proc)
+        self.tiles, self.features = {}, {}
+
+    def _recv(self):
+        try:
+            status, payload = self._conn.recv()
+        except EOFError:
+            raise Exception("Process shard đã dừng bất thường!")
+        if status == "error":
+            raise Exception(payload)
+        return payload
+
+    def wait_ready(self):
+        for sz, (handle, features) in self._recv().items():
+            self.tiles[sz] = tile_cache.open_tiles(handle)
+            self.features[sz] = features
+
+    def send(self, sz: int, colors: np.ndarray, k: Optional[int], count_visits: bool):
+        if not self._stop.alive:
+            raise Exception("Shard đã đóng (kho đã được chia lại hoặc đã close())!")
+        self._conn.send((sz, colors, k, count_visits))
+
+    def recv(self):
+        return self._recv()
+
+    def close(self):
+        self._stop()
+
+class ShardedTiles:
+    """
+    Mảng tiles ảo (N, s, s, 3) nối các shard theo thứ tự: hàng offsets[i] + r là hàng r của shard i.
+    Hỗ trợ những gì bộ ghép cần: shape, dtype, len(), lấy 1 hàng hoặc mảng chỉ số (gom theo từng shard).
+    """
+
+    def __init__(self, parts: List[np.ndarray]):
+        self.parts = parts
+        self.offsets = np.concatenate([[0], np.cumsum([len(p) for p in parts])]).astype(np.int64)
+        self.shape = (int(self.offsets[-1]),) + tuple(parts[0].shape[1:])
+        self.dtype = parts[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def locate(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(shard, hàng trong shard) của các hàng toàn cục."""
+        shard = np.searchsorted(self.offsets, rows, side="right") - 1
+        return shard, rows - self.offsets[shard]
+
+    def __getitem__(self, idx):
+        if np.ndim(idx) == 0:
+            i = int(idx)
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("Chỉ số tile ngoài phạm vi")
+            s, r = self.locate(np.int64(i))
+            return self.parts[int(s)][int(r)]
+
+        rows = np.asarray(idx, dtype=np.int64)
+        out = np.empty(rows.shape + self.shape[1:], dtype=self.dtype)
+        shard, local = self.locate(rows)
+        for s in np.unique(shard).tolist():
+            sel = shard == s
+            out[sel] = self.parts[s][local[sel]]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.concatenate(self.parts)
+        return arr if dtype is None else arr.astype(dtype)
+
+class ShardedIndex:
+    """
+    Chỉ mục 1 level trên mọi shard: mỗi truy vấn được gửi tới mọi shard (thread pool hoặc các process shard
+    cùng lúc), mỗi shard trả về k ứng viên gần nhất của nó, kết quả được trộn theo khoảng cách
+    -> đúng k láng giềng gần nhất toàn cục (mỗi láng giềng toàn cục nằm trong top-k của shard chứa nó).
+    Chỉ số trả về là hàng toàn cục trong ShardedTiles cùng level.
+    Giữ cố định danh sách shard + offset lúc tạo -> tiles_db() cũ vẫn khớp mảng tiles của nó sau reshard()
+    (shard process đã bị đóng thì báo lỗi thay vì trả tile sai).
+    Cùng giao diện với KDTreeNearestNeighbor (colors, query, query_batch, query_k_batch).
+    """
+
+    def __init__(self, library: "ShardedTileLibrary", shards: List, offsets: np.ndarray, size: int):
+        self._library = library
+        self._shards = shards
+        self._offsets = offsets
+        self.size = size
+        self.dim = shards[0].features[size].shape[1]
+        self._colors = None
+
+    @property
+    def colors(self) -> np.ndarray:
+        """Đặc trưng của mọi tile (nối các shard, chỉ tạo khi cần)."""
+        if self._colors is None:
+            self._colors = np.concatenate([s.features[self.size] for s in self._shards])
+        return self._colors
+
+    def _check(self, colors: np.ndarray, name: str) -> np.ndarray:
+        colors = np.asarray(colors, dtype=np.float32)
+        if colors.ndim != 2 or colors.shape[1] != self.dim:
+            raise ValueError(f"{name} phải có shape (M, {self.dim})")
+        return colors
+
+    def _merge(self, results, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        offsets = self._offsets
+        dists = np.concatenate([d for d, _, _ in results], axis=1)
+        idxs = np.concatenate([i + offsets[s] for s, (_, i, _) in enumerate(results)], axis=1)
+        if len(results) > 1:
+            # Sắp ổn định: khoảng cách bằng nhau -> ưu tiên shard đứng trước, giữ thứ tự trong shard
+            order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+            dists = np.take_along_axis(dists, order, axis=1)
+            idxs = np.take_along_axis(idxs, order, axis=1)
+        return dists, idxs
+
+    def query_k_batch(self, colors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """k tile gần nhất cho nhiều màu. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần."""
+        colors = self._check(colors, "colors")
+        k = min(k, int(self._offsets[-1]))
+        return self._merge(self._library._fan_out(self._shards, self.size, colors, k, False), k)
+
+    def query_batch(self, colors: np.ndarray, visit_counts=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Truy vấn nhiều màu cùng lúc. Trả về (dists, idxs) shape (M,).
+        visit_counts: dict nhận tổng số node / leaf đã duyệt trên mọi shard cho mỗi truy vấn.
+        """
+        colors = self._check(colors, "colors")
+        results = self._library._fan_out(self._shards, self.size, colors, None, visit_counts is not None)
+        if visit_counts is not None:
+            for key in ("nodes", "leaves"):
+                visit_counts[key] = sum(v[key] for _, _, v in results)
+        d, i = self._merge(results, 1)
+        return d[:, 0], i[:, 0]
+
+    def query(self, color: np.ndarray) -> int:
+        _, idx = self.query_batch(np.asarray(color, dtype=np.float32).reshape(1, -1))
+        return int(idx[0])
+
+class ShardedTileLibrary:
+    """
+    Kho tiles chia thành N shard cho thư viện rất lớn (10^6+ ảnh): mỗi shard có cache / atlas
+    (<cache>/shards/<i>) và chỉ mục riêng, được nạp song song.
+      - processes=False: mọi shard trong process hiện tại, truy vấn gửi tới các shard trên thread pool.
+      - processes=True: mỗi shard 1 process riêng giữ chỉ mục của nó (dựng song song trên nhiều nhân,
+        bộ nhớ chỉ mục chia theo process); process chính chỉ giữ đặc trưng và mmap atlas của các shard.
+        Nên dùng cùng cache (use_cache=True), không thì tiles được gửi nguyên về process chính.
+    File thuộc shard nào chỉ phụ thuộc đường dẫn và số shard (partition_files); reshard() tăng số shard khi
+    kho lớn lên và chỉ phải xử lý lại phần file đổi shard (phần còn lại lấy từ cache shard cũ).
+
+    tiles_db() trả về {size: (ShardedTiles, ShardedIndex)} dùng được như kết quả của build_tiles_db
+    (VD: MosaicGenerator(..., tiles_db=lib.tiles_db())); kết quả ghép giống hệt kho không chia shard
+    (trừ khi nhiều tile cách đều 1 block). Gọi close() khi không dùng nữa.
+    """
+
+    def __init__(self, tiles_folder: str, sizes: List[int],
+                 n_shards: Optional[int] = None,
+                 progress_callback: Callable[[float, str], None] = lambda p, m: None,
+                 use_cache: bool = True,
+                 cache_dir: Optional[str] = None,
+                 processes: bool = False,
+                 workers: Optional[int] = None,
+                 use_texture: Optional[bool] = None):
+        if workers is not None and workers < 1:
+            raise ValueError("workers phải >= 1")
+        self.tiles_folder = tiles_folder
+        self.sizes = list(sizes)
+        # Loại đặc trưng của mọi shard (truyền tường minh cho process shard), None = theo USE_TEXTURE
+        self.use_texture = multiresolution.USE_TEXTURE if use_texture is None else use_texture
+        self.processes = processes
+        self.workers = workers or os.cpu_count() or 1
+        if use_cache and cache_dir is None:
+            cache_dir = os.path.join(tiles_folder, tile_cache.CACHE_DIRNAME)
+        self.cache_dir = cache_dir if use_cache else None
+        self._lock = threading.Lock()
+        # Thread pool gửi truy vấn tới các shard trong process (dùng chung cho mọi snapshot tiles_db)
+        self._executor = None if processes else concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        self._shards = []
+        self.n_shards = 0
+        self.reshard(n_shards, progress_callback)
+
+    def _shard_cache(self, i: int) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, SHARD_CACHE_DIRNAME, str(i))
+
+    def reshard(self, n_shards: Optional[int] = None,
+                progress_callback: Callable[[float, str], None] = lambda p, m: None):
+        """
+        Quét lại thư mục và chia lại kho thành n_shards shard (None: shards_for(số file)).
+        Shard có danh sách file và (mtime, dung lượng) từng file không đổi được giữ nguyên, các shard khác
+        (thêm / xóa / sửa ảnh) nạp lại song song từ cache của chúng (chỉ decode file mới / đã sửa).
+        Shard không còn tile hợp lệ nào bị bỏ qua; chỉ báo lỗi khi mọi shard đều rỗng.
+        """
+        file_list = _list_image_files(self.tiles_folder)
+        if not file_list: raise Exception("Thư mục tiles trống!")
+        if n_shards is None:
+            n_shards = shards_for(len(file_list))
+        # Như TileLibrary.rescan: so (đường dẫn, chữ ký file) -> ảnh sửa tại chỗ cũng làm shard được nạp lại
+        sigs = [[(path, _file_sig_or_zero(path)) for path in files] for files in partition_files(file_list, n_shards)]
+
+        old = {s.id: s for s in self._shards}
+        keep = {i: old[i] for i, part in enumerate(sigs) if i in old and old[i].sigs == part}
+        todo = [i for i, part in enumerate(sigs) if part and i not in keep]
+        progress_callback(0, f"Chia kho {len(file_list)} ảnh thành {n_shards} shard "
+                             f"(giữ {len(keep)}, nạp {len(todo)})")
+
+        built = self._build(sigs, todo, progress_callback)
+        first = self.sizes[0]
+        for i in [i for i, shard in built.items() if len(shard.features[first]) == 0]:
+            built.pop(i).close()
+        if not keep and not built:
+            raise Exception("Không tìm thấy ảnh hợp lệ trong thư mục tiles!")
+        with self._lock:
+            for shard in self._shards:
+                if keep.get(shard.id) is not shard:
+                    shard.close()
+            shards = [keep.get(i) or built.get(i) for i in range(n_shards)]
+            self._shards = [s for s in shards if s is not None]
+            self.n_shards = n_shards
+            self._refresh()
+        progress_callback(100, f"Đã nạp {len(self.tiles[self.sizes[0]])} tiles trên {len(self._shards)} shard")
+
+    def _build(self, sigs: List[List[Tuple[str, Tuple[int, int]]]], todo: List[int],
+               progress_callback: Callable[[float, str], None]) -> Dict[int, object]:
+        """Nạp song song các shard todo (sigs[i]: file của shard i). Lỗi ở 1 shard -> đóng mọi shard vừa tạo rồi ném lại."""
+        built = {}
+        try:
+            if self.processes:
+                # Khởi động mọi process trước (chúng nạp song song), rồi chờ lần lượt
+                ctx = multiprocessing.get_context()
+                for i in todo:
+                    built[i] = _ProcessShard(i, sigs[i], self.sizes, self._shard_cache(i), self.use_texture, ctx)
+                for n, i in enumerate(todo):
+                    built[i].wait_ready()
+                    progress_callback((n + 1) / len(todo) * 100, f"Đã nạp shard {n + 1}/{len(todo)}")
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.workers, max(1, len(todo)))) as ex:
+                    futures = {ex.submit(_load_shard, [path for path, _ in sigs[i]], self.sizes,
+                                         self._shard_cache(i), self.use_texture): i for i in todo}
+                    for n, fut in enumerate(concurrent.futures.as_completed(futures)):
+                        i = futures[fut]
+                        built[i] = _LocalShard(i, sigs[i], *fut.result())
+                        progress_callback((n + 1) / len(todo) * 100, f"Đã nạp shard {n + 1}/{len(todo)}")
+        except BaseException:
+            for shard in built.values():
+                shard.close()
+            raise
+        return built
+
+    def _refresh(self):
+        """Dựng snapshot tiles_db mới (mảng tiles ảo + chỉ mục với danh sách shard / offset cố định)."""
+        shards = list(self._shards)
+        first = self.sizes[0]
+        offsets = np.concatenate([[0], np.cumsum([len(s.features[first]) for s in shards])]).astype(np.int64)
+        self.tiles = {sz: ShardedTiles([s.tiles[sz] for s in shards]) for sz in self.sizes}
+        self._db = {sz: (self.tiles[sz], ShardedIndex(self, shards, offsets, sz)) for sz in self.sizes}
+
+    def _fan_out(self, shards: List, sz: int, colors: np.ndarray, k: Optional[int], count_visits: bool):
+        """Gửi 1 lô truy vấn tới các shard, trả về danh sách (dists, idxs cục bộ, visits) theo thứ tự shard."""
+        if self.processes:
+            # 1 vòng gửi / nhận mỗi lần (pipe không chia sẻ được giữa các thread đang truy vấn)
+            # Luôn nhận đủ trả lời của mọi shard đã gửi (kể cả khi 1 shard lỗi) để pipe không bị lệch lượt
+            with self._lock:
+                sent, error = [], None
+                for shard in shards:
+                    try:
+                        shard.send(sz, colors, k, count_visits)
+                    except Exception as e:
+                        error = e
+                        break
+                    sent.append(shard)
+                results = []
+                for shard in sent:
+                    try:
+                        results.append(shard.recv())
+                    except Exception as e:
+                        error = error or e
+                if error is not None:
+                    raise error
+                return results
+        if self._executor is None or len(shards) == 1:
+            return [shard.query(sz, colors, k, count_visits) for shard in shards]
+        return list(self._executor.map(lambda s: s.query(sz, colors, k, count_visits), shards))
+
+    def __len__(self) -> int:
+        return len(self.tiles[self.sizes[0]])
+
+    def tiles_db(self) -> Dict[int, Tuple[ShardedTiles, ShardedIndex]]:
+        """{size: (tiles, index)} hiện tại. Trả về cùng 1 đối tượng tới lần reshard() kế tiếp."""
+        return self._db
+
+    def close(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.close()
+            self._shards = []
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,135 @@
+import os
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from algorithms.multiresolution import render_mosaic
+from algorithms.deepzoom import DeepZoomWriter
+
+# Dung lượng mục tiêu của 1 dải (strip) ảnh gốc khi không chỉ định strip_rows
+STRIP_BYTES = 32 << 20
+
+# Định dạng đầu ra có thể ghi dần từng dải
+STREAM_FORMATS = (".npy", ".ppm", ".dzi")
+
+def _read_ppm_header(f) -> Tuple[int, int, int]:
+    """Đọc header PPM nhị phân (P6), trả về (w, h, offset dữ liệu)."""
+    tokens = []
+    while len(tokens) < 4:
+        line = f.readline()
+        if not line:
+            raise ValueError("File PPM không hợp lệ")
+        line = line.split(b"#", 1)[0]
+        tokens.extend(line.split())
+    if tokens[0] != b"P6" or int(tokens[3]) != 255:
+        raise ValueError("Chỉ hỗ trợ PPM nhị phân 8-bit (P6)")
+    return int(tokens[1]), int(tokens[2]), f.tell()
+
+def open_target(target_path: str) -> Tuple[np.ndarray, bool]:
+    """
+    Mở ảnh gốc để đọc theo dải. Trả về (ảnh BGR, is_rgb).
+    - .npy (H, W, 3) BGR: memmap, chỉ các dải đang xử lý được nạp vào RAM.
+    - .ppm (P6): memmap trực tiếp trên dữ liệu thô (thứ tự RGB -> is_rgb=True).
+    - Định dạng nén khác (jpg, png...): buộc phải giải mã toàn bộ bằng cv2.imread.
+    """
+    ext = os.path.splitext(target_path)[1].lower()
+    if ext == ".npy":
+        img = np.load(target_path, mmap_mode="r")
+        if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+            raise ValueError("Ảnh .npy phải có shape (H, W, 3) kiểu uint8")
+        return img, False
+    if ext == ".ppm":
+        with open(target_path, "rb") as f:
+            w, h, offset = _read_ppm_header(f)
+        return np.memmap(target_path, dtype=np.uint8, mode="r", offset=offset, shape=(h, w, 3)), True
+
+    img = cv2.imread(target_path)
+    if img is None: raise Exception("Lỗi đọc ảnh gốc!")
+    return img, False
+
+class NpyStripWriter:
+    """Ghi kết quả vào file .npy (BGR) được memmap, từng dải một."""
+
+    def __init__(self, path: str, h: int, w: int):
+        self.path = path
+        self._out = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(h, w, 3))
+
+    def write(self, y0: int, strip: np.ndarray):
+        self._out[y0:y0 + strip.shape[0]] = strip
+        self._out.flush()
+
+    def close(self):
+        self._out.flush()
+        del self._out
+
+class PpmStripWriter:
+    """Ghi kết quả thành file PPM (P6) nối dần từng dải - mọi trình xem ảnh đều mở được."""
+
+    def __init__(self, path: str, h: int, w: int):
+        self.path = path
+        self._next_row = 0
+        self._f = open(path, "wb")
+        self._f.write(f"P6\n{w} {h}\n255\n".encode("ascii"))
+
+    def write(self, y0: int, strip: np.ndarray):
+        if y0 != self._next_row:
+            raise ValueError("PpmStripWriter chỉ ghi được các dải theo thứ tự từ trên xuống")
+        self._f.write(cv2.cvtColor(np.ascontiguousarray(strip), cv2.COLOR_BGR2RGB).tobytes())
+        self._next_row += strip.shape[0]
+
+    def close(self):
+        self._f.close()
+
+def open_strip_writer(out_path: str, h: int, w: int):
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == ".npy":
+        return NpyStripWriter(out_path, h, w)
+    if ext == ".ppm":
+        return PpmStripWriter(out_path, h, w)
+    if ext == ".dzi":
+        return DeepZoomWriter(out_path, h, w)
+    raise ValueError(f"Chế độ streaming chỉ ghi được {', '.join(STREAM_FORMATS)}")
+
+def strip_height(w_img: int, max_size: int, strip_rows: Optional[int] = None) -> int:
+    """Chiều cao dải: luôn là bội số của max_size để các ô Quadtree không bị cắt ngang."""
+    if strip_rows is None:
+        strip_rows = STRIP_BYTES // max(1, w_img * 3)
+    return max(1, strip_rows // max_size) * max_size
+
+def stream_mosaic(
+    target_path: str,
+    tiles_db: Dict[int, Tuple[np.ndarray, object]],
+    sizes: List[int],
+    out: Union[str, object],
+    blend_factor: float = 0.2,
+    strip_rows: Optional[int] = None,
+    progress_callback: Callable[[float, str], None] = lambda p, m: None,
+    workers: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Ghép tranh theo từng dải ngang (cao = bội số của size lớn nhất) cho ảnh rất lớn.
+    Mỗi dải được lập Quadtree, matching, ghép và blend độc lập rồi ghi ngay ra `out`
+    (đường dẫn .npy / .ppm / .dzi (kim tự tháp Deep Zoom), hoặc object có write(y0, strip) và close()).
+    Vì ranh giới dải trùng với lưới Quadtree, kết quả giống hệt render_mosaic trên toàn ảnh,
+    nhưng RAM đỉnh chỉ tỉ lệ với chiều cao dải (cộng ảnh gốc nếu phải giải mã toàn bộ).
+    Trả về (h, w) của ảnh kết quả. workers: số thread ghép mỗi dải (xem compose_mosaic).
+    """
+    target, is_rgb = open_target(target_path)
+    h_img, w_img = target.shape[:2]
+    rows = strip_height(w_img, sizes[0], strip_rows)
+
+    writer = open_strip_writer(out, h_img, w_img) if isinstance(out, str) else out
+    try:
+        for y0 in range(0, h_img, rows):
+            y1 = min(h_img, y0 + rows)
+            strip = np.array(target[y0:y1]) # Chỉ nạp dải này vào RAM (nếu là memmap)
+            if is_rgb:
+                strip = cv2.cvtColor(strip, cv2.COLOR_RGB2BGR)
+
+            mosaic = render_mosaic(strip, tiles_db, sizes, blend_factor, workers=workers)
+            writer.write(y0, mosaic)
+            progress_callback(y1 / h_img * 100, f"Streaming: {y1}/{h_img} dòng")
+    finally:
+        writer.close()
+
+    return h_img, w_img
@@ -0,0 +1,193 @@
+import os
+import glob
+import mmap
+import uuid
+import hashlib
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Tăng số này mỗi khi thay đổi cách resize / trích xuất đặc trưng
+# để các cache cũ tự động bị bỏ qua.
+CACHE_VERSION = 4
+
+# Thư mục cache mặc định (đặt bên trong thư mục tiles)
+CACHE_DIRNAME = ".mosaic_cache"
+
+def file_signature(path: str) -> Tuple[int, int]:
+    """Trả về (mtime_ns, size) của file, dùng để phát hiện file đã thay đổi."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def cache_path(cache_dir: str, sizes: List[int], feat_dim: int = 3, texture_weight: float = 1.0) -> str:
+    """
+    Mỗi bộ kích thước tile (và số chiều đặc trưng, 3 hoặc 6) có một file cache riêng.
+    Đặc trưng 6 chiều còn phụ thuộc trọng số phần vân (texture_weight) -> đổi trọng số thì dùng file khác.
+    """
+    name = f"tiles_v{CACHE_VERSION}_" + "_".join(str(s) for s in sizes)
+    if feat_dim != 3:
+        name += f"_f{feat_dim}_w{texture_weight:g}"
+    name += ".npz"
+    return os.path.join(cache_dir, name)
+
+def atlas_path(cache_file: str, size: int, token: str) -> str:
+    """
+    File atlas .npy chứa toàn bộ tiles (N, size, size, 3) của 1 level.
+    Mỗi lần ghi cache dùng token mới -> không ghi đè file đang được process khác memory-map.
+    """
+    return f"{os.path.splitext(cache_file)[0]}_atlas_{size}_{token}.npy"
+
+def open_atlas(path: str) -> np.ndarray:
+    """Mở atlas chỉ đọc bằng memory-map: chỉ các tile thực sự được truy cập mới được nạp vào RAM."""
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+def load(cache_file: str, sizes: List[int]) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Đọc file cache. Trả về None nếu không có, hỏng hoặc khác phiên bản.
+    Các khóa: paths, mtimes, fsizes, failed_paths, failed_mtimes, failed_fsizes,
+    tiles_{size}, feats_{size} cho từng size.
+    feats_{size} nằm trong RAM, tiles_{size} là memmap chỉ đọc lên file atlas (xem open_atlas).
+    """
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                return None
+            if [int(s) for s in data["sizes"]] != [int(s) for s in sizes]:
+                return None
+            arrays = {k: data[k] for k in data.files}
+        n = len(arrays["paths"])
+        for sz in sizes:
+            tiles = open_atlas(atlas_path(cache_file, sz, str(arrays["atlas_token"])))
+            if tiles.shape != (n, sz, sz, 3) or tiles.dtype != np.uint8:
+                return None
+            arrays[f"tiles_{sz}"] = tiles
+        return arrays
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+def save(cache_file: str, sizes: List[int],
+         paths: List[str], mtimes: np.ndarray, fsizes: np.ndarray,
+         levels: Dict[int, Tuple[np.ndarray, np.ndarray]],
+         failed: Dict[str, Tuple[int, int]]) -> bool:
+    """
+    Ghi cache ra đĩa: đặc trưng + thông tin file vào .npz, tiles từng level vào 1 atlas .npy riêng
+    (ghi file tạm rồi đổi tên, xem _save_npz). Atlas của các lần ghi trước được xóa nếu được.
+    Trả về False nếu không ghi được (VD: thư mục chỉ đọc).
+    """
+    token = uuid.uuid4().hex[:12]
+    written = []
+    for sz, (t_arr, _) in levels.items():
+        path = atlas_path(cache_file, sz, token)
+        if not _save_npy(path, t_arr):
+            for done in written:
+                _remove_quietly(done)
+            return False
+        written.append(path)
+
+    arrays = {
+        "version": np.array(CACHE_VERSION, dtype=np.int32),
+        "atlas_token": np.array(token),
+        "sizes": np.array(sizes, dtype=np.int32),
+        "paths": np.array(paths, dtype=np.str_),
+        "mtimes": np.asarray(mtimes, dtype=np.int64),
+        "fsizes": np.asarray(fsizes, dtype=np.int64),
+        "failed_paths": np.array(list(failed.keys()), dtype=np.str_),
+        "failed_mtimes": np.array([s[0] for s in failed.values()], dtype=np.int64),
+        "failed_fsizes": np.array([s[1] for s in failed.values()], dtype=np.int64),
+    }
+    for sz, (_, f_arr) in levels.items():
+        arrays[f"feats_{sz}"] = f_arr
+
+    if not _save_npz(cache_file, arrays):
+        for done in written:
+            _remove_quietly(done)
+        return False
+
+    # Atlas cũ: trên Windows file đang được map không xóa được -> bỏ qua, lần ghi sau dọn tiếp
+    for old in glob.glob(f"{glob.escape(os.path.splitext(cache_file)[0])}_atlas_*.npy"):
+        if old not in written:
+            _remove_quietly(old)
+    return True
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _save_npy(path: str, arr: np.ndarray) -> bool:
+    """Ghi 1 mảng ra .npy (file tạm rồi đổi tên). False nếu không ghi được."""
+    tmp_file = path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_file, "wb") as f:
+            np.save(f, np.ascontiguousarray(arr), allow_pickle=False)
+        os.replace(tmp_file, path)
+        return True
+    except OSError:
+        _remove_quietly(tmp_file)
+        return False
+
+def portable_tiles(tiles: np.ndarray) -> Union[np.ndarray, str]:
+    """
+    Dạng gửi được sang process khác của 1 mảng tiles: memmap atlas -> đường dẫn file
+    (process nhận mở lại bằng open_tiles, các process dùng chung page cache của hệ điều hành
+    thay vì mỗi process 1 bản sao), mảng thường -> giữ nguyên.
+    """
+    # Chỉ memmap mở trực tiếp từ file (base là mmap), không phải view / lát cắt của nó
+    if isinstance(tiles, np.memmap) and tiles.filename is not None and isinstance(tiles.base, mmap.mmap):
+        return str(tiles.filename)
+    return tiles
+
+def open_tiles(handle: Union[np.ndarray, str]) -> np.ndarray:
+    """Ngược lại của portable_tiles."""
+    return open_atlas(handle) if isinstance(handle, str) else handle
+
+def _save_npz(cache_file: str, arrays: Dict[str, np.ndarray]) -> bool:
+    """Ghi file tạm rồi đổi tên để không bao giờ để lại file dở dang. False nếu không ghi được."""
+    tmp_file = cache_file + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Dùng file object để np.savez không tự thêm đuôi .npz
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_file, cache_file)
+        return True
+    except OSError:
+        if os.path.exists(tmp_file):
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+        return False
+
+def features_digest(features: np.ndarray) -> str:
+    """Dấu vân tay của mảng đặc trưng: chỉ mục dựng từ đúng bộ đặc trưng này mới được dùng lại."""
+    return hashlib.sha1(np.ascontiguousarray(features, dtype=np.float32).tobytes()).hexdigest()
+
+def lut_path(cache_dir: str, size: int, bits: int, candidates: int) -> str:
+    """File cache bảng tra màu (ColorLUTIndex) của 1 level."""
+    return os.path.join(cache_dir, f"lut_v{CACHE_VERSION}_{size}_b{bits}_k{candidates}.npz")
+
+def load_lut(lut_file: str, features: np.ndarray) -> Optional[Dict[str, np.ndarray]]:
+    """Đọc bảng tra màu. None nếu không có, hỏng, khác phiên bản hoặc dựng từ đặc trưng khác."""
+    if not os.path.isfile(lut_file):
+        return None
+    try:
+        with np.load(lut_file, allow_pickle=False) as data:
+            if int(data["version"]) != CACHE_VERSION:
+                return None
+            if str(data["digest"]) != features_digest(features):
+                return None
+            return {k: data[k] for k in data.files}
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+def save_lut(lut_file: str, features: np.ndarray, arrays: Dict[str, np.ndarray]) -> bool:
+    """Ghi bảng tra màu kèm dấu vân tay đặc trưng."""
+    arrays = dict(arrays)
+    arrays["version"] = np.array(CACHE_VERSION, dtype=np.int32)
+    arrays["digest"] = np.array(features_digest(features))
+    return _save_npz(lut_file, arrays)
@@ -0,0 +1,369 @@
+import os
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from algorithms import tile_cache
+from algorithms import multiresolution
+from algorithms.kdtree_nn import KDTreeNearestNeighbor
+from algorithms.multiresolution import _list_image_files, _build_levels, load_tile_levels_keyed
+
+# Bộ đệm brute-force được gộp vào KD-Tree (rebalance) khi vượt max(SIDE_MIN, SIDE_FRACTION * số điểm trong cây)
+SIDE_MIN = 2048
+SIDE_FRACTION = 0.1
+
+# Rebalance khi số tile đã xóa (tombstone) vượt tỉ lệ này
+DEAD_FRACTION = 0.1
+
+# Giới hạn phần tử ma trận khoảng cách tạm (truy vấn x điểm đệm) khi quét brute-force
+_SCAN_BLOCK = 1 << 22
+
+def _grow(arr: np.ndarray, n: int, needed: int) -> np.ndarray:
+    """Mảng có sức chứa >= needed hàng (gấp đôi khi thiếu), giữ nguyên n hàng đầu."""
+    if needed <= len(arr):
+        return arr
+    out = np.empty((max(needed, 2 * len(arr), 16),) + arr.shape[1:], dtype=arr.dtype)
+    out[:n] = arr[:n]
+    return out
+
+def _brute_k(targets: np.ndarray, points: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """k điểm gần nhất trong `points` (nhãn ids) cho mỗi truy vấn, quét toàn bộ. Trả về (d2, ids) (M, k) tăng dần."""
+    m = len(targets)
+    k = min(k, len(points))
+    best_d2 = np.empty((m, k), dtype=np.float32)
+    best_id = np.empty((m, k), dtype=np.int64)
+    step = max(1, _SCAN_BLOCK // max(1, len(points) * targets.shape[1]))
+    for s in range(0, m, step):
+        diff = targets[s:s + step, None, :] - points[None, :, :]
+        d2 = np.einsum('qpk,qpk->qp', diff, diff)
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k] if k < d2.shape[1] else np.broadcast_to(
+            np.arange(d2.shape[1]), d2.shape)
+        pd2 = np.take_along_axis(d2, part, axis=1)
+        order = np.argsort(pd2, axis=1, kind="stable")
+        best_d2[s:s + step] = np.take_along_axis(pd2, order, axis=1)
+        best_id[s:s + step] = ids[np.take_along_axis(part, order, axis=1)]
+    return best_d2, best_id
+
+class IncrementalIndex:
+    """
+    Chỉ mục láng giềng gần nhất cho phép thêm / xóa điểm mà không dựng lại cây mỗi lần:
+      - KD-Tree chính cho các hàng [0, n_main),
+      - bộ đệm brute-force cho các hàng thêm sau [n_main, n),
+      - tombstone (alive = False) cho hàng đã xóa: không bao giờ được trả về.
+    Chỉ số trả về là số hàng, ổn định tới lần rebalance() kế tiếp.
+    Cùng giao diện với KDTreeNearestNeighbor (colors, query, query_batch, query_k_batch).
+    """
+
+    def __init__(self, colors_arr: np.ndarray):
+        colors_arr = np.asarray(colors_arr, dtype=np.float32)
+        if colors_arr.ndim != 2 or colors_arr.shape[0] == 0:
+            raise ValueError("colors_arr phải có shape (N, F) và N > 0")
+        self._colors = colors_arr.copy()
+        self._alive = np.ones(len(colors_arr), dtype=bool)
+        self.n = len(colors_arr)
+        self.n_dead = 0
+        self._rebuild()
+
+    def _rebuild(self):
+        self.n_main = self.n
+        self.tree = KDTreeNearestNeighbor(self._colors[:self.n])
+
+    @property
+    def colors(self) -> np.ndarray:
+        return self._colors[:self.n]
+
+    @property
+    def n_alive(self) -> int:
+        return self.n - self.n_dead
+
+    def add(self, colors: np.ndarray) -> np.ndarray:
+        """Thêm điểm vào bộ đệm. Trả về số hàng của các điểm mới."""
+        colors = np.asarray(colors, dtype=np.float32).reshape(-1, self._colors.shape[1])
+        start, end = self.n, self.n + len(colors)
+        self._colors = _grow(self._colors, self.n, end)
+        self._alive = _grow(self._alive, self.n, end)
+        self._colors[start:end] = colors
+        self._alive[start:end] = True
+        self.n = end
+        return np.arange(start, end, dtype=np.int64)
+
+    def remove(self, rows: np.ndarray):
+        """Đánh dấu xóa các hàng (tombstone)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[self._alive[rows]]
+        self._alive[rows] = False
+        self.n_dead += len(np.unique(rows))
+
+    def needs_rebalance(self) -> bool:
+        side = self.n - self.n_main
+        return side > max(SIDE_MIN, SIDE_FRACTION * self.n_main) or self.n_dead > DEAD_FRACTION * self.n
+
+    def rebalance(self) -> np.ndarray:
+        """Bỏ hàng đã xóa, gộp bộ đệm vào cây mới. Trả về số hàng cũ được giữ (theo thứ tự mới)."""
+        keep = np.flatnonzero(self._alive[:self.n])
+        if keep.size == 0:
+            raise ValueError("Chỉ mục phải còn ít nhất 1 điểm")
+        self._colors = self._colors[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self.n = len(keep)
+        self.n_dead = 0
+        self._rebuild()
+        return keep
+
+    def rebalanced(self) -> Tuple["IncrementalIndex", np.ndarray]:
+        """Như rebalance() nhưng trả về chỉ mục mới (chỉ mục này giữ nguyên): (chỉ mục mới, số hàng cũ được giữ)."""
+        keep = np.flatnonzero(self._alive[:self.n])
+        if keep.size == 0:
+            raise ValueError("Chỉ mục phải còn ít nhất 1 điểm")
+        return IncrementalIndex(self._colors[keep]), keep
+
+    def snapshot(self) -> "IncrementalIndex":
+        """
+        Bản chỉ đọc ở trạng thái hiện tại: thấy đúng n hàng hiện có, không bị add / remove / rebalance sau đó
+        ảnh hưởng (add chỉ ghi sau hàng n hoặc sang mảng mới, rebalance gán mảng / cây mới).
+        """
+        snap = object.__new__(IncrementalIndex)
+        snap._colors = self._colors
+        snap._alive = self._alive[:self.n].copy()
+        snap.n = self.n
+        snap.n_dead = self.n_dead
+        snap.n_main = self.n_main
+        snap.tree = self.tree
+        return snap
+
+    # --- TRUY VẤN ---
+
+    def _main_k(self, targets: np.ndarray, k: int, visit_counts=None) -> Tuple[np.ndarray, np.ndarray]:
+        """k điểm còn sống gần nhất trong cây chính (d2, idx) (M, k), thiếu thì đệm inf / -1."""
+        m = len(targets)
+        out_d2 = np.full((m, k), np.inf, dtype=np.float32)
+        out_idx = np.full((m, k), -1, dtype=np.int64)
+        if k == 1:
+            d, i = self.tree.query_batch(targets, visit_counts)
+            d, i = d[:, None], i[:, None]
+        else:
+            d, i = self.tree.query_k_batch(targets, k)
+
+        # Truy vấn trúng tombstone: hỏi lại với k tăng dần tới khi đủ k điểm còn sống
+        pending = np.arange(m)
+        kk = k
+        need = min(k, int(self._alive[:self.n_main].sum()))
+        while True:
+            live = self._alive[i]
+            enough = live.sum(axis=1) >= need
+            done = pending[enough]
+            if done.size:
+                dd, ii, lv = d[enough], i[enough], live[enough]
+                # Dồn các cột còn sống lên trước, giữ thứ tự tăng dần
+                order = np.argsort(~lv, axis=1, kind="stable")[:, :k]
+                dd = np.take_along_axis(np.where(lv, dd, np.inf), order, axis=1)
+                ii = np.take_along_axis(np.where(lv, ii, -1), order, axis=1)
+                cols = min(k, dd.shape[1])
+                out_d2[done, :cols] = dd[:, :cols] ** 2
+                out_idx[done, :cols] = ii[:, :cols]
+            pending = pending[~enough]
+            if pending.size == 0 or kk >= self.n_main:
+                break
+            kk = min(kk * 4, self.n_main)
+            d, i = self.tree.query_k_batch(targets[pending], kk)
+        return out_d2, out_idx
+
+    def _side_k(self, targets: np.ndarray, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        ids = self.n_main + np.flatnonzero(self._alive[self.n_main:self.n])
+        if ids.size == 0:
+            return None
+        return _brute_k(targets, self._colors[ids], ids, k)
+
+    def query_k_batch(self, colors: np.ndarray, k: int, visit_counts=None) -> Tuple[np.ndarray, np.ndarray]:
+        """k điểm còn sống gần nhất. Trả về (dists, idxs) shape (M, k), mỗi hàng tăng dần."""
+        k = int(k)
+        if k < 1:
+            raise ValueError("k phải >= 1")
+        k = min(k, self.n_alive)
+        if k == 0:
+            raise ValueError("Chỉ mục không còn điểm nào")
+        targets = np.asarray(colors, dtype=np.float32).reshape(-1, self._colors.shape[1])
+
+        d2, idx = self._main_k(targets, k, visit_counts)
+        side = self._side_k(targets, k)
+        if side is not None:
+            d2 = np.concatenate([d2, side[0]], axis=1)
+            idx = np.concatenate([idx, side[1]], axis=1)
+            order = np.argsort(d2, axis=1, kind="stable")[:, :k]
+            d2 = np.take_along_axis(d2, order, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+        return np.sqrt(d2), idx
+
+    def query_batch(self, colors: np.ndarray, visit_counts=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Truy vấn nhiều màu cùng lúc. Trả về (dists, idxs) shape (M,)."""
+        d, i = self.query_k_batch(colors, 1, visit_counts)
+        return d[:, 0], i[:, 0]
+
+    def query(self, color: np.ndarray) -> int:
+        _, idx = self.query_batch(np.asarray(color, dtype=np.float32).reshape(1, -1))
+        return int(idx[0])
+
+class TileLibrary:
+    """
+    Kho tiles cập nhật dần: thêm / xóa ảnh chỉ tốn chi phí tỉ lệ với phần thay đổi.
+    Mỗi level giữ mảng tiles có sức chứa dư (thêm vào cuối) và 1 IncrementalIndex; ảnh bị xóa
+    chỉ bị đánh dấu, được dọn khi rebalance() (tự gọi khi bộ đệm / số tile xóa vượt ngưỡng).
+    rescan() so thư mục với lần quét trước (đường dẫn, mtime, dung lượng) và chỉ xử lý phần chênh lệch.
+
+    tiles_db() trả về {size: (tiles_array, index)} dùng được như kết quả của build_tiles_db
+    (VD: MosaicGenerator(..., tiles_db=lib.tiles_db())). Chỉ số tile đổi sau mỗi lần rebalance.
+    """
+
+    def __init__(self, tiles_folder: str, sizes: List[int],
+                 progress_callback: Callable[[float, str], None] = lambda p, m: None,
+                 use_cache: bool = True,
+                 cache_dir: Optional[str] = None,
+                 use_texture: Optional[bool] = None):
+        self.tiles_folder = tiles_folder
+        self.sizes = list(sizes)
+        # Loại đặc trưng cố định cho cả kho (ảnh thêm sau dùng cùng loại), None = theo USE_TEXTURE
+        self.use_texture = multiresolution.USE_TEXTURE if use_texture is None else use_texture
+        self._lock = threading.RLock()
+        self._db = None
+
+        file_list = _list_image_files(tiles_folder)
+        if not file_list: raise Exception("Thư mục tiles trống!")
+        if use_cache and cache_dir is None:
+            cache_dir = os.path.join(tiles_folder, tile_cache.CACHE_DIRNAME)
+
+        levels, keys, sigs, failed = load_tile_levels_keyed(file_list, self.sizes, progress_callback,
+                                                            cache_dir if use_cache else None,
+                                                            use_texture=self.use_texture)
+        self._n = len(keys)
+        self._keys = list(keys)
+        self._row_of = {key: r for r, key in enumerate(keys)}
+        self._sigs = dict(zip(keys, sigs))
+        self._failed = dict(failed)
+        self._tiles = {sz: levels[sz][0] for sz in self.sizes}
+        self._indexes = {sz: IncrementalIndex(levels[sz][1]) for sz in self.sizes}
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.abspath(path) in self._row_of
+
+    def tiles_db(self) -> Dict[int, Tuple[np.ndarray, IncrementalIndex]]:
+        """
+        {size: (tiles_array, index)} hiện tại. Trả về cùng 1 đối tượng tới lần thay đổi kế tiếp.
+        Chỉ mục là snapshot(): các bản đã trả về vẫn khớp với mảng tiles của chúng sau add / remove / rebalance.
+        """
+        with self._lock:
+            if self._db is None:
+                self._db = {sz: (self._tiles[sz][:self._n], self._indexes[sz].snapshot()) for sz in self.sizes}
+            return self._db
+
+    def add(self, paths: List[str],
+            progress_callback: Callable[[float, str], None] = lambda p, m: None) -> int:
+        """Nạp thêm ảnh (ảnh đã có trong kho thì được nạp lại). Trả về số ảnh nạp thành công."""
+        with self._lock:
+            # Bỏ đường dẫn trùng (cùng abspath): mỗi ảnh chỉ được 1 hàng, _row_of không để sót hàng mồ côi
+            unique = {}
+            for p in paths:
+                if os.path.isfile(p):
+                    unique.setdefault(os.path.abspath(p), p)
+            paths = list(unique.values())
+            if not paths:
+                return 0
+            # Hàng cũ của ảnh được nạp lại chỉ bị xóa sau khi thêm hàng mới -> nạp lại ảnh duy nhất vẫn được
+            old_rows = [self._row_of[os.path.abspath(p)] for p in paths if p in self]
+
+            levels, ok = _build_levels(paths, self.sizes, progress_callback, use_texture=self.use_texture)
+            n_new = int(ok.sum())
+            if n_new == 0 and old_rows and len(old_rows) == len(self._row_of):
+                raise Exception("Không thể xóa toàn bộ tiles trong kho!")
+            for path, good in zip(paths, ok):
+                key = os.path.abspath(path)
+                try:
+                    sig = tile_cache.file_signature(path)
+                except OSError:
+                    sig = (0, 0)
+                if good:
+                    self._row_of[key] = len(self._keys)
+                    self._keys.append(key)
+                    self._sigs[key] = sig
+                    self._failed.pop(key, None)
+                else:
+                    self._row_of.pop(key, None)
+                    self._sigs.pop(key, None)
+                    self._failed[key] = sig
+
+            if n_new:
+                start, end = self._n, self._n + n_new
+                for sz in self.sizes:
+                    t_new, f_new = levels[sz]
+                    self._tiles[sz] = _grow(self._tiles[sz], self._n, end)
+                    self._tiles[sz][start:end] = t_new
+                    self._indexes[sz].add(f_new)
+                self._n = end
+            if old_rows:
+                for index in self._indexes.values():
+                    index.remove(np.array(old_rows, dtype=np.int64))
+            if n_new or old_rows:
+                self._db = None
+            self._maybe_rebalance()
+            return n_new
+
+    def remove(self, paths: List[str]) -> int:
+        """Xóa ảnh khỏi kho (tombstone). Trả về số ảnh đã xóa."""
+        with self._lock:
+            keys = {os.path.abspath(p) for p in paths}
+            rows = [self._row_of[key] for key in keys if key in self._row_of]
+            if rows and len(rows) == len(self._row_of):
+                raise Exception("Không thể xóa toàn bộ tiles trong kho!")
+            for key in keys:
+                self._row_of.pop(key, None)
+                self._sigs.pop(key, None)
+                self._failed.pop(key, None)
+            if rows:
+                for index in self._indexes.values():
+                    index.remove(np.array(rows, dtype=np.int64))
+                self._db = None
+                self._maybe_rebalance()
+            return len(rows)
+
+    def rescan(self, progress_callback: Callable[[float, str], None] = lambda p, m: None) -> Tuple[int, int]:
+        """Đồng bộ với thư mục tiles: nạp ảnh mới / đã sửa, xóa ảnh không còn. Trả về (số nạp, số xóa)."""
+        with self._lock:
+            current = {}
+            for path in _list_image_files(self.tiles_folder):
+                try:
+                    current[os.path.abspath(path)] = (path, tile_cache.file_signature(path))
+                except OSError:
+                    continue
+
+            gone = [key for key in self._row_of if key not in current]
+            fresh = [path for key, (path, sig) in current.items()
+                     if self._sigs.get(key) != sig and self._failed.get(key) != sig]
+            if not gone and not fresh:
+                return 0, 0
+
+            progress_callback(0, f"Kho tiles thay đổi: thêm/sửa {len(fresh)}, xóa {len(gone)}")
+            # Thêm trước rồi mới xóa: tránh kho rỗng tạm thời khi thay toàn bộ ảnh
+            added = self.add(fresh, progress_callback)
+            removed = self.remove(gone)
+            return added, removed
+
+    def _maybe_rebalance(self):
+        if any(index.needs_rebalance() for index in self._indexes.values()):
+            self.rebalance()
+
+    def rebalance(self):
+        """
+        Dọn tile đã xóa và dựng lại cây cho mọi level (chỉ số tile thay đổi).
+        Chỉ mục / mảng tiles mới được tạo thay vì sửa tại chỗ -> tiles_db() đã trả về trước đó vẫn dùng được.
+        """
+        with self._lock:
+            keep = None
+            for sz in self.sizes:
+                self._indexes[sz], keep = self._indexes[sz].rebalanced()
+                self._tiles[sz] = self._tiles[sz][keep]
+            self._keys = [self._keys[r] for r in keep]
+            self._row_of = {key: r for r, key in enumerate(self._keys)}
+            self._n = len(self._keys)
+            self._db = None
@@ -0,0 +1,189 @@
+import time
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from algorithms.multiresolution import (
+    level_sizes, build_tiles_db, blend_mosaic, _level_query
+)
+from algorithms.kdtree_nn import KDTreeNearestNeighbor
+from algorithms.quadtree import plan_quadtree, SPLIT_THRESHOLD, BLOCK_X, BLOCK_Y, BLOCK_SIZE
+from algorithms.compositing import composite_level
+from algorithms.metrics import MetricsRecorder, maybe_stage
+from algorithms.cancel import CancelToken
+
+# Block giữ nguyên tile của frame trước nếu mọi thành phần mean / std (thang 0..255) lệch
+# không quá ngưỡng này so với lúc tile được chọn -> ít nhấp nháy, chỉ truy vấn lại vùng thay đổi.
+VIDEO_TOLERANCE = 4.0
+
+# Codec mặc định cho file kết quả (mp4v có sẵn trong mọi bản OpenCV)
+VIDEO_FOURCC = "mp4v"
+
+# FPS dùng khi video nguồn không khai báo
+DEFAULT_FPS = 25.0
+
+class TemporalMosaic:
+    """
+    Ghép mosaic cho chuỗi frame cùng kích thước, dùng lại kết quả frame trước:
+      - Quadtree được lập lại mỗi frame (bảng tổng tích lũy, vector hóa, rẻ so với matching / ghép).
+      - Block trùng vị trí + size với 1 block của frame trước và có mean / std lệch <= tolerance so với
+        thống kê lúc tile được chọn -> giữ tile cũ, không truy vấn, không vẽ lại (ảnh mosaic giữ qua các frame).
+      - Chỉ các block còn lại được truy vấn chỉ mục và ghép lại.
+    So với thống kê lúc chọn tile (không phải frame liền trước) -> thay đổi chậm không bị tích lũy mãi.
+    Chi phí truy vấn / ghép mỗi frame tỉ lệ với phần ảnh thực sự thay đổi.
+    """
+
+    def __init__(self, tiles_db: Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]], sizes: List[int],
+                 tolerance: float = VIDEO_TOLERANCE):
+        if tolerance < 0:
+            raise ValueError("tolerance phải >= 0")
+        self.tiles_db = tiles_db
+        self.sizes = list(sizes)
+        self.tolerance = float(tolerance)
+        self.reset()
+
+    def reset(self):
+        """Bỏ trạng thái frame trước (frame kế tiếp được ghép lại toàn bộ)."""
+        self.mosaic = None
+        self.placements = np.zeros((0, 6), dtype=np.int64)
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._anchors = np.zeros((0, 6), dtype=np.float32)
+        self._edge_cache = {}
+        self.last_requeried = 0
+
+    def _block_keys(self, blocks: np.ndarray, w_img: int) -> np.ndarray:
+        """Khóa duy nhất cho mỗi block theo (y, x, size)."""
+        b = blocks.astype(np.int64)
+        return (b[:, BLOCK_Y] * w_img + b[:, BLOCK_X]) * (self.sizes[0] + 1) + b[:, BLOCK_SIZE]
+
+    def render(self, frame: np.ndarray, metrics: Optional[MetricsRecorder] = None) -> np.ndarray:
+        """
+        Ghép 1 frame (BGR). Trả về mosaic chưa blend (bộ đệm dùng chung giữa các frame, không được sửa).
+        Sau khi gọi: placements (M, 6) như compose_mosaic, last_requeried = số block phải truy vấn lại.
+        """
+        h_img, w_img = frame.shape[:2]
+        if self.mosaic is None or self.mosaic.shape != frame.shape:
+            self.reset()
+            self.mosaic = np.zeros_like(frame)
+
+        with maybe_stage(metrics, "plan_quadtree"):
+            blocks, stats = plan_quadtree(frame, self.sizes, SPLIT_THRESHOLD)
+        keys = self._block_keys(blocks, w_img)
+
+        # Ghép cặp với block cùng khóa của frame trước (_keys đã sắp tăng dần)
+        idxs = np.full(len(blocks), -1, dtype=np.int64)
+        anchors = stats.copy()
+        if len(self._keys):
+            pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            same = self._keys[pos] == keys
+            same[same] = np.abs(stats[same] - self._anchors[pos[same]]).max(axis=1) <= self.tolerance
+            idxs[same] = self.placements[pos[same], 5]
+            anchors[same] = self._anchors[pos[same]]
+
+        changed = idxs < 0
+        self.last_requeried = int(changed.sum())
+        if metrics is not None:
+            metrics.count("video_blocks_reused", len(blocks) - self.last_requeried)
+            metrics.count("video_blocks_requeried", self.last_requeried)
+
+        for sz in self.sizes:
+            sel = np.flatnonzero(changed & (blocks[:, BLOCK_SIZE] == sz))
+            if sel.size == 0:
+                continue
+            t_arr, tree, query_mat = _level_query(self.tiles_db, sz, self.sizes[-1], stats[sel])
+            with maybe_stage(metrics, "matching"):
+                _, idxs[sel] = tree.query_batch(query_mat)
+            with maybe_stage(metrics, "compositing"):
+                composite_level(self.mosaic, blocks[sel], t_arr, idxs[sel], self._edge_cache)
+
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._anchors = anchors[order]
+        self.placements = np.column_stack([blocks, idxs]).astype(np.int64)[order]
+        return self.mosaic
+
+def video_mosaic(
+    video_path: str,
+    tiles_folder: str,
+    out_path: str,
+    base_tile: int = 15,
+    levels: int = 3,
+    blend_factor: float = 0.2,
+    tolerance: float = VIDEO_TOLERANCE,
+    progress_callback: Callable[[float, str], None] = lambda p, m: None,
+    use_cache: bool = True,
+    tiles_db: Optional[Dict[int, Tuple[np.ndarray, KDTreeNearestNeighbor]]] = None,
+    index: Union[str, Dict[int, str]] = "kdtree",
+    fourcc: str = VIDEO_FOURCC,
+    max_frames: Optional[int] = None,
+    metrics: Optional[MetricsRecorder] = None,
+    cancel: Optional[CancelToken] = None,
+    use_texture: Optional[bool] = None
+) -> Dict:
+    """
+    Chuyển video thành video mosaic: đọc lần lượt từng frame, ghép bằng TemporalMosaic
+    (kho tiles nạp 1 lần, block không đổi giữ nguyên tile), blend rồi ghi ngay frame đó ra out_path.
+    Trả về thống kê: frames, blocks (tổng số block), requeried (số block phải truy vấn lại), elapsed_s.
+    cancel: CancelToken, kiểm tra giữa các frame (ném MosaicCancelled; phần đã ghi vẫn xem được).
+    use_texture: khớp cả vân (đặc trưng 6 chiều), None = theo multiresolution.USE_TEXTURE.
+    """
+    t0 = time.perf_counter()
+    try:
+        sizes = level_sizes(base_tile, levels)
+        progress_callback(5, f"Levels cấu hình: {sizes}")
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened(): raise Exception("Lỗi đọc video gốc!")
+        writer = None
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            if max_frames is not None and (total <= 0 or max_frames < total):
+                total = max_frames
+
+            if tiles_db is None:
+                with maybe_stage(metrics, "tiles_db"):
+                    tiles_db = build_tiles_db(tiles_folder, sizes, progress_callback,
+                                              use_cache=use_cache, index=index, metrics=metrics,
+                                              use_texture=use_texture)
+
+            temporal = TemporalMosaic(tiles_db, sizes, tolerance)
+            n_frames = n_blocks = n_requeried = 0
+            while max_frames is None or n_frames < max_frames:
+                if cancel is not None:
+                    cancel.check()
+                with maybe_stage(metrics, "decode_frame"):
+                    ok, frame = cap.read()
+                if not ok:
+                    break
+
+                with maybe_stage(metrics, "render"):
+                    mosaic = temporal.render(frame, metrics)
+                result = blend_mosaic(mosaic, frame, blend_factor, metrics=metrics)
+
+                if writer is None:
+                    h, w = frame.shape[:2]
+                    writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*fourcc), fps, (w, h))
+                    if not writer.isOpened(): raise Exception("Không tạo được file video kết quả!")
+                with maybe_stage(metrics, "encode"):
+                    writer.write(result)
+
+                n_frames += 1
+                n_blocks += len(temporal.placements)
+                n_requeried += temporal.last_requeried
+                pct = min(100.0, n_frames / total * 100) if total > 0 else 0.0
+                progress_callback(10 + pct * 0.9,
+                                  f"Frame {n_frames}: ghép lại {temporal.last_requeried}/{len(temporal.placements)} block")
+        finally:
+            cap.release()
+            if writer is not None:
+                writer.release()
+
+        if n_frames == 0: raise Exception("Video gốc không có frame nào!")
+    finally:
+        if metrics is not None:
+            metrics.finish()
+
+    progress_callback(100, "Hoàn tất!")
+    return {"frames": n_frames, "blocks": n_blocks, "requeried": n_requeried,
+            "elapsed_s": time.perf_counter() - t0}
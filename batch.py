@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import json
+import argparse
+
+from algorithms.batch import expand_targets, run_batch
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tạo tranh Mosaic hàng loạt (không cần giao diện). "
+                    "Kho tiles chỉ được nạp và dựng chỉ mục 1 lần cho mọi ảnh gốc.")
+    parser.add_argument("targets", nargs="+",
+                        help="Ảnh gốc: file, thư mục, glob (\"imgs/*.jpg\") hoặc file .txt liệt kê đường dẫn")
+    parser.add_argument("-t", "--tiles", required=True, help="Thư mục kho ảnh ghép")
+    parser.add_argument("-o", "--out", required=True, help="Thư mục ghi kết quả")
+    parser.add_argument("--tile-size", type=int, default=15, help="Kích thước ô nhỏ nhất (px)")
+    parser.add_argument("--levels", type=int, default=3, help="Số level Quadtree")
+    parser.add_argument("--blend", type=float, default=0.2, help="Tỉ lệ pha trộn ảnh gốc (0..1)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="Số process song song (1 = chạy tuần tự)")
+    parser.add_argument("--format", default="jpg", choices=["jpg", "png", "bmp", "webp", "ppm", "npy", "dzi"],
+                        help="Định dạng ảnh kết quả (dzi = kim tự tháp ô Deep Zoom cho ảnh rất lớn)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Ghép và ghi theo từng dải ngang cho ảnh rất lớn (cần --format ppm, npy hoặc dzi)")
+    parser.add_argument("--strip-rows", type=int, default=None,
+                        help="Chiều cao dải khi --stream (làm tròn xuống bội số của ô lớn nhất)")
+    parser.add_argument("--index", default="kdtree", choices=["kdtree", "lut"],
+                        help="Chỉ mục tìm tile: KD-Tree hoặc bảng tra màu dựng sẵn (lut, được cache)")
+    parser.add_argument("--texture", action="store_true",
+                        help="Khớp cả vân (đặc trưng 6 chiều màu + độ lệch chuẩn), không dùng được với --index lut")
+    parser.add_argument("--no-cache", action="store_true", help="Không dùng cache tiles trên đĩa")
+    parser.add_argument("--report", help="Ghi thống kê thời gian từng ảnh ra file JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.texture and args.index == "lut":
+        print("--texture không dùng được với --index lut (bảng tra chỉ cho màu 3 chiều).", file=sys.stderr)
+        return 1
+
+    targets = expand_targets(args.targets)
+    if not targets:
+        print("Không tìm thấy ảnh gốc nào.", file=sys.stderr)
+        return 1
+
+    def on_progress(p, msg):
+        if not msg.startswith("Loading") and not msg.startswith("Resizing"):
+            print(f"[{p:5.1f}%] {msg}", flush=True)
+
+    def on_result(res):
+        if res["ok"]:
+            print(f"  {res['target']} -> {res['output']}: {res['total_s']:.2f}s "
+                  f"(đọc {res['read_s']:.2f}s, ghép {res['render_s']:.2f}s, ghi {res['write_s']:.2f}s)", flush=True)
+        else:
+            print(f"  LỖI {res['target']}: {res['error']}", file=sys.stderr, flush=True)
+
+    t0 = time.perf_counter()
+    results = run_batch(
+        targets, args.tiles, args.out,
+        base_tile=args.tile_size, levels=args.levels, blend_factor=args.blend,
+        workers=args.workers, ext="." + args.format, use_cache=not args.no_cache,
+        stream=args.stream, strip_rows=args.strip_rows, index=args.index,
+        progress_callback=on_progress, result_callback=on_result, use_texture=args.texture,
+    )
+    elapsed = time.perf_counter() - t0
+
+    n_ok = sum(r["ok"] for r in results)
+    print(f"Hoàn tất {n_ok}/{len(results)} ảnh trong {elapsed:.2f}s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"elapsed_s": elapsed, "results": results}, f, ensure_ascii=False, indent=2)
+
+    return 0 if n_ok == len(results) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Đo thời gian từng giai đoạn của pipeline ghép tranh trên dữ liệu giả sinh tại chỗ.
+
+    python -m benchmarks.run --preset quick --out bench.json
+    python -m benchmarks.run --preset full --out new.json --baseline old.json --tolerance 1.3
+
+Kết quả ghi ra JSON (so sánh được giữa các commit). Chạy thất bại (exit code 1) nếu một giai đoạn
+chậm hơn baseline quá `tolerance` lần hoặc vượt giới hạn tuyệt đối `--limit giai_doan=giây`.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tempfile
+from typing import Dict, List
+
+import cv2
+import numpy as np
+
+from algorithms.multiresolution import level_sizes, build_tiles_db, render_mosaic
+from algorithms.metrics import MetricsRecorder
+from algorithms.kdtree_module import KDTree, FlatKDTree
+from benchmarks.synthetic import make_tile_folder, make_target
+
+PRESETS = {
+    "quick": {"tiles": [1000], "targets": [1]},
+    "full": {"tiles": [1000, 10000, 100000], "targets": [1, 10, 100]},
+}
+
+# Giai đoạn chạy nhanh hơn ngưỡng này không bị so với baseline (nhiễu đo lớn hơn tín hiệu)
+MIN_COMPARE_SECONDS = 0.05
+
+def _noop(p, m):
+    pass
+
+class _Timer:
+    """Gom thời gian theo tên giai đoạn (cộng dồn nếu 1 giai đoạn chạy nhiều lần, VD: mỗi level)."""
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def run(self, name: str, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.add(name, time.perf_counter() - t0)
+        return result
+
+def _stage_times(metrics: MetricsRecorder) -> Dict[str, float]:
+    """Tổng thời gian từng giai đoạn MetricsRecorder đã ghi (giai đoạn lồng nhau được tính riêng)."""
+    metrics.finish()
+    return {name: s["wall_s"] for name, s in metrics.stages().items()}
+
+def bench_library(folder: str, sizes: List[int]):
+    """
+    Nạp kho tiles bằng đúng build_tiles_db (không cache) và lấy thời gian các giai đoạn nó ghi.
+    Trả về (thời gian, {size: (tiles, chỉ mục)}).
+    """
+    metrics = MetricsRecorder(track_memory=False)
+    tiles_db = build_tiles_db(folder, sizes, _noop, use_cache=False, metrics=metrics)
+    return _stage_times(metrics), tiles_db
+
+def bench_render(target: np.ndarray, tiles_db, sizes: List[int], blend_factor: float = 0.2):
+    """Ghép 1 ảnh bằng đúng render_mosaic. Trả về (thời gian các giai đoạn, số block mỗi level)."""
+    metrics = MetricsRecorder(track_memory=False)
+    render_mosaic(target, tiles_db, sizes, blend_factor, metrics=metrics)
+    counts = {str(sz): n for sz, n in metrics.to_dict()["values"].get("blocks_per_level", {}).items()}
+    return _stage_times(metrics), counts
+
+def bench_queries(features: np.ndarray, n_queries: int = 2000, seed: int = 0) -> Dict[str, float]:
+    """
+    So sánh các cách tìm tile gần nhất trên cùng bộ truy vấn (giây dựng cây, giây / 1000 truy vấn).
+    Kiểm tra luôn mọi cách cho cùng khoảng cách nhỏ nhất với brute-force.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.uniform(0, 255, (n_queries, features.shape[1])).astype(np.float32)
+    feats64 = features.astype(np.float64)
+
+    def brute_single():
+        return np.array([np.sqrt(((feats64 - q) ** 2).sum(axis=1).min()) for q in queries])
+
+    def brute_batch(chunk=1024):
+        out = np.empty(len(queries))
+        sq = (feats64 * feats64).sum(axis=1)
+        for s in range(0, len(queries), chunk):
+            q = queries[s:s + chunk].astype(np.float64)
+            d2 = (q * q).sum(axis=1)[:, None] + sq[None, :] - 2.0 * (q @ feats64.T)
+            out[s:s + chunk] = np.sqrt(np.maximum(d2.min(axis=1), 0.0))
+        return out
+
+    timer = _Timer()
+    t0 = time.perf_counter()
+    kd = KDTree(features)
+    timer.add("kdtree_build", time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    flat = FlatKDTree(features)
+    timer.add("flat_kdtree_build", time.perf_counter() - t0)
+
+    ref = timer.run("brute_force_single", brute_single)
+    results = {
+        "brute_force_batch": timer.run("brute_force_batch", brute_batch),
+        "kdtree_query": timer.run("kdtree_query", lambda: np.array([kd.query(q)[0] for q in queries])),
+        "kdtree_query_batch": timer.run("kdtree_query_batch", lambda: kd.query_batch(queries)[0]),
+        "flat_kdtree_query": timer.run("flat_kdtree_query", lambda: np.array([flat.query(q)[0] for q in queries])),
+        "flat_kdtree_query_batch": timer.run("flat_kdtree_query_batch", lambda: flat.query_batch(queries)[0]),
+    }
+    for name, dists in results.items():
+        if not np.allclose(dists, ref, atol=1e-2):
+            raise Exception(f"{name} cho kết quả khác brute-force!")
+
+    # Thời gian dựng cây giữ nguyên, thời gian truy vấn quy về 1000 truy vấn
+    per_k = 1000.0 / n_queries
+    out = {}
+    for name, sec in timer.times.items():
+        if name.endswith("_build"):
+            out[name] = sec
+        else:
+            out[f"{name}_per_1000"] = sec * per_k
+    return out
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run(tile_counts: List[int], target_mps: List[float], work_dir: str,
+        base_tile: int = 15, levels: int = 3, repeat: int = 1, n_queries: int = 2000,
+        log=print) -> Dict:
+    """Chạy toàn bộ ma trận (kho tiles x ảnh gốc). Mỗi giai đoạn lấy thời gian nhỏ nhất qua `repeat` lần."""
+    sizes = level_sizes(base_tile, levels)
+    timings: Dict[str, float] = {}
+    details: Dict[str, Dict] = {}
+
+    def _keep_min(prefix, times):
+        for stage, sec in times.items():
+            key = f"{prefix}/{stage}"
+            timings[key] = min(timings.get(key, float("inf")), sec)
+
+    targets = {}
+    for mp in target_mps:
+        log(f"Sinh ảnh gốc {mp}MP...")
+        targets[mp] = make_target(mp, seed=int(mp * 1000))
+
+    for n in tile_counts:
+        folder = os.path.join(work_dir, f"tiles_{n}")
+        log(f"Sinh kho {n} tiles tại {folder}...")
+        make_tile_folder(folder, n)
+
+        lib = f"tiles{n}"
+        tiles_db = None
+        for _ in range(repeat):
+            times, tiles_db = bench_library(folder, sizes)
+            _keep_min(f"{lib}/library", times)
+        log("  nạp kho: " + ", ".join(f"{k}={v:.3f}s" for k, v in timings.items() if k.startswith(lib)))
+
+        q_times = bench_queries(tiles_db[sizes[-1]][1].colors, n_queries)
+        _keep_min(f"{lib}/queries", q_times)
+
+        for mp, target in targets.items():
+            prefix = f"{lib}/target{mp:g}mp"
+            for _ in range(repeat):
+                times, counts = bench_render(target, tiles_db, sizes)
+                _keep_min(prefix, times)
+            details[prefix] = {"shape": list(target.shape[:2]), "blocks_per_level": counts}
+            log(f"  {prefix}: " + ", ".join(f"{k.split('/')[-1]}={v:.3f}s"
+                                          for k, v in timings.items() if k.startswith(prefix + "/")))
+        del tiles_db
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "sizes": sizes,
+            "repeat": repeat,
+        },
+        "timings": timings,
+        "details": details,
+    }
+
+def check(report: Dict, baseline: Dict = None, tolerance: float = 1.3,
+          limits: Dict[str, float] = None) -> List[str]:
+    """Danh sách vi phạm: chậm hơn baseline quá tolerance lần, hoặc vượt giới hạn tuyệt đối."""
+    failures = []
+    timings = report["timings"]
+    if baseline:
+        for key, old in baseline.get("timings", {}).items():
+            new = timings.get(key)
+            if new is None or max(old, new) < MIN_COMPARE_SECONDS:
+                continue
+            if new > old * tolerance:
+                failures.append(f"{key}: {new:.3f}s > {old:.3f}s x {tolerance}")
+
+    # Giới hạn theo tên giai đoạn (áp cho mọi kho / ảnh) hoặc theo khóa đầy đủ
+    for name, limit in (limits or {}).items():
+        for key, sec in timings.items():
+            if (key == name or key.endswith("/" + name)) and sec > limit:
+                failures.append(f"{key}: {sec:.3f}s > giới hạn {limit}s")
+    return failures
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark từng giai đoạn với kho tiles / ảnh gốc giả")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--tiles", type=int, nargs="+", help="Số tiles mỗi kho (ghi đè preset)")
+    parser.add_argument("--targets", type=float, nargs="+", help="Kích thước ảnh gốc theo MP (ghi đè preset)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "mosaic_bench"),
+                        help="Thư mục chứa kho tiles giả (được dùng lại giữa các lần chạy)")
+    parser.add_argument("--tile-size", type=int, default=15, help="Kích thước ô nhỏ nhất (px)")
+    parser.add_argument("--levels", type=int, default=3, help="Số level Quadtree")
+    parser.add_argument("--repeat", type=int, default=1, help="Số lần lặp, lấy thời gian nhỏ nhất")
+    parser.add_argument("--queries", type=int, default=2000, help="Số truy vấn khi so KD-Tree với brute-force")
+    parser.add_argument("--out", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--tolerance", type=float, default=1.3,
+                        help="Tỉ lệ chậm hơn baseline tối đa cho phép")
+    parser.add_argument("--limit", action="append", default=[], metavar="GIAI_DOAN=GIAY",
+                        help="Giới hạn tuyệt đối, VD: matching=2.5 hoặc tiles1000/target1mp/blending=0.1")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    preset = PRESETS[args.preset]
+
+    limits = {}
+    for item in args.limit:
+        name, _, value = item.partition("=")
+        if not value:
+            print(f"--limit không hợp lệ: {item}", file=sys.stderr)
+            return 2
+        limits[name] = float(value)
+
+    report = run(args.tiles or preset["tiles"], args.targets or preset["targets"], args.work_dir,
+                 base_tile=args.tile_size, levels=args.levels, repeat=args.repeat, n_queries=args.queries)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    failures = check(report, baseline, args.tolerance, limits)
+    for msg in failures:
+        print(f"CHẬM: {msg}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+import os
+import cv2
+import numpy as np
+import concurrent.futures
+
+# Kích thước ảnh tile sinh ra (lớn hơn size lớn nhất thường dùng -> luôn phải resize như ảnh thật)
+TILE_SIZE = 96
+
+# File đánh dấu thư mục tiles đã sinh đủ (tránh sinh lại ở lần chạy sau)
+_DONE_MARKER = ".synthetic_done"
+
+def _make_tile(rng: np.random.Generator, size: int) -> np.ndarray:
+    """1 ảnh tile giả: nền màu ngẫu nhiên + gradient + vài hình tròn + nhiễu (có cả màu lẫn vân)."""
+    base = rng.integers(0, 256, 3)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    grad = rng.uniform(-60, 60, (2, 3)).astype(np.float32)
+    img = base[None, None, :] + xx[..., None] * grad[0] + yy[..., None] * grad[1]
+
+    for _ in range(int(rng.integers(0, 4))):
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        color = tuple(float(v) for v in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(size // 10, size // 3)), color, -1)
+
+    img += rng.normal(0, rng.uniform(0, 25), img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+def _write_tiles(folder: str, start: int, count: int, size: int, seed: int):
+    rng = np.random.default_rng([seed, start])
+    for i in range(start, start + count):
+        cv2.imwrite(os.path.join(folder, f"tile_{i:06d}.jpg"), _make_tile(rng, size),
+                    [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+def make_tile_folder(folder: str, count: int, size: int = TILE_SIZE, seed: int = 0,
+                     workers: int = None) -> str:
+    """
+    Sinh thư mục `count` ảnh tile JPEG (tái lập được theo seed). Nếu thư mục đã sinh đủ thì dùng lại.
+    Ghi song song bằng process pool (mã hóa JPEG là phần tốn thời gian).
+    """
+    marker = os.path.join(folder, _DONE_MARKER)
+    if os.path.isfile(marker):
+        with open(marker, encoding="utf-8") as f:
+            if f.read().strip() == f"{count} {size} {seed}":
+                return folder
+
+    os.makedirs(folder, exist_ok=True)
+    chunk = 500
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_write_tiles, folder, s, min(chunk, count - s), size, seed)
+                   for s in range(0, count, chunk)]
+        for fut in futures:
+            fut.result()
+
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(f"{count} {size} {seed}")
+    return folder
+
+def make_target(megapixels: float, seed: int = 0, aspect: float = 4 / 3) -> np.ndarray:
+    """
+    Ảnh gốc giả (BGR) khoảng `megapixels` MP: nền biến thiên chậm (vùng phẳng -> ô lớn)
+    xen các mảng nhiễu chi tiết (-> Quadtree chia tới ô nhỏ nhất), giống ảnh chụp thực tế.
+    """
+    rng = np.random.default_rng(seed)
+    h = max(1, int(round(np.sqrt(megapixels * 1e6 / aspect))))
+    w = max(1, int(round(h * aspect)))
+
+    # Nền: lưới màu thô phóng to bằng nội suy bậc 3
+    coarse = rng.integers(0, 256, (12, 16, 3)).astype(np.uint8)
+    img = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+
+    # Vùng chi tiết: mặt nạ thô phóng to, nhiễu mạnh bên trong
+    mask = cv2.resize((rng.random((24, 32)) > 0.6).astype(np.uint8), (w, h),
+                      interpolation=cv2.INTER_NEAREST).astype(bool)
+    band = 1024
+    for y0 in range(0, h, band):
+        m = mask[y0:y0 + band]
+        noise = rng.integers(-60, 61, m.shape + (3,), dtype=np.int16)
+        part = img[y0:y0 + band].astype(np.int16)
+        part[m] += noise[m]
+        img[y0:y0 + band] = np.clip(part, 0, 255).astype(np.uint8)
+    return img
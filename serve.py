@@ -0,0 +1,46 @@
+import sys
+import argparse
+
+from algorithms.service import MosaicService, make_server, SERVICE_WORKERS, SERVICE_QUEUE
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Chạy dịch vụ ghép tranh cục bộ qua HTTP (kho tiles được giữ sẵn trong RAM giữa các job).")
+    parser.add_argument("--host", default="127.0.0.1", help="Địa chỉ nghe (mặc định chỉ máy cục bộ)")
+    parser.add_argument("--port", type=int, default=8765, help="Cổng TCP")
+    parser.add_argument("--unix-socket", default=None, help="Nghe trên Unix socket này thay cho TCP")
+    parser.add_argument("-j", "--workers", type=int, default=SERVICE_WORKERS, help="Số job ghép cùng lúc")
+    parser.add_argument("--queue", type=int, default=SERVICE_QUEUE, help="Số job chờ tối đa trong hàng đợi")
+    parser.add_argument("-o", "--out", default=None, help="Thư mục ghi kết quả ('out' của job phải nằm trong thư mục này)")
+    parser.add_argument("--warm", action="append", default=[],
+                        help="Nạp sẵn kho tiles này khi khởi động (lặp lại được)")
+    parser.add_argument("--tile-size", type=int, default=15, help="Kích thước ô nhỏ nhất khi nạp sẵn (--warm)")
+    parser.add_argument("--levels", type=int, default=3, help="Số level Quadtree khi nạp sẵn (--warm)")
+    parser.add_argument("--texture", action="store_true",
+                        help="Nạp sẵn (--warm) với đặc trưng vân cho các job gửi use_texture = true")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    service = MosaicService(workers=args.workers, max_queue=args.queue, output_dir=args.out)
+    for folder in args.warm:
+        print(f"Đang nạp sẵn kho tiles: {folder}", flush=True)
+        try:
+            service.warm(folder, args.tile_size, args.levels, use_texture=args.texture)
+        except Exception as e:
+            print(f"  LỖI: {e}", file=sys.stderr, flush=True)
+
+    server = make_server(service, args.host, args.port, args.unix_socket)
+    where = args.unix_socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"Dịch vụ ghép tranh đang chạy tại {where} (Ctrl+C để dừng)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,16 @@
+import os
+import pytest
+
+from algorithms.multiresolution import _list_image_files
+
+SUB_IMAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sub_images")
+
+@pytest.fixture(scope="session")
+def sub_images() -> str:
+    """Thư mục tiles mẫu đi kèm repo."""
+    return SUB_IMAGES
+
+@pytest.fixture(scope="session")
+def tile_files():
+    """Danh sách ảnh trong sub_images (thứ tự cố định)."""
+    return sorted(_list_image_files(SUB_IMAGES))
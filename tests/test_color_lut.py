@@ -0,0 +1,36 @@
+import pickle
+import numpy as np
+
+from algorithms.color_lut import ColorLUTIndex
+from algorithms.multiresolution import load_tile_levels
+
+def _brute(points: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    diff = queries[:, None, :].astype(np.float64) - points[None, :, :].astype(np.float64)
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+def _queries(n: int) -> np.ndarray:
+    return np.random.default_rng(3).uniform(0, 255, (n, 3)).astype(np.float32)
+
+def test_lut_matches_numpy_on_sub_images(tile_files):
+    features = load_tile_levels(tile_files, [10], lambda p, m: None)[10][1]
+    queries = _queries(5000)
+    ref = _brute(features, queries)
+    for lut in (ColorLUTIndex(features), ColorLUTIndex(features, bits=3, candidates=2)):
+        d, i = lut.query_batch(queries)
+        np.testing.assert_allclose(d, ref.min(axis=1), rtol=1e-4, atol=1e-3)
+        np.testing.assert_allclose(ref[np.arange(len(queries)), i], ref.min(axis=1), rtol=1e-4, atol=1e-3)
+
+        dk, _ = lut.query_k_batch(queries, 4)
+        np.testing.assert_allclose(dk, np.sort(ref, axis=1)[:, :4], rtol=1e-4, atol=1e-3)
+
+def test_tree_is_built_only_when_needed():
+    features = np.random.default_rng(4).uniform(0, 255, (300, 3)).astype(np.float32)
+    lut = ColorLUTIndex.from_arrays(features, ColorLUTIndex(features, candidates=300).to_arrays())
+    # Mọi tile là ứng viên -> mọi truy vấn trúng bảng, không cần cây
+    lut.query_batch(_queries(100))
+    assert lut._tree is None
+
+    copy = pickle.loads(pickle.dumps(lut))
+    assert copy._tree is None
+    copy.query_k_batch(_queries(10), 3)
+    assert copy._tree is not None
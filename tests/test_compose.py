@@ -0,0 +1,40 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+from algorithms.multiresolution import build_tiles_db, compose_mosaic, level_sizes
+from algorithms.sharded import ShardedTileLibrary
+from algorithms.metrics import MetricsRecorder
+
+TARGET = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main_img", "R.jpg")
+SIZES = level_sizes(10, 3)
+
+@pytest.fixture(scope="module")
+def target():
+    img = cv2.imread(TARGET)
+    return cv2.resize(img, (img.shape[1] // 3, img.shape[0] // 3), interpolation=cv2.INTER_AREA)
+
+@pytest.fixture(scope="module")
+def tiles_db(sub_images):
+    return build_tiles_db(sub_images, SIZES, use_cache=False)
+
+def _compose(target, tiles_db, workers, metrics=None):
+    return compose_mosaic(target, tiles_db, SIZES, lambda p, m: None, workers=workers, metrics=metrics)
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_parallel_compose_matches_sequential(target, tiles_db, workers):
+    mosaic, placements = _compose(target, tiles_db, 1)
+    metrics = MetricsRecorder(track_memory=False)
+    mosaic_p, placements_p = _compose(target, tiles_db, workers, metrics)
+    np.testing.assert_array_equal(mosaic_p, mosaic)
+    order = np.lexsort(placements.T[::-1])
+    order_p = np.lexsort(placements_p.T[::-1])
+    np.testing.assert_array_equal(placements_p[order_p], placements[order])
+    assert {"plan_quadtree", "matching", "compositing"} <= set(metrics.to_dict()["stages"])
+
+def test_sharded_compose_matches_unsharded(target, tiles_db, sub_images):
+    mosaic, _ = _compose(target, tiles_db, 1)
+    with ShardedTileLibrary(sub_images, SIZES, n_shards=3, use_cache=False) as lib:
+        mosaic_s, _ = _compose(target, lib.tiles_db(), 1)
+    np.testing.assert_array_equal(mosaic_s, mosaic)
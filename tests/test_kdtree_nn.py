@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from algorithms.kdtree_nn import KDTreeNearestNeighbor
+
+def _brute(points: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Ma trận khoảng cách (M, N) tính thẳng bằng NumPy (float64)."""
+    diff = queries[:, None, :].astype(np.float64) - points[None, :, :].astype(np.float64)
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+@pytest.mark.parametrize("dim", [3, 6])
+@pytest.mark.parametrize("backend,flat", [("tree", True), ("tree", False), ("brute", True), ("auto", True)])
+def test_backends_match_numpy(dim, backend, flat):
+    rng = np.random.default_rng(dim)
+    points = rng.uniform(0, 255, (500, dim)).astype(np.float32)
+    queries = rng.uniform(0, 255, (200, dim)).astype(np.float32)
+    ref = _brute(points, queries)
+    nn = KDTreeNearestNeighbor(points, flat=flat, backend=backend)
+
+    d, i = nn.query_batch(queries)
+    np.testing.assert_array_equal(i, ref.argmin(axis=1))
+    np.testing.assert_allclose(d, ref.min(axis=1), rtol=1e-4, atol=1e-3)
+    assert nn.query(queries[0]) == ref[0].argmin()
+
+    dk, ik = nn.query_k_batch(queries, 5)
+    np.testing.assert_allclose(dk, np.sort(ref, axis=1)[:, :5], rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(np.take_along_axis(ref, ik, axis=1), dk, rtol=1e-4, atol=1e-3)
+
+def test_auto_matches_tree_on_small_and_large_batches():
+    rng = np.random.default_rng(7)
+    points = rng.uniform(0, 255, (3000, 6)).astype(np.float32)
+    auto = KDTreeNearestNeighbor(points, backend="auto")
+    tree = KDTreeNearestNeighbor(points, backend="tree")
+    for m in (1, 10, 2000):
+        queries = rng.uniform(0, 255, (m, 6)).astype(np.float32)
+        np.testing.assert_array_equal(auto.query_batch(queries)[1], tree.query_batch(queries)[1])
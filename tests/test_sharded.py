@@ -0,0 +1,76 @@
+import os
+import shutil
+import cv2
+import numpy as np
+import pytest
+
+from algorithms.multiresolution import _list_image_files, load_tile_levels
+from algorithms.sharded import ShardedTileLibrary, partition_files
+
+SIZES = [20, 10]
+
+@pytest.fixture
+def tiles_folder(tmp_path, tile_files):
+    """Bản sao 60 ảnh đầu của sub_images (test được sửa / làm hỏng file)."""
+    folder = tmp_path / "tiles"
+    folder.mkdir()
+    for path in tile_files[:60]:
+        shutil.copy2(path, folder)
+    return str(folder)
+
+def _brute_k(points: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    d2 = ((queries[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    return np.sort(np.sqrt(d2), axis=1)[:, :k]
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_sharded_matches_unsharded(sub_images, tile_files, processes):
+    queries = np.random.default_rng(1).uniform(0, 255, (300, 3)).astype(np.float32)
+    flat = load_tile_levels(tile_files, SIZES, lambda p, m: None)
+    with ShardedTileLibrary(sub_images, SIZES, n_shards=4, use_cache=False, processes=processes) as lib:
+        db = lib.tiles_db()
+        for sz in SIZES:
+            tiles, index = db[sz]
+            assert len(tiles) == len(flat[sz][0])
+            d, i = index.query_batch(queries)
+            np.testing.assert_allclose(d, _brute_k(flat[sz][1], queries, 1)[:, 0], rtol=1e-5, atol=1e-4)
+            # Chỉ số toàn cục trỏ đúng tile có đặc trưng đó
+            np.testing.assert_allclose(np.sqrt(((index.colors[i] - queries) ** 2).sum(axis=1)), d,
+                                       rtol=1e-5, atol=1e-4)
+            assert tiles[i].shape == (len(queries), sz, sz, 3)
+
+            dk, _ = index.query_k_batch(queries, 7)
+            np.testing.assert_allclose(dk, _brute_k(flat[sz][1], queries, 7), rtol=1e-5, atol=1e-4)
+
+def test_empty_shard_is_skipped(tiles_folder):
+    files = _list_image_files(tiles_folder)
+    bad = partition_files(files, 4)[0]
+    assert bad
+    for path in bad:
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+
+    with ShardedTileLibrary(tiles_folder, SIZES, n_shards=4, use_cache=False) as lib:
+        assert len(lib) == len(files) - len(bad)
+        _, index = lib.tiles_db()[SIZES[0]]
+        assert index.query_batch(np.zeros((1, 3), dtype=np.float32))[1][0] < len(lib)
+
+    for path in files:
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+    with pytest.raises(Exception, match="Không tìm thấy ảnh hợp lệ"):
+        ShardedTileLibrary(tiles_folder, SIZES, n_shards=4, use_cache=False)
+
+def test_reshard_reloads_tile_edited_in_place(tiles_folder):
+    with ShardedTileLibrary(tiles_folder, SIZES, n_shards=4) as lib:
+        path = _list_image_files(tiles_folder)[0]
+        red = np.zeros((64, 64, 3), dtype=np.uint8)
+        red[..., 2] = 255
+        cv2.imwrite(path, red)
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+        lib.reshard(4)
+        tiles, index = lib.tiles_db()[10]
+        d, i = index.query_batch(np.array([[0, 0, 255]], dtype=np.float32))
+        assert d[0] < 3.0
+        assert (np.abs(tiles[int(i[0])].astype(int) - [0, 0, 255]) <= 3).all()
@@ -0,0 +1,28 @@
+import os
+import numpy as np
+
+from algorithms import multiresolution
+from algorithms.multiresolution import build_tiles_db, load_tile_levels, TEXTURE_WEIGHT
+
+SIZES = [20, 10]
+
+def test_use_texture_parameter_applies_to_every_level(sub_images, tmp_path):
+    assert multiresolution.USE_TEXTURE is False
+    for cache_dir in (None, str(tmp_path)):
+        db = build_tiles_db(sub_images, SIZES, use_cache=cache_dir is not None, cache_dir=cache_dir,
+                            use_texture=True)
+        assert all(db[sz][1].colors.shape[1] == 6 for sz in SIZES)
+        db = build_tiles_db(sub_images, SIZES, use_cache=cache_dir is not None, cache_dir=cache_dir)
+        assert all(db[sz][1].colors.shape[1] == 3 for sz in SIZES)
+
+    # Cache riêng cho đặc trưng 6 chiều, theo TEXTURE_WEIGHT
+    names = os.listdir(tmp_path)
+    assert any(name.endswith(f"_f6_w{TEXTURE_WEIGHT:g}.npz") for name in names)
+
+def test_cached_levels_match_fresh_decode(tile_files, tmp_path):
+    fresh = load_tile_levels(tile_files, SIZES, lambda p, m: None, use_texture=True)
+    load_tile_levels(tile_files, SIZES, lambda p, m: None, str(tmp_path), use_texture=True)
+    cached = load_tile_levels(tile_files, SIZES, lambda p, m: None, str(tmp_path), use_texture=True)
+    for sz in SIZES:
+        np.testing.assert_array_equal(np.asarray(cached[sz][0]), fresh[sz][0])
+        np.testing.assert_array_equal(cached[sz][1], fresh[sz][1])
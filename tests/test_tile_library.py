@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+
+from algorithms.tile_library import IncrementalIndex, TileLibrary
+
+SIZES = [20, 10]
+
+def _brute_d(points: np.ndarray, alive: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Khoảng cách tới điểm còn sống gần nhất, quét toàn bộ bằng NumPy."""
+    live = points[alive]
+    d2 = ((queries[:, None, :] - live[None, :, :]) ** 2).sum(axis=2)
+    return np.sqrt(d2.min(axis=1))
+
+def _check_live_only(lib: TileLibrary, queries_by_size):
+    """Mỗi level: số hàng sống = số ảnh, kết quả chỉ là hàng sống và khớp brute-force."""
+    db = lib.tiles_db()
+    live_rows = set(lib._row_of.values())
+    for sz in SIZES:
+        tiles, index = db[sz]
+        assert index.n_alive == len(lib)
+        assert len(tiles) == index.n
+        alive = np.zeros(index.n, dtype=bool)
+        alive[list(live_rows)] = True
+        d, i = index.query_batch(queries_by_size[sz])
+        assert set(i.tolist()) <= live_rows
+        np.testing.assert_allclose(d, _brute_d(index.colors, alive, queries_by_size[sz]), rtol=1e-5, atol=1e-4)
+
+@pytest.fixture
+def library(sub_images):
+    return TileLibrary(sub_images, SIZES, use_cache=False)
+
+def test_incremental_index_returns_only_live_rows():
+    rng = np.random.default_rng(0)
+    index = IncrementalIndex(rng.uniform(0, 255, (300, 3)))
+    index.add(rng.uniform(0, 255, (40, 3)))
+    index.remove(rng.choice(index.n, 60, replace=False))
+    queries = rng.uniform(0, 255, (200, 3)).astype(np.float32)
+    alive = index._alive[:index.n]
+
+    d, i = index.query_batch(queries)
+    assert alive[i].all()
+    np.testing.assert_allclose(d, _brute_d(index.colors, alive, queries), rtol=1e-5, atol=1e-4)
+
+    dk, ik = index.query_k_batch(queries, 5)
+    assert alive[ik].all()
+    live = index.colors[alive]
+    ref = np.sort(np.sqrt(((queries[:, None, :] - live[None, :, :]) ** 2).sum(axis=2)), axis=1)[:, :5]
+    np.testing.assert_allclose(dk, ref, rtol=1e-5, atol=1e-4)
+
+def test_add_duplicate_paths_then_remove(library, tile_files):
+    path = tile_files[0]
+    queries = {sz: library.tiles_db()[sz][1].colors[:50].copy() for sz in SIZES}
+    n = len(library)
+
+    assert library.add([path, path, os.path.join(os.path.dirname(path), ".", os.path.basename(path))]) == 1
+    assert len(library) == n
+    _check_live_only(library, queries)
+
+    assert library.remove([path]) == 1
+    assert path not in library
+    _check_live_only(library, queries)
+
+def test_snapshot_survives_add_remove_rebalance(library, tile_files):
+    before = library.tiles_db()
+    tiles, index = before[SIZES[0]]
+    queries = index.colors[:30].copy()
+    d0, i0 = index.query_batch(queries)
+
+    library.remove(tile_files[:60])
+    library.add(tile_files[:10])
+    library.rebalance()
+
+    d1, i1 = index.query_batch(queries)
+    np.testing.assert_array_equal(i0, i1)
+    np.testing.assert_array_equal(d0, d1)
+    assert i1.max() < len(tiles)
+    _check_live_only(library, {sz: library.tiles_db()[sz][1].colors[:30].copy() for sz in SIZES})
@@ -8,6 +8,9 @@ from PIL import Image, ImageTk
 
 # Import core thuật toán
 from algorithms.mosaic_core import MosaicGenerator
+from algorithms.multiresolution import level_sizes
+from algorithms.cancel import CancelToken, MosaicCancelled
+from algorithms.deepzoom import save_deepzoom
 
 # --- HÀM HỖ TRỢ HIỂN THỊ ẢNH ---
 def bgr_to_tk(img_bgr: np.ndarray, max_w=800, max_h=800) -> ImageTk.PhotoImage:
@@ -48,10 +51,14 @@ class App(tk.Tk):
         self.tile_size = tk.IntVar(value=15)
         self.levels = tk.IntVar(value=3)
         self.blend = tk.DoubleVar(value=0.2)
+        self.use_texture = tk.BooleanVar(value=False)
         
         self._current_img = None  # Lưu ảnh gốc
         self._result_img = None   # Lưu ảnh kết quả
         self._photo = None        # Giữ reference cho Tkinter khỏi bị garbage collect
+        self._prewarm_token = None # CancelToken của lần nạp trước kho tiles đang chạy nền
+        self._running = False     # Đang tạo tranh (run_mosaic)
+        self._generator = None    # MosaicGenerator đang chạy (để hủy)
 
         self._build_ui()
 
@@ -113,12 +120,18 @@ class App(tk.Tk):
         ttk.Label(grp_config, text="(Kéo cao để ảnh rõ nét hơn, thấp để nghệ thuật hơn)", 
                   font=("Arial", 8, "italic"), foreground="gray").pack(anchor="w")
 
+        # Checkbox: Khớp cả vân (đặc trưng 6 chiều màu + độ lệch chuẩn)
+        ttk.Checkbutton(grp_config, text="Khớp cả vân ảnh (texture)", variable=self.use_texture).pack(anchor="w", pady=(10, 0))
+
         # 4. Bước 3: Hành động
         grp_action = ttk.LabelFrame(left_frame, text="3. Thực Hiện", padding=10)
         grp_action.pack(fill="x", pady=5)
 
         self.btn_run = ttk.Button(grp_action, text="▶ BẮT ĐẦU TẠO TRANH", command=self.run_mosaic)
         self.btn_run.pack(fill="x", pady=5)
+
+        self.btn_cancel = ttk.Button(grp_action, text="■ Hủy", command=self.cancel_mosaic, state="disabled")
+        self.btn_cancel.pack(fill="x", pady=(0, 5))
         
         self.progress = ttk.Progressbar(grp_action, mode="determinate")
         self.progress.pack(fill="x", pady=5)
@@ -171,6 +184,47 @@ class App(tk.Tk):
             self.tiles_folder.set(folder)
             self.lbl_tiles_name.config(text=f"✔ .../{os.path.basename(folder)}", foreground="green")
             self.status.set("Đã chọn kho ảnh mẫu.")
+            self.prewarm_tiles(folder)
+
+    def prewarm_tiles(self, folder: str):
+        """
+        Nạp + dựng chỉ mục kho tiles ở thread nền ngay khi chọn thư mục (vào cache phiên dùng chung
+        của MosaicGenerator) -> bấm chạy chỉ còn tốn thời gian Quadtree + matching.
+        Chọn thư mục khác thì lần nạp cũ bị hủy; nút Hủy của lần tạo tranh đang chờ cũng hủy lần nạp này.
+        """
+        if self._prewarm_token is not None:
+            self._prewarm_token.cancel()
+        token = CancelToken()
+        self._prewarm_token = token
+
+        try:
+            sizes = level_sizes(int(self.tile_size.get()), int(self.levels.get()))
+        except ValueError:
+            return
+        texture = bool(self.use_texture.get())
+
+        def on_progress(p, msg):
+            # Lần tạo tranh bấm trong lúc nạp trước chờ trên khóa của phiên (chưa báo tiến độ gì)
+            # -> vẫn hiện tiến độ nạp để người dùng không thấy giao diện đứng yên
+            prefix = "Đang chờ nạp kho tiles" if self._running else "Nạp trước kho tiles"
+            self.after(0, lambda: self.progress.configure(value=float(p)))
+            self.after(0, lambda: self.status.set(f"{prefix} - {msg}"))
+
+        def prewarm_thread():
+            try:
+                MosaicGenerator.shared_session.tiles_db(folder, sizes, on_progress, cancel=token,
+                                                        use_texture=texture)
+                if not token.cancelled and not self._running:
+                    self.after(0, lambda: self.progress.configure(value=0))
+                    self.after(0, lambda: self.status.set("Kho tiles đã sẵn sàng."))
+            except MosaicCancelled:
+                pass
+            except Exception as e:
+                # Lỗi sẽ được báo lại khi bấm chạy (kho được nạp lại trong lần chạy đó)
+                if not token.cancelled and not self._running:
+                    self.after(0, lambda err=str(e): self.status.set(f"Chưa nạp được kho tiles: {err}"))
+
+        threading.Thread(target=prewarm_thread, daemon=True).start()
 
     def show_image(self, img_bgr: np.ndarray):
         # Lấy kích thước thực tế của khung hiển thị để resize cho vừa vặn
@@ -194,7 +248,10 @@ class App(tk.Tk):
             return
 
         # Khóa giao diện
+        # Nếu kho tiles đang được nạp trước ở nền, lần chạy này chờ trên khóa của cache phiên rồi dùng lại kết quả
+        self._running = True
         self.btn_run.config(state="disabled")
+        self.btn_cancel.config(state="normal")
         self.btn_save.config(state="disabled")
         self.progress["value"] = 0
         self.status.set("Đang khởi động thuật toán...")
@@ -203,28 +260,36 @@ class App(tk.Tk):
         t_size = int(self.tile_size.get())
         levs = int(self.levels.get())
         bl = float(self.blend.get())
+        texture = bool(self.use_texture.get())
 
         # Callbacks cập nhật UI từ Thread
         def on_progress(p, msg):
             self.after(0, lambda: self.progress.configure(value=float(p)))
             self.after(0, lambda: self.status.set(msg))
 
+        # Preview chỉ cần lớn bằng khung hiển thị -> pipeline gửi ảnh thu nhỏ, không phải ảnh đầy đủ
+        preview_side = max(self.preview_container.winfo_width(), self.preview_container.winfo_height(), 800)
+
         def on_frame(frame_img):
-            # Copy để tránh conflict memory khi đang render
+            # Copy để tránh conflict memory khi đang render (frame_img là ảnh preview nhỏ)
             show_img = frame_img.copy()
             self.after(0, lambda: self.show_image(show_img))
 
+        gen = MosaicGenerator(
+            target_path=target,
+            tiles_folder=tiles,
+            tile_size=t_size,
+            blend_factor=bl,
+            levels=levs,
+            frame_every=150, # Cập nhật preview mượt hơn
+            preview_max=preview_side,
+            use_texture=texture
+        )
+        self._generator = gen
+
         def worker_thread():
+            done_msg = "Đã xong."
             try:
-                gen = MosaicGenerator(
-                    target_path=target,
-                    tiles_folder=tiles,
-                    tile_size=t_size,
-                    blend_factor=bl,
-                    levels=levs,
-                    frame_every=150 # Cập nhật preview mượt hơn
-                )
-                
                 # Chạy thuật toán
                 final_img = gen.run(progress_callback=on_progress, frame_callback=on_frame)
                 
@@ -234,25 +299,47 @@ class App(tk.Tk):
                 self.after(0, lambda: self.btn_save.config(state="normal"))
                 self.after(0, lambda: messagebox.showinfo("Hoàn tất", "Đã tạo tranh Mosaic thành công!"))
                 
+            except MosaicCancelled:
+                done_msg = "Đã hủy."
             except Exception as e:
                 import traceback
                 traceback.print_exc()
                 self.after(0, lambda err=str(e): messagebox.showerror("Lỗi Runtime", f"Có lỗi xảy ra:\n{err}"))
             finally:
+                self._running = False
+                self._generator = None
                 self.after(0, lambda: self.btn_run.config(state="normal"))
-                self.after(0, lambda: self.status.set("Đã xong."))
+                self.after(0, lambda: self.btn_cancel.config(state="disabled"))
+                self.after(0, lambda: self.status.set(done_msg))
 
         threading.Thread(target=worker_thread, daemon=True).start()
 
+    def cancel_mosaic(self):
+        """Yêu cầu dừng lần tạo tranh đang chạy (dừng ở điểm kiểm tra kế tiếp)."""
+        # Lần chạy có thể đang chờ lần nạp trước kho tiles -> hủy luôn lần nạp đó để nhả khóa phiên
+        if self._prewarm_token is not None:
+            self._prewarm_token.cancel()
+        if self._generator is not None:
+            self._generator.cancel()
+            self.btn_cancel.config(state="disabled")
+            self.status.set("Đang hủy...")
+
     def save_as(self):
         if self._result_img is None:
             return
         path = filedialog.asksaveasfilename(
             title="Lưu tác phẩm",
             defaultextension=".jpg",
-            filetypes=[("JPG Image", "*.jpg"), ("PNG Image", "*.png")]
+            filetypes=[("JPG Image", "*.jpg"), ("PNG Image", "*.png"), ("Deep Zoom (DZI)", "*.dzi")]
         )
-        if path:
+        if path and path.lower().endswith(".dzi"):
+            # Ảnh rất lớn: lưu thành kim tự tháp ô (thư mục <tên>_files) thay vì 1 file ảnh
+            try:
+                save_deepzoom(self._result_img, path)
+                messagebox.showinfo("Đã lưu", f"Ảnh Deep Zoom đã được lưu tại:\n{path}")
+            except Exception as e:
+                messagebox.showerror("Lỗi", f"Không thể lưu file.\n{e}")
+        elif path:
             success, buf = cv2.imencode(os.path.splitext(path)[1], self._result_img)
             if success:
                 with open(path, "wb") as f:
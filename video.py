@@ -0,0 +1,57 @@
+import sys
+import argparse
+
+from algorithms.video import video_mosaic, VIDEO_TOLERANCE, VIDEO_FOURCC
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Tạo video Mosaic từ 1 video (không cần giao diện). "
+                    "Block không đổi giữa các frame giữ nguyên tile, chỉ vùng thay đổi được ghép lại.")
+    parser.add_argument("video", help="Video gốc")
+    parser.add_argument("-t", "--tiles", required=True, help="Thư mục kho ảnh ghép")
+    parser.add_argument("-o", "--out", required=True, help="File video kết quả (VD: out.mp4)")
+    parser.add_argument("--tile-size", type=int, default=15, help="Kích thước ô nhỏ nhất (px)")
+    parser.add_argument("--levels", type=int, default=3, help="Số level Quadtree")
+    parser.add_argument("--blend", type=float, default=0.2, help="Tỉ lệ pha trộn ảnh gốc (0..1)")
+    parser.add_argument("--tolerance", type=float, default=VIDEO_TOLERANCE,
+                        help="Độ lệch mean / std tối đa (0..255) để giữ tile của frame trước (0 = ghép lại mọi block đổi)")
+    parser.add_argument("--fourcc", default=VIDEO_FOURCC, help="Codec video kết quả (4 ký tự)")
+    parser.add_argument("--max-frames", type=int, default=None, help="Chỉ xử lý tối đa số frame này")
+    parser.add_argument("--index", default="kdtree", choices=["kdtree", "lut"],
+                        help="Chỉ mục tìm tile: KD-Tree hoặc bảng tra màu dựng sẵn (lut, được cache)")
+    parser.add_argument("--texture", action="store_true",
+                        help="Khớp cả vân (đặc trưng 6 chiều màu + độ lệch chuẩn), không dùng được với --index lut")
+    parser.add_argument("--no-cache", action="store_true", help="Không dùng cache tiles trên đĩa")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.texture and args.index == "lut":
+        print("--texture không dùng được với --index lut (bảng tra chỉ cho màu 3 chiều).", file=sys.stderr)
+        return 1
+    if len(args.fourcc) != 4:
+        print("--fourcc phải gồm đúng 4 ký tự.", file=sys.stderr)
+        return 1
+
+    def on_progress(p, msg):
+        if not msg.startswith("Loading") and not msg.startswith("Resizing"):
+            print(f"[{p:5.1f}%] {msg}", flush=True)
+
+    try:
+        stats = video_mosaic(args.video, args.tiles, args.out,
+                             base_tile=args.tile_size, levels=args.levels, blend_factor=args.blend,
+                             tolerance=args.tolerance, progress_callback=on_progress,
+                             use_cache=not args.no_cache, index=args.index, fourcc=args.fourcc,
+                             max_frames=args.max_frames, use_texture=args.texture)
+    except Exception as e:
+        print(f"LỖI: {e}", file=sys.stderr)
+        return 2
+
+    ratio = stats["requeried"] / max(1, stats["blocks"]) * 100
+    print(f"Hoàn tất {stats['frames']} frame trong {stats['elapsed_s']:.2f}s "
+          f"(ghép lại {ratio:.1f}% số block)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())